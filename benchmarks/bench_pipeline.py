@@ -0,0 +1,307 @@
+"""Benchmark the stages of the evaluation pipeline on synthetic data at several scales.
+
+Every stage is timed on inputs generated by synthetic_data.py (generation is
+not timed) and the results are written as JSON, so that two versions of the
+code can be compared with --compare.
+
+Usage: python benchmarks/bench_pipeline.py [--scales 1 10 100] [--out results.json] [--compare baseline.json]
+
+Stages whose dependencies are missing (e.g. espeak, mlconjug3, pydub), or whose
+input stages did not run successfully, are reported as skipped.
+"""
+import argparse
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+
+BENCHMARKS_DIRECTORY = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS_DIRECTORY.parent / 'scripts'))
+sys.path.insert(0, str(BENCHMARKS_DIRECTORY))
+
+import synthetic_data  # noqa: E402
+
+STAGES = ['create_sentences_files', 'find_word_candidates', 'word_pos_index_build', 'word_pos_index_query',
+          'build_tasks', 'ngram_lm', 'run_tasks', 'synthesize', 'synthesize_batched', 'zr_gold', 'zr_convert']
+# Synthesis and conversion write one audio file per sentence and voice: at larger
+# scales, they write millions of files.
+STAGE_MAX_SCALE = {'synthesize': 10, 'synthesize_batched': 10, 'zr_convert': 10}
+# Stages reading the outputs of other stages: they are skipped when one of these
+# did not run successfully at the same scale, so that partial data is never timed.
+STAGE_DEPENDENCIES = {'word_pos_index_query': ['word_pos_index_build'],
+                      'run_tasks': ['build_tasks', 'ngram_lm'],
+                      'synthesize': ['build_tasks'],
+                      'synthesize_batched': ['build_tasks'],
+                      'zr_gold': ['build_tasks'],
+                      'zr_convert': ['synthesize', 'zr_gold']}
+VOICES = ['en-US-Wavenet-A', 'en-US-Wavenet-C']
+# Sentences per request of the batched synthesis.
+SYNTHESIS_BATCH_SIZE = 50
+
+
+class Timer:
+    """Context manager measuring the wall time of the timed part of a stage."""
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.start
+
+
+def scaled_task_classes(scale):
+    """The task classes of build_tasks.py, with an outer word list `scale` times longer."""
+    from tasks.part_of_speech import AdjsNounsOrderTask, NounsVerbsOrderTask
+    from tasks.anaphor_agreement import AnaphorGenderAgreementTask, AnaphorNumberAgreementTask
+    from tasks.determiner_noun_agreement import DeterminerNounAgreementTask
+    from tasks.noun_verb_agreement import NounVerbAgreementTask
+    tasks = [('adj_noun_order', AdjsNounsOrderTask, 'n_adjs'),
+             ('noun_verb_order', NounsVerbsOrderTask, 'n_verbs'),
+             ('anaphor_gender_agreement', AnaphorGenderAgreementTask, 'n_verbs'),
+             ('anaphor_number_agreement', AnaphorNumberAgreementTask, 'n_verbs'),
+             ('determiner_noun_agreement', DeterminerNounAgreementTask, 'n_adjs'),
+             ('noun_verb_agreement', NounVerbAgreementTask, 'n_verbs')]
+    for name, task_class, attribute in tasks:
+        def init_words(self, task_class=task_class, attribute=attribute):
+            task_class.init_words(self)
+            setattr(self, attribute, getattr(self, attribute) * scale)
+        yield name, type('Scaled' + task_class.__name__, (task_class,), {'init_words': init_words})
+
+
+class PipelineBenchmark:
+    """Runs the stages at one scale, in a working directory, passing outputs from stage to stage."""
+    def __init__(self, workdir, scale, seed):
+        self.workdir = Path(workdir)
+        self.scale = scale
+        self.rng = np.random.default_rng(seed)
+        self.vocabulary = synthetic_data.make_words(5000, self.rng)
+        self.tasks_folder = self.workdir / 'tasks'
+        self.model_path = None
+        self.gold = None
+
+    def create_sentences_files(self):
+        from create_training_files import create_sentences_files
+        n_utterances = synthetic_data.BASE_SIZES['providence_utterances'] * self.scale
+        synthetic_data.write_providence_csvs(self.workdir / 'providence', n_utterances, self.rng, self.vocabulary)
+        with Timer() as timer:
+            create_sentences_files(self.workdir / 'providence', self.workdir / 'tokenized')
+        return timer.seconds, n_utterances
+
+    def _childes_sentences(self):
+        path = self.workdir / 'transcripts' / 'sentences.csv'
+        if not path.exists():
+            n_utterances = synthetic_data.BASE_SIZES['childes_utterances'] * self.scale
+            synthetic_data.write_childes_sentences(path, n_utterances, self.rng, self.vocabulary)
+        return path, synthetic_data.BASE_SIZES['childes_utterances'] * self.scale
+
+    def find_word_candidates(self):
+        import find_word_candidates
+        path, n_utterances = self._childes_sentences()
+        with Timer() as timer:
+            find_word_candidates.main(['--input', str(path), '--out', str(self.workdir / 'candidates')])
+        return timer.seconds, n_utterances
+
+    def word_pos_index_build(self):
+        from word_pos_index import build_index
+        path, n_utterances = self._childes_sentences()
+        with Timer() as timer:
+            build_index(path, self.workdir / 'transcripts' / 'index.sqlite')
+        return timer.seconds, n_utterances
+
+    def word_pos_index_query(self):
+        import find_word_candidates
+        path, _ = self._childes_sentences()
+        index_path = self.workdir / 'transcripts' / 'index.sqlite'
+        if not index_path.exists():
+            self.word_pos_index_build()
+        with Timer() as timer:
+            find_word_candidates.main(['--input', str(path), '--out', str(self.workdir / 'candidates'),
+                                       '--index', str(index_path), '--verb_threshold', '0.5'])
+        # Items: the three candidate queries.
+        return timer.seconds, 3
+
+    def build_tasks(self):
+        words_folder = self.workdir / 'word_candidates'
+        self.vocabulary += synthetic_data.write_word_candidates(words_folder, self.scale, self.rng)
+        n_pairs, seconds, failures = 0, 0.0, []
+        for name, task_class in scaled_task_classes(self.scale):
+            try:
+                with Timer() as timer:
+                    task = task_class(words_folder, self.tasks_folder / (name + '.csv'))
+                    task.generate_all()
+                    task.write()
+            except ImportError as error:
+                failures.append('%s (%s)' % (name, error))
+                continue
+            seconds += timer.seconds
+            n_pairs += len(task.pairs)
+        if failures:
+            print('Tasks not built: ' + ', '.join(failures))
+        return seconds, n_pairs
+
+    def ngram_lm(self):
+        from models.ngram_lm import train_compiled_model
+        n_utterances = synthetic_data.BASE_SIZES['training_utterances'] * self.scale
+        train_file = self.workdir / 'training' / 'orthographic_words.txt'
+        synthetic_data.write_training_file(train_file, n_utterances, self.rng, self.vocabulary)
+        with Timer() as timer:
+            self.model_path = train_compiled_model(train_file, 5, 'kneser_ney', 0.4, 1e-6,
+                                                   self.workdir / 'trained', 'fivegram', 5_000_000, None)
+        return timer.seconds, n_utterances
+
+    def run_tasks(self):
+        import run_tasks
+        from models.ngram_store import CompiledNGramModel
+        if self.model_path is None:
+            raise RuntimeError('the ngram_lm stage must run first')
+        model = CompiledNGramModel(self.model_path)
+        with Timer() as timer:
+            scores = run_tasks.score_models(self.tasks_folder, [('fivegram', model, 'orthographic_words')])
+        return timer.seconds, sum(len(real) for real, _ in scores.values())
+
+    def synthesize(self):
+        from fake_tts import synthesize_tasks
+        with Timer() as timer:
+            n_files, _ = synthesize_tasks(self.tasks_folder, self.workdir / 'synth' / 'audio', VOICES)
+        return timer.seconds, n_files
+
+    def synthesize_batched(self):
+        from fake_tts import synthesize_tasks
+        with Timer() as timer:
+            n_files, _ = synthesize_tasks(self.tasks_folder, self.workdir / 'synth_batched' / 'audio', VOICES,
+                                          batch_size=SYNTHESIS_BATCH_SIZE)
+        return timer.seconds, n_files
+
+    def zr_gold(self):
+        from zr_format import get_gold, split_dev_test
+        import pandas as pd
+        subtasks = sorted(path.stem for path in self.tasks_folder.glob('*.csv'))
+        sizes = [len(pd.read_csv(self.tasks_folder / (subtask + '.csv'), header=None, sep='\t'))
+                 for subtask in subtasks]
+        with Timer() as timer:
+            gold = get_gold(self.tasks_folder, subtasks, VOICES)
+            self.gold = split_dev_test(gold, sizes, 0.2, VOICES[1:])
+        return timer.seconds, len(gold)
+
+    def zr_convert(self):
+        from zr_format import convert_files
+        if shutil.which('ffmpeg') is None:
+            raise ImportError('ffmpeg is not installed')
+        if self.gold is None:
+            self.zr_gold()
+        out_folder = self.workdir / 'zr_format'
+        (out_folder / 'dev').mkdir(parents=True, exist_ok=True)
+        (out_folder / 'test').mkdir(parents=True, exist_ok=True)
+        dev_gold, test_gold = self.gold
+        with Timer() as timer:
+            convert_files(dev_gold, self.workdir / 'synth' / 'audio', out_folder / 'dev')
+            convert_files(test_gold, self.workdir / 'synth' / 'audio', out_folder / 'test')
+        return timer.seconds, len(dev_gold) + len(test_gold)
+
+
+def git_commit():
+    """The commit of the benchmarked code, if available."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_DIRECTORY,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Print the time ratio of each (stage, scale) with respect to a baseline JSON file."""
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    reference = {(entry['stage'], entry['scale']): entry for entry in baseline['results']
+                 if entry['status'] == 'ok'}
+    print('\nComparison with %s (commit %s):' % (baseline_path, baseline.get('commit')))
+    for entry in results:
+        key = (entry['stage'], entry['scale'])
+        if entry['status'] != 'ok' or key not in reference:
+            continue
+        ratio = entry['seconds'] / max(reference[key]['seconds'], 1e-9)
+        print('%-25s %4dx  %8.3fs -> %8.3fs  (%.2fx)' % (key[0], key[1], reference[key]['seconds'],
+                                                         entry['seconds'], ratio))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='This script benchmarks the stages of the pipeline on '
+                                                 'synthetic data.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+                        help='Scales of the synthetic data, relative to the current sizes.')
+    parser.add_argument('--stages', type=str, nargs='+', choices=STAGES, default=STAGES,
+                        help='Stages to benchmark (default to all).')
+    parser.add_argument('--no_scale_limits', action='store_true',
+                        help='Also run synthesis and conversion above scale %d.' % max(STAGE_MAX_SCALE.values()))
+    parser.add_argument('--seed', type=int, default=42,
+                        help='Random seed of the synthetic data.')
+    parser.add_argument('--workdir', type=str, default=None,
+                        help='Where the synthetic data is generated (default to a temporary directory, '
+                             'removed at the end).')
+    parser.add_argument('--out', type=str, default=None,
+                        help='Where to store the results (default to benchmarks/results/pipeline_<commit>.json).')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='A previous results file to compare with.')
+    args = parser.parse_args(argv)
+
+    commit = git_commit()
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix='cdsyn_bench_'))
+    results = []
+    try:
+        for scale in args.scales:
+            benchmark = PipelineBenchmark(workdir / ('scale_%d' % scale), scale, args.seed)
+            statuses = {}
+            for stage in STAGES:
+                if stage not in args.stages:
+                    continue
+                entry = {'stage': stage, 'scale': scale, 'status': 'ok',
+                         'seconds': None, 'items': None, 'items_per_second': None}
+                missing = [dependency for dependency in STAGE_DEPENDENCIES.get(stage, [])
+                           if statuses.get(dependency, 'not run') != 'ok']
+                if not args.no_scale_limits and scale > STAGE_MAX_SCALE.get(stage, scale):
+                    entry['status'] = 'skipped: scale limit'
+                elif missing:
+                    entry['status'] = 'skipped: %s did not run successfully' % ', '.join(missing)
+                else:
+                    try:
+                        seconds, items = getattr(benchmark, stage)()
+                        entry.update(seconds=seconds, items=items, items_per_second=items / max(seconds, 1e-9))
+                    except ImportError as error:
+                        entry['status'] = 'skipped: %s' % error
+                    except Exception as error:
+                        entry['status'] = 'failed: %r' % error
+                statuses[stage] = entry['status']
+                results.append(entry)
+                if entry['status'] == 'ok':
+                    print('%-25s %4dx  %8.3fs  %12.1f items/s' % (stage, scale, entry['seconds'],
+                                                                   entry['items_per_second']))
+                else:
+                    print('%-25s %4dx  %s' % (stage, scale, entry['status']))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    out = Path(args.out or BENCHMARKS_DIRECTORY / 'results' / ('pipeline_%s.json' % (commit or 'unknown')))
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, 'w') as out_file:
+        json.dump({'commit': commit,
+                   'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'seed': args.seed,
+                   'base_sizes': synthetic_data.BASE_SIZES,
+                   'results': results}, out_file, indent=2)
+    print('Results written to %s' % out)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    args = sys.argv[1:]
+    main(args)
@@ -0,0 +1,85 @@
+"""Measure the startup time of the entry points of the scripts.
+
+Each entry point is started with `--help` in a fresh interpreter, so the\
+measured time covers the interpreter start, the module level imports and\
+the argument parsing, but no actual work.
+
+Usage: python benchmarks/bench_startup.py [--repeat 5] [--out startup.json]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+SCRIPTS_DIRECTORY = Path(__file__).resolve().parent.parent / "scripts"
+
+# (name, command run from the scripts directory)
+ENTRY_POINTS = [
+    ("python", ["-c", "pass"]),
+    ("build_tasks", ["build_tasks.py", "--help"]),
+    ("run_tasks", ["run_tasks.py", "--help"]),
+    ("create_training_files", ["create_training_files.py", "--help"]),
+    ("analyze_scores", ["analyze_scores.py", "--help"]),
+    ("synthesize_sentences", ["synthesize_sentences.py", "--help"]),
+    ("find_word_candidates", ["find_word_candidates.py", "--help"]),
+    ("zr_format", ["zr_format.py", "--help"]),
+    ("download_transcript", ["download_transcript.py", "--help"]),
+    ("download_providence_csvs", ["download_providence_csvs.py", "--help"]),
+    ("ngram_lm", ["models/ngram_lm.py", "--help"]),
+    ("neural_ngram_lm", ["models/neural_ngram_lm.py", "--help"]),
+    ("lstm_lm", ["models/lstm_lm.py", "--help"]),
+    ("import preprocessing_tools", ["-c", "import preprocessing_tools"]),
+    ("import tasks.anaphor_agreement", ["-c", "import tasks.anaphor_agreement"]),
+    ("import tasks.synthetizer", ["-c", "import tasks.synthetizer"]),
+]
+
+
+def time_command(command, repeat):
+    """Run a command `repeat` times and return its wall times and its last return code."""
+    times = []
+    returncode = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable] + command,
+                                   cwd=SCRIPTS_DIRECTORY,
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+        returncode = completed.returncode
+    return times, returncode
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='This script measures the startup time of the entry points.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of runs of each entry point.')
+    parser.add_argument('--only', type=str, nargs='+', default=None,
+                        help='Names of the entry points to measure (default to all).')
+    parser.add_argument('--out', type=str, default=None,
+                        help='Where to store the results as JSON.')
+    args = parser.parse_args(argv)
+
+    results = []
+    for name, command in ENTRY_POINTS:
+        if args.only and name not in args.only:
+            continue
+        times, returncode = time_command(command, args.repeat)
+        results.append({'entry_point': name,
+                        'median_seconds': statistics.median(times),
+                        'min_seconds': min(times),
+                        'returncode': returncode})
+        # A non-zero return code usually means that a dependency is missing.
+        status = '' if returncode == 0 else f'  (exit code {returncode})'
+        print(f'{name:35s} median {statistics.median(times):6.3f}s  min {min(times):6.3f}s{status}')
+    if args.out:
+        with open(args.out, 'w') as out_file:
+            json.dump(results, out_file, indent=2)
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    args = sys.argv[1:]
+    main(args)
@@ -0,0 +1,128 @@
+"""Local stand-in for the Google Text-to-Speech synthesizer.
+
+FakeSynthesizer has the interface of tasks.synthetizer.GoogleSpeakSynthesizer
+but returns a precomputed audio clip after a fixed latency, so that the
+synthesis stage (rate limiting, concurrency and file writing) can be timed
+without credentials, network or cost. Batched SSML requests are answered
+like the v1beta1 API: synthetic WAV audio (a tone per sentence, silence for
+the breaks) with the time of each <mark>.
+"""
+import asyncio
+import io
+import wave
+from pathlib import Path
+from xml.etree import ElementTree
+import numpy as np
+from tasks.synthetizer import BaseCorporaSynthesisTask, GoogleSpeakSynthesizer
+
+FRAME_RATE = 24000
+# Duration of the synthetic speech of each character of a sentence.
+SECONDS_PER_CHARACTER = 0.06
+# A 220Hz tone, cut to the duration of each text.
+TONE = (0.3 * np.sin(2 * np.pi * 220 * np.arange(30 * FRAME_RATE) / FRAME_RATE) * 32767).astype(np.int16)
+
+
+def silent_ogg(duration_ms=500):
+    """An ogg clip of silence if pydub and ffmpeg are available, placeholder bytes otherwise."""
+    try:
+        from pydub import AudioSegment
+        buffer = io.BytesIO()
+        AudioSegment.silent(duration=duration_ms, frame_rate=24000).export(buffer, format='ogg')
+        return buffer.getvalue()
+    except Exception:
+        return b'OggS' + bytes(1024)
+
+
+def synthetic_speech(ssml, frame_rate=FRAME_RATE):
+    """
+    Render an SSML input as 16-bit mono WAV audio: a tone for each text, of
+    SECONDS_PER_CHARACTER per character, and silence for each <break>.
+
+    Return
+    ------
+    - tuple:
+        The WAV bytes and the (mark name, time in seconds) of each <mark>.
+    """
+    chunks, timepoints, n_frames = [], [], 0
+
+    def add_text(text):
+        nonlocal n_frames
+        chunks.append(TONE[:int(len(text.strip()) * SECONDS_PER_CHARACTER * frame_rate)])
+        n_frames += len(chunks[-1])
+
+    root = ElementTree.fromstring(ssml)
+    if root.text:
+        add_text(root.text)
+    for element in root:
+        if element.tag == 'mark':
+            timepoints.append((element.get('name'), n_frames / frame_rate))
+        elif element.tag == 'break':
+            chunks.append(np.zeros(int(float(element.get('time')[:-2]) / 1000 * frame_rate), dtype=np.int16))
+            n_frames += len(chunks[-1])
+        if element.tail:
+            add_text(element.tail)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as audio:
+        audio.setnchannels(1)
+        audio.setsampwidth(2)
+        audio.setframerate(frame_rate)
+        audio.writeframes(np.concatenate(chunks + [np.zeros(0, dtype=np.int16)]).tobytes())
+    return buffer.getvalue(), timepoints
+
+
+class FakeSynthesizer(GoogleSpeakSynthesizer):
+    WAVENET_VOICE_PRICE_PER_CHAR = 0.0
+
+    def __init__(self, voice_id, audio_bytes, latency=0.0):
+        self.voice_id = voice_id
+        self.audio_bytes = audio_bytes
+        self.latency = latency
+        self.requests = 0
+
+    def estimate_price(self, sentences):
+        return 0.0
+
+    async def synth_text(self, text):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.audio_bytes, text
+
+    async def synth_ssml(self, ssml):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return synthetic_speech(ssml)
+
+
+class FakeCorporaSynthesisTask(BaseCorporaSynthesisTask):
+    """The synthesis of synthesize_sentences.py, with fake synthesizers and without request quotas."""
+    MAX_REQUEST_PER_SECOND = 10 ** 6
+    MAX_CONCURRENT_REQUEST = 64
+
+    def __init__(self, voices, latency=0.0, batch_size=None):
+        super().__init__(no_confirmation=True, batch_size=batch_size)
+        audio_bytes = silent_ogg()
+        self.synthesizers = [FakeSynthesizer(voice, audio_bytes, latency) for voice in voices]
+
+    def init_synthesizers(self, credentials_path):
+        return self.synthesizers
+
+
+def synthesize_tasks(tasks_folder, audio_folder, voices, latency=0.0, batch_size=None):
+    """
+    Synthesize every task of a folder, in the layout of synthesize_sentences.py
+    (<audio_folder>/<task>/<voice>/<sentence>.ogg, or .wav with batch_size).
+
+    Return
+    ------
+    - tuple:
+        The number of synthesized files and of requests.
+    """
+    n_files, n_requests = 0, 0
+    for task_file in sorted(Path(tasks_folder).glob('*.csv')):
+        synthesizer = FakeCorporaSynthesisTask(voices, latency, batch_size)
+        synthesizer.run(task_file, Path(audio_folder) / task_file.stem, None, False)
+        n_files += sum(1 for path in (Path(audio_folder) / task_file.stem).rglob('*') if path.is_file())
+        n_requests += sum(synth.requests for synth in synthesizer.synthesizers)
+    return n_files, n_requests
@@ -0,0 +1,117 @@
+"""Synthetic inputs of the pipeline, at any scale.
+
+At scale 1, the word candidates and the task sets have the sizes of the
+current ones (10 800 pairs over 6 tasks), and the corpora have the sizes
+given in BASE_SIZES. Everything is generated from a seed, so two versions of
+the code are benchmarked on the same data.
+"""
+import itertools
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+BASE_SIZES = {
+    # Adult utterances of the Providence csvs (create_training_files.py).
+    'providence_utterances': 20000,
+    # Utterances of the CHILDES sentences.csv (find_word_candidates.py).
+    'childes_utterances': 50000,
+    # Utterances of the tokenized training file (ngram_lm.py).
+    'training_utterances': 20000,
+}
+
+ONSETS = ['b', 'd', 'f', 'g', 'k', 'l', 'm', 'n', 'p', 'r', 's', 't', 'v', 'w', 'z', 'sh', 'ch', 'br', 'st', 'pl']
+VOWELS = ['a', 'e', 'i', 'o', 'u', 'ee', 'oo', 'ai']
+CODAS = ['', '', 'n', 'm', 't', 'k', 'p', 'l', 'r']
+POS_TAGS = ['n', 'v', 'adj', 'det:art', 'pro:sub', 'adv', 'prep', 'co', 'n:prop', 'aux']
+# Words that pandas reads back as NaN (default na_values): the onsets, vowels
+# and codas can spell "nan".
+NA_WORDS = {'nan', 'null', 'none', 'na', 'n/a'}
+
+
+def make_words(n, rng, exclude=()):
+    """Generate n distinct pronounceable lowercase words, none of which pandas reads as NaN."""
+    words, seen = [], set(exclude) | NA_WORDS
+    while len(words) < n:
+        n_syllables = rng.integers(1, 4)
+        word = ''.join(rng.choice(ONSETS) + rng.choice(VOWELS) + rng.choice(CODAS) for _ in range(n_syllables))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def zipf_sentences(vocabulary, n_sentences, rng, max_length=10):
+    """Draw sentences whose words follow a Zipf-like distribution over the vocabulary."""
+    probabilities = 1.0 / np.arange(1, len(vocabulary) + 1)
+    probabilities /= probabilities.sum()
+    lengths = rng.integers(1, max_length + 1, size=n_sentences)
+    word_ids = rng.choice(len(vocabulary), size=lengths.sum(), p=probabilities)
+    vocabulary = np.asarray(vocabulary)
+    boundaries = np.cumsum(lengths)[:-1]
+    return [' '.join(vocabulary[ids]) for ids in np.split(word_ids, boundaries)]
+
+
+def write_providence_csvs(directory, n_utterances, rng, vocabulary):
+    """Write csv files of utterances of six children, in the format of download_providence_csvs.py."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    glosses = zipf_sentences(vocabulary, n_utterances, rng)
+    roles = rng.choice(['Mother', 'Father', 'Target_Child', 'Investigator'], size=n_utterances, p=[.5, .2, .25, .05])
+    for child, indices in zip(['Alex', 'Ethan', 'Lily', 'Naima', 'Violet', 'William'],
+                              np.array_split(np.arange(n_utterances), 6)):
+        pd.DataFrame({'speaker_role': roles[indices],
+                      'gloss': [glosses[idx] for idx in indices]}).to_csv(directory / (child + '.csv'))
+
+
+def write_childes_sentences(path, n_utterances, rng, vocabulary):
+    """Write a sentences.csv with stems, POS tags and speaker roles, as download_transcript.py."""
+    tags = {word: rng.choice(POS_TAGS, size=rng.integers(1, 3), replace=False) for word in vocabulary}
+    stems = zipf_sentences(vocabulary, n_utterances, rng)
+    part_of_speech = [' '.join(rng.choice(tags[word]) for word in stem.split(' ')) for stem in stems]
+    roles = rng.choice(['Mother', 'Father', 'Target_Child', 'Media'], size=n_utterances, p=[.5, .2, .28, .02])
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame({'stem': stems,
+                  'part_of_speech': part_of_speech,
+                  'speaker_role': roles,
+                  'gloss': stems}).to_csv(path, index=False)
+
+
+def write_word_candidates(directory, scale, rng):
+    """
+    Write the word candidate files read by build_tasks.py. The word lists looped over
+    in the outer loop of each task are scale times longer than the ones used today, so
+    that every task set is scale times larger.
+
+    Return
+    ------
+    - list:
+        All the words of the candidates.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    words = iter(make_words(50 * scale * 3 + 40 * scale * 2 + 200, rng))
+    take = lambda n: list(itertools.islice(words, n))
+    adjs, verbs_intransitive = take(40 * scale), take(40 * scale)
+    verbs_reflexive, verbs = take(50 * scale), take(10 * scale)
+    nouns_animate, nouns_gendered = take(40), take(10)
+    pd.DataFrame({'word': adjs}).to_csv(directory / 'adjs.csv', index=False)
+    pd.DataFrame({'word': nouns_animate}).to_csv(directory / 'nouns_animate.csv', index=False)
+    pd.DataFrame({'word': verbs_intransitive}).to_csv(directory / 'verbs_intransitive.csv', index=False)
+    pd.DataFrame({'word': verbs_reflexive}).to_csv(directory / 'verbs_reflexive.csv', index=False)
+    pd.DataFrame({'word': verbs}).to_csv(directory / 'verbs_noun_verb_agreement.csv', index=False)
+    # Consecutive nouns are the male/female equivalents of each other.
+    pd.DataFrame({'word': nouns_gendered,
+                  'gender': ['M', 'F'] * (len(nouns_gendered) // 2),
+                  'equiv': [idx ^ 1 for idx in range(len(nouns_gendered))],
+                  'plural': [noun + 's' for noun in nouns_gendered]}).to_csv(directory / 'nouns_gendered.csv',
+                                                                            index=False)
+    return adjs + verbs_intransitive + verbs_reflexive + verbs + nouns_animate + nouns_gendered \
+        + [noun + 's' for noun in nouns_gendered]
+
+
+def write_training_file(path, n_utterances, rng, vocabulary):
+    """Write a tokenized orthographic training file, one utterance per line."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as training_file:
+        for sentence in zipf_sentences(vocabulary, n_utterances, rng):
+            training_file.write(sentence + '\n')
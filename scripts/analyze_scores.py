@@ -0,0 +1,134 @@
+import argparse
+import sys
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from instrumentation import add_profiling_arguments, profiling, span
+
+# Number of consecutive pairs generated by each call to `generate_block`
+# (see the tasks module): pair i of a task belongs to subtype gr{i % size + 1}.
+PAIRS_PER_BLOCK = {'adj_noun_order': 1,
+                   'noun_verb_order': 1,
+                   'anaphor_gender_agreement': 2,
+                   'anaphor_number_agreement': 4,
+                   'determiner_noun_agreement': 4,
+                   'noun_verb_agreement': 4}
+
+
+def load_scores(path):
+    """Load the per-pair scores saved by run_tasks.py --save_scores as a DataFrame."""
+    scores = np.load(path)
+    data = pd.DataFrame({'model': pd.Categorical.from_codes(scores['model'], scores['model_names']),
+                         'task': pd.Categorical.from_codes(scores['task'], scores['task_names']),
+                         'pair': scores['pair'],
+                         'diff': scores['real_logprob'] - scores['modified_logprob']})
+    block_sizes = data['task'].map(PAIRS_PER_BLOCK).fillna(1).astype(np.int64)
+    data['subtype'] = 'gr' + (data['pair'] % block_sizes + 1).astype(str)
+    return data
+
+
+def bootstrap_accuracies(n_correct, n_pairs, n_bootstrap, confidence, rng):
+    """
+    Bootstrap confidence intervals of many accuracies at once.
+
+    Resampling n pairs with replacement among n pairs of which k are correct
+    gives a Binomial(n, k/n) number of correct pairs, so every group is
+    resampled with a single vectorized binomial draw.
+    """
+    n_correct = np.asarray(n_correct, dtype=np.float64)
+    n_pairs = np.asarray(n_pairs, dtype=np.int64)
+    samples = rng.binomial(n_pairs[:, None], (n_correct / n_pairs)[:, None],
+                           size=(len(n_pairs), n_bootstrap)) / n_pairs[:, None]
+    alpha = (1 - confidence) / 2
+    return np.quantile(samples, alpha, axis=1), np.quantile(samples, 1 - alpha, axis=1)
+
+
+def bootstrap_means(values, groups, n_groups, n_bootstrap, confidence, rng, chunk_bytes=1 << 26):
+    """
+    Bootstrap confidence intervals of the mean of values within each group,
+    resampling pairs within groups. Bootstrap replicates are drawn by chunks
+    of at most chunk_bytes per array, so that memory stays bounded.
+    """
+    order = np.argsort(groups, kind='stable')
+    values, groups = values[order], groups[order]
+    sizes = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    non_empty = np.flatnonzero(sizes)
+    # For every value slot, the first index and the size of its group.
+    index_type = np.int32 if len(values) < 2 ** 31 else np.int64
+    slot_starts = starts[groups].astype(index_type)
+    slot_sizes = sizes[groups].astype(np.float32)
+    slot_last = (sizes[groups] - 1).astype(index_type)
+    chunk_size = int(np.clip(chunk_bytes // (8 * max(len(values), 1)), 1, n_bootstrap))
+    means = np.zeros((n_groups, n_bootstrap))
+    for start in range(0, n_bootstrap, chunk_size):
+        n_samples = min(chunk_size, n_bootstrap - start)
+        # For every value slot, draw an index within the slot's group (float32
+        # draws are uniform enough for groups much smaller than 2 ** 24 pairs).
+        offsets = rng.random((n_samples, len(values)), dtype=np.float32)
+        np.multiply(offsets, slot_sizes, out=offsets)
+        indices = offsets.astype(index_type)
+        np.minimum(indices, slot_last, out=indices)
+        indices += slot_starts
+        # The groups are contiguous: the sums of a replicate are sums of slices.
+        sums = np.add.reduceat(values[indices], starts[non_empty], axis=1)
+        means[non_empty, start:start + n_samples] = (sums / sizes[non_empty]).T
+    alpha = (1 - confidence) / 2
+    return np.quantile(means, alpha, axis=1), np.quantile(means, 1 - alpha, axis=1)
+
+
+def summarize(data, n_bootstrap=10000, confidence=0.95, seed=42):
+    """
+    Compute, for each (model, task, subtype) and each (model, task) with
+    subtype 'all', the accuracy, the mean log-probability difference and their
+    bootstrap confidence intervals.
+    """
+    rng = np.random.default_rng(seed)
+    data = pd.concat([data, data.assign(subtype='all')], ignore_index=True)
+    data['correct'] = data['diff'] > 0
+    keys = ['model', 'task', 'subtype']
+    summary = data.groupby(keys, observed=True).agg(n=('correct', 'size'),
+                                                    n_correct=('correct', 'sum'),
+                                                    mean_diff=('diff', 'mean')).reset_index()
+    summary['accuracy'] = summary['n_correct'] / summary['n']
+    summary['accuracy_low'], summary['accuracy_high'] = bootstrap_accuracies(
+        summary['n_correct'].values, summary['n'].values, n_bootstrap, confidence, rng)
+    groups = data.groupby(keys, observed=True).ngroup().values
+    summary['mean_diff_low'], summary['mean_diff_high'] = bootstrap_means(
+        data['diff'].values, groups, len(summary), n_bootstrap, confidence, rng)
+    return summary.drop(columns='n_correct')
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='This script computes per-subtype accuracies and bootstrap '
+                                                 'confidence intervals from the per-pair scores saved by '
+                                                 'run_tasks.py --save_scores, without re-scoring.')
+    parser.add_argument('--scores', type=str, required=True,
+                        help='Path to a <out_filename>_scores.npz file.')
+    parser.add_argument('--out', type=str, default=None,
+                        help='Where to store the summary (default to <scores>_summary.csv).')
+    parser.add_argument('--n_bootstrap', type=int, default=10000,
+                        help='Number of bootstrap replicates.')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                        help='Confidence level of the intervals.')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='Random seed of the bootstrap.')
+    add_profiling_arguments(parser)
+    args = parser.parse_args(argv)
+    args.scores = Path(args.scores)
+    if args.out is None:
+        args.out = args.scores.with_name(args.scores.stem + '_summary.csv')
+
+    with profiling(args.profile, args.cprofile):
+        with span('load_scores'):
+            scores = load_scores(args.scores)
+        with span('summarize', items=len(scores)):
+            summary = summarize(scores, args.n_bootstrap, args.confidence, args.seed)
+        summary.to_csv(args.out, index=False)
+        print(summary[summary.subtype == 'all'].to_string(index=False))
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    args = sys.argv[1:]
+    main(args)
@@ -0,0 +1,157 @@
+"""Resumable, chunked downloads from the CHILDES database.
+
+A table is downloaded chunk by chunk (e.g. corpus by corpus): each chunk is
+fetched by a worker process and written to its own CSV file as soon as it is
+fetched. A chunk file only appears once it is complete, so it serves as a
+checkpoint: after a failure, running the download again only fetches the
+missing chunks. rpy2, used by childespy, is not thread-safe, hence processes.
+"""
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from pathlib import Path
+import pandas as pd
+from tqdm import tqdm
+from instrumentation import span
+
+
+def fetch_table(table, **filters):
+    """
+    Fetch a table of the CHILDES database with childespy
+    (e.g. `fetch_table('utterances', collection='Eng-NA', corpus='Brown')`).
+    """
+    # Imported here, in the worker processes: the parent process never starts R.
+    import childespy
+    return getattr(childespy, 'get_' + table)(**filters)
+
+
+def chunk_filename(name):
+    """Turn a chunk name (e.g. a corpus name) into a safe file name."""
+    return re.sub(r'[^\w.-]', '_', name) + '.csv'
+
+
+def _download_chunk(fetch, filters, chunk_path, index):
+    """Fetch a chunk and write it atomically to its checkpoint file."""
+    data = fetch(**filters)
+    tmp_path = chunk_path.with_name(chunk_path.name + '.tmp')
+    data.to_csv(tmp_path, index=index)
+    os.replace(tmp_path, chunk_path)
+    return len(data)
+
+
+def download_chunks(fetch, chunks, chunks_directory, workers=2, index=False):
+    """
+    Download the chunks that are not checkpointed yet, with a bounded pool of processes.
+
+    Parameters
+    ----------
+    - fetch: callable
+        Picklable function returning the DataFrame of a chunk from its filters
+        (e.g. `partial(fetch_table, 'utterances')`). A local stand-in can be given
+        instead of the CHILDES database.
+    - chunks: dict
+        Filters of each chunk, by chunk name, in the output order.
+    - chunks_directory: Path
+        Where the chunk files are stored.
+    - workers: int
+        Maximal number of concurrent fetches.
+    - index: bool
+        Whether the DataFrame index is written to the chunk files.
+
+    Return
+    ------
+    - list:
+        The paths of the chunk files, in the order of the chunks.
+    """
+    chunks_directory = Path(chunks_directory)
+    chunks_directory.mkdir(parents=True, exist_ok=True)
+    paths = {name: chunks_directory / chunk_filename(name) for name in chunks}
+    pending = [name for name in chunks if not paths[name].exists()]
+    if len(pending) < len(chunks):
+        print("%d/%d chunks already downloaded." % (len(chunks) - len(pending), len(chunks)))
+    failures = []
+    if pending:
+        with span('download_chunks', items=len(pending)), ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_download_chunk, fetch, chunks[name], paths[name], index): name
+                       for name in pending}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                try:
+                    future.result()
+                except Exception as error:
+                    failures.append(futures[future])
+                    print("Failed to download %s: %r" % (futures[future], error))
+    if failures:
+        raise RuntimeError("%d chunks could not be downloaded (%s). Run the download again to resume."
+                           % (len(failures), ', '.join(sorted(failures))))
+    return [paths[name] for name in chunks]
+
+
+def concatenate_csvs(paths, out_path):
+    """
+    Concatenate CSV files with the same header into a single CSV file, streaming
+    them from disk. The output only appears once it is complete. A ValueError is
+    raised if the headers of the files differ.
+    """
+    out_path = Path(out_path)
+    tmp_path = out_path.with_name(out_path.name + '.tmp')
+    try:
+        with open(tmp_path, 'wb') as out_file:
+            first_header = None
+            for path in paths:
+                with open(path, 'rb') as chunk_file:
+                    header = chunk_file.readline()
+                    if first_header is None:
+                        first_header = header
+                        out_file.write(header)
+                    elif header != first_header:
+                        raise ValueError("The header of %s differs from the one of %s."
+                                         % (path, paths[0]))
+                    shutil.copyfileobj(chunk_file, out_file, 1 << 20)
+    except Exception:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+    os.replace(tmp_path, out_path)
+
+
+def download_table(table, chunks, out_path, chunks_directory, workers=2, fetch=None, keep_chunks=False):
+    """
+    Download a table chunk by chunk and concatenate the chunks into `out_path`.
+    Nothing is downloaded if `out_path` already exists.
+
+    Parameters
+    ----------
+    - table: str
+        The name of the table (e.g. 'utterances').
+    - chunks: dict
+        Filters of each chunk, by chunk name.
+    - out_path: Path
+        The output CSV file.
+    - chunks_directory: Path
+        Where the chunks are checkpointed.
+    - workers: int
+        Maximal number of concurrent fetches.
+    - fetch: callable
+        Stand-in for `fetch_table` (called with the table, then the filters).
+    - keep_chunks: bool
+        Whether to keep the chunk files once concatenated.
+    """
+    out_path = Path(out_path)
+    if out_path.exists():
+        print("%s already exists, skipping." % out_path)
+        return
+    fetch = partial(fetch or fetch_table, table)
+    paths = download_chunks(fetch, chunks, chunks_directory, workers)
+    with span('concatenate'):
+        concatenate_csvs(paths, out_path)
+    if not keep_chunks:
+        shutil.rmtree(chunks_directory)
+
+
+def list_corpora(collection, chunks_directory, workers=1, fetch=None):
+    """List the corpora of a collection (the listing is itself checkpointed)."""
+    fetch = partial(fetch or fetch_table, 'corpora')
+    path, = download_chunks(fetch, {'corpora': {'collection': collection}}, chunks_directory, workers)
+    return list(pd.read_csv(path)['corpus_name'])
@@ -1,21 +1,62 @@
 """This module will create text files storing tokenized utterances."""
 
-from typing import List
+from typing import List, Tuple
 import pandas as pd
 from pathlib import Path
 from tqdm import tqdm
-from preprocessing_tools import clean_utterance, phonemization, \
+from preprocessing_tools import Cleaner, check_cleaner, phonemize_many, \
     phonemic_words_tokenization, phonemic_phonemes_tokenization, \
-    remove_multiple_spaces
+    remove_multiple_spaces, build_lexicon
+from models.corpus_files import ShardedWriter, COMPRESSIONS
+from instrumentation import add_profiling_arguments, profiling, span
+
+def read_adult_utterances(csv_file: Path, adults: List[str]) -> List[str]:
+    """Read the non-trivial utterances produced by the adults in a csv file."""
+    csv = pd.read_csv(csv_file)
+    adult_utterances = csv.loc[csv.speaker_role.isin(adults)]
+    return [utterance for utterance in adult_utterances["gloss"]
+            if utterance and isinstance(utterance, str) and len(utterance) != 1]
+
+def tokenize_batch(utterances: List[str]) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Phonemize a batch of cleaned utterances and produce its three tokenizations.
+
+    Return
+    ------
+    - tuple:
+        The orthographic words, the phonemic words and the phonemes lines.\
+        As before, an utterance whose phonemic words are empty is only kept\
+        in the orthographic file, and empty phonemes lines are skipped.
+    """
+    orthographic_words, phonemic_words, phonemes = [], [], []
+    with span("phonemize", items=len(utterances)) :
+        phonemized_utterances = phonemize_many(utterances)
+    for utterance, phonemized in zip(utterances, phonemized_utterances) :
+        orthographic_words.append(utterance)
+        words = remove_multiple_spaces(phonemic_words_tokenization(phonemized))
+        if not words :
+            continue
+        phonemic_words.append(words)
+        utterance_phonemes = remove_multiple_spaces(phonemic_phonemes_tokenization(phonemized))
+        if not utterance_phonemes :
+            continue
+        phonemes.append(utterance_phonemes)
+    return orthographic_words, phonemic_words, phonemes
 
 def create_sentences_files(csvs_directory: str,
                             out_directory: str,
-                            adults: List[str]=["Mother", "Father"]) -> None:
+                            adults: List[str]=["Mother", "Father"],
+                            compression: str=None,
+                            shard_size: int=None,
+                            batch_size: int=2000) -> None:
     """
     Create a text file containing all utterances\
     produced by all the adults (Mother and Father)\
     from all the six families of the providence corpus.
 
+    Utterances are cleaned, phonemized and written by batches,\
+    through large write buffers.
+
     Parameters
     ----------
     - csvs_directory : str
@@ -26,50 +67,65 @@ def create_sentences_files(csvs_directory: str,
         will be stored.
     - speaker_roles : list
         The speaker roles to be considered as adults
+    - compression: str
+        None, "gzip" or "zstd".
+    - shard_size: int
+        If given, the files are split in shards of this number of lines.
+    - batch_size: int
+        The number of utterances phonemized and written at once.
     """
     input_directory = Path(csvs_directory)
     output_directoty = Path(out_directory)
     output_directoty.mkdir(parents=True, exist_ok=True)
-    output_orthographic_words = open((output_directoty \
-        / Path("providence_orthographic_tokenized_in_words.txt")),
-                                        mode="w",
-                                        encoding="utf-8")
-    output_phonemic_words = open((output_directoty \
-        / Path("providence_phonemic_tokenized_in_words.txt")),
-                                    mode="w",
-                                    encoding="utf-8")
-    output_phonemic_phonemes = open((output_directoty \
-        / Path("providence_phonemic_tokenized_in_phonemes.txt")),
-                                    mode="w",
-                                    encoding="utf-8")
-    csv_files = list(input_directory.glob("*.csv"))
+    writers = [ShardedWriter(output_directoty / Path(filename), compression, shard_size)
+                for filename in ("providence_orthographic_tokenized_in_words.txt",
+                                    "providence_phonemic_tokenized_in_words.txt",
+                                    "providence_phonemic_tokenized_in_phonemes.txt")]
+    vocabulary = set()
+    csv_files = sorted(input_directory.glob("*.csv"))
     total_csv_files = len(csv_files)
+    cleaner = Cleaner(remove_punctuation=False)
     for csv_file in tqdm(csv_files, total=total_csv_files):
-        csv = pd.read_csv(csv_file)
-        adult_utterances = csv.loc[csv.speaker_role.isin(adults)]
-        for utterance in adult_utterances["gloss"] :
-            if not utterance or not isinstance(utterance, str): 
-                continue
-            if len(utterance) == 1:
-                continue
-            utterance = clean_utterance(utterance)
-            if not utterance:
-                continue
-            output_orthographic_words.write(f"{utterance}\n")
-            utterance = phonemization(utterance)
-            phonemic_words = phonemic_words_tokenization(utterance)
-            phonemic_words = remove_multiple_spaces(phonemic_words)
-            if not phonemic_words:
-                continue
-            output_phonemic_words.write(f"{phonemic_words}\n")
-            phonemes = phonemic_phonemes_tokenization(utterance)
-            phonemes = remove_multiple_spaces(phonemes)
-            if not phonemes:
-                continue
-            output_phonemic_phonemes.write(f"{phonemes}\n")
-    output_orthographic_words.close()
-    output_phonemic_words.close()
-    output_phonemic_phonemes.close()
+        with span("read_csv") as stage :
+            adult_utterances = read_adult_utterances(csv_file, adults)
+            stage.add(len(adult_utterances))
+        with span("clean", items=len(adult_utterances)) :
+            utterances = [utterance for utterance in cleaner.clean_many(adult_utterances) if utterance]
+        for start in range(0, len(utterances), batch_size) :
+            batch = utterances[start:start + batch_size]
+            tokenizations = tokenize_batch(batch)
+            with span("write", items=len(batch)) :
+                for writer, lines in zip(writers, tokenizations) :
+                    writer.write_lines(lines)
+            for utterance in batch :
+                vocabulary.update(utterance.split())
+    for writer in writers :
+        writer.close()
+    print("Building the phonemization lexicon...")
+    with span("lexicon", items=len(vocabulary)) :
+        build_lexicon(vocabulary, output_directoty / Path("providence_lexicon.tsv"))
+
+def check_cleaner_on_corpus(csvs_directory: str,
+                            adults: List[str]=["Mother", "Father"]) -> int:
+    """
+    Check `Cleaner.clean_many` against the original cleaning\
+    on all the adult utterances of the corpus, as cleaned for the training\
+    files (without punctuation removal) and for the evaluation (with it).
+
+    Return
+    ------
+    - int:
+        The number of utterances cleaned differently.
+    """
+    total_mismatches = 0
+    for csv_file in tqdm(list(Path(csvs_directory).glob("*.csv"))) :
+        utterances = read_adult_utterances(csv_file, adults)
+        for remove_punctuation in (False, True) :
+            for idx in check_cleaner(utterances, remove_punctuation=remove_punctuation) :
+                print(f"{csv_file.name}: {utterances[idx]!r}")
+                total_mismatches += 1
+    print(f"{total_mismatches} utterances cleaned differently.")
+    return total_mismatches
 
 if __name__ == "__main__" :
     from argparse import ArgumentParser
@@ -79,6 +135,35 @@ if __name__ == "__main__" :
                         required=True)
     parser.add_argument("--out_directory_name",
                         help="The directory where outputs will be stored.",
-                        required=True)
+                        required=False)
+    parser.add_argument("--check_cleaner",
+                        action="store_true",
+                        help="Only check that the cleaner gives the same "
+                            "utterances as the original cleaning on the corpus.")
+    parser.add_argument("--compression",
+                        choices=[name for name in COMPRESSIONS if name],
+                        default=None,
+                        help="Compress the training files (zstd requires\
+                            the zstandard package).")
+    parser.add_argument("--shard_size",
+                        type=int,
+                        default=None,
+                        help="Split the training files in shards of this\
+                            number of lines.")
+    parser.add_argument("--batch_size",
+                        type=int,
+                        default=2000,
+                        help="The number of utterances phonemized and written at once.")
+    add_profiling_arguments(parser)
     args = parser.parse_args()
-    create_sentences_files(args.csvs_directory, args.out_directory_name)
\ No newline at end of file
+    if not args.check_cleaner and args.out_directory_name is None :
+        parser.error("--out_directory_name is required.")
+    with profiling(args.profile, args.cprofile) :
+        if args.check_cleaner :
+            check_cleaner_on_corpus(args.csvs_directory)
+        else :
+            create_sentences_files(args.csvs_directory,
+                                    args.out_directory_name,
+                                    compression=args.compression,
+                                    shard_size=args.shard_size,
+                                    batch_size=args.batch_size)
\ No newline at end of file
@@ -0,0 +1,215 @@
+"""This script measures how much the task accuracies of the n-gram models vary\
+with their input, by leave-one-child-out cross-validation.
+
+The adult utterances of each child of the Providence corpus are tokenized and\
+counted once, as per-child shards (see update_ngram_counts.py). For each\
+child, the models of each tokenization and order are estimated from the\
+merged counts of the other children, without tokenizing again, and evaluated\
+on the tasks. The folds are run in a pool of forked processes that share the\
+tasks, preprocessed once per tokenization.
+"""
+import multiprocessing
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+import pandas as pd
+from tqdm import tqdm
+from run_tasks import load_tasks, preprocess_tasks, evaluate
+from tokenizations import TOKENIZATIONS, model_name
+from update_ngram_counts import update_counts, merge_sources, load_manifest
+from models.ngram_lm import ESTIMATORS, estimate_model
+from models.ngram_store import CompiledNGramModel
+from instrumentation import add_profiling_arguments, profiling, span
+
+CROSS_VALIDATION_COLUMNS = ["held_out", "model", "tokenization", "order", "task", "accuracy"]
+# The fold trained on all the children, reported as a reference.
+ALL_CHILDREN = "none"
+
+# Preprocessed tasks of each tokenization, shared with the worker processes:\
+# they are set before the pool is forked, as in run_tasks.py.
+_SHARED_TASKS: Dict[str, Dict[str, Tuple[List[List[str]], List[List[str]]]]] = {}
+
+def _run_fold(fold: Tuple[str, str, List[Path], Sequence[int], int, str, float, float]) -> List[list] :
+    """
+    Merge the counts of the training sources of a fold, estimate its models\
+    of each order and evaluate them on the shared tasks.
+    """
+    held_out, tokenization, source_directories, orders, ngram_size, estimator, alpha, smooth = fold
+    vocabulary, counts = merge_sources(source_directories, ngram_size)
+    rows = []
+    for order in orders :
+        tables, metadata = estimate_model(counts[:order], len(vocabulary), estimator, alpha, smooth)
+        model = CompiledNGramModel.from_orders(vocabulary, tables, metadata)
+        name = model_name(order, tokenization)
+        rows.extend([held_out, name, tokenization, order, task, accuracy]
+                    for task, accuracy in evaluate(model, _SHARED_TASKS[tokenization]).items())
+    return rows
+
+def cross_validate(csvs_directory: str,
+                    counts_directory: str,
+                    tasks_folder: str,
+                    orders: Sequence[int]=(3, 5),
+                    tokenizations: Sequence[str]=tuple(TOKENIZATIONS),
+                    estimator: str="stupid_backoff",
+                    alpha: float=0.4,
+                    smooth: float=1e-6,
+                    ngram_size: int=5,
+                    workers: int=1) -> pd.DataFrame :
+    """
+    Run the leave-one-child-out folds of the n-gram models.
+
+    Parameters
+    ----------
+    - csvs_directory: str
+        The directory of the csvs of the children.
+    - counts_directory: str
+        The directory of the per-child counts. Only the new or changed csvs\
+        are counted.
+    - tasks_folder: str
+        The folder containing the task csvs.
+    - orders: list
+        The orders of the models.
+    - tokenizations: list
+        The tokenizations of the models (keys of TOKENIZATIONS).
+    - estimator: str
+        Either 'stupid_backoff' or 'kneser_ney'.
+    - alpha: float
+        The backoff penalty of stupid backoff.
+    - smooth: float
+        The probability given to unknown words by stupid backoff.
+    - ngram_size: int
+        The maximal order of the counts.
+    - workers: int
+        The number of processes running the folds.
+
+    Return
+    ------
+    - pd.DataFrame:
+        One row (see CROSS_VALIDATION_COLUMNS) per fold, model and task.\
+        The held out child of the reference fold, trained on all the\
+        children, is ALL_CHILDREN.
+    """
+    global _SHARED_TASKS
+    update_counts(csvs_directory, counts_directory, ngram_size)
+    sources = sorted(load_manifest(Path(counts_directory))["sources"])
+    with span("load_tasks") :
+        tasks = load_tasks(tasks_folder)
+    n_sentences = 2 * sum(len(pairs) for pairs in tasks.values())
+    for tokenization in tokenizations :
+        print(f"Preprocessing the tasks ({tokenization})...")
+        with span(f"preprocess {tokenization}", items=n_sentences) :
+            _SHARED_TASKS[tokenization] = preprocess_tasks(tasks, *TOKENIZATIONS[tokenization])
+    folds = [(Path(held_out).stem if held_out else ALL_CHILDREN,
+                tokenization,
+                [Path(counts_directory) / "sources" / source / tokenization
+                    for source in sources if source != held_out],
+                orders,
+                ngram_size,
+                estimator,
+                alpha,
+                smooth)
+                for held_out in [None] + sources
+                for tokenization in tokenizations]
+    rows = []
+    with span("folds", items=len(folds)) :
+        if workers > 1 :
+            with multiprocessing.get_context("fork").Pool(workers) as pool :
+                for fold_rows in tqdm(pool.imap_unordered(_run_fold, folds), total=len(folds)) :
+                    rows.extend(fold_rows)
+        else :
+            for fold in tqdm(folds) :
+                rows.extend(_run_fold(fold))
+    _SHARED_TASKS = {}
+    return pd.DataFrame(rows, columns=CROSS_VALIDATION_COLUMNS)
+
+def summarize_folds(accuracies: pd.DataFrame) -> pd.DataFrame :
+    """
+    Mean, standard deviation, minimum and maximum of the accuracy of each\
+    model and task over the leave-one-out folds, along with the accuracy\
+    of the model trained on all the children.
+    """
+    folds = accuracies[accuracies.held_out != ALL_CHILDREN]
+    summary = folds.groupby(["model", "task"]).accuracy.agg(["mean", "std", "min", "max"]).reset_index()
+    reference = accuracies[accuracies.held_out == ALL_CHILDREN][["model", "task", "accuracy"]]
+    return summary.merge(reference.rename(columns={"accuracy": "all_children"}), on=["model", "task"], how="left")
+
+if __name__ == "__main__" :
+    from argparse import ArgumentParser
+    from preprocessing_tools import load_lexicon
+    parser = ArgumentParser()
+    parser.add_argument("--csvs_directory",
+                        type=str,
+                        default="data/children_csvs",
+                        help="The directory containing the csv files of the children.")
+    parser.add_argument("--counts_directory",
+                        type=str,
+                        default="data/counts",
+                        help="The directory of the per-child counts.")
+    parser.add_argument("--tasks_folder",
+                        type=str,
+                        help="The folder containing the tasks",
+                        required=True)
+    parser.add_argument("--tokenizations",
+                        nargs="+",
+                        choices=list(TOKENIZATIONS),
+                        default=list(TOKENIZATIONS),
+                        help="The tokenizations to evaluate (default to all).")
+    parser.add_argument("--orders",
+                        type=int,
+                        nargs="+",
+                        default=[3, 5],
+                        help="The orders of the models.")
+    parser.add_argument("--ngram_size",
+                        type=int,
+                        default=5,
+                        help="The maximal order of the counts.")
+    parser.add_argument("--estimator",
+                        choices=ESTIMATORS,
+                        default="stupid_backoff",
+                        help="The estimator of the models.")
+    parser.add_argument("--alpha",
+                        type=float,
+                        default=0.4,
+                        help="The backoff penalty of the stupid backoff models.")
+    parser.add_argument("--smooth",
+                        type=float,
+                        default=1e-6,
+                        help="The probability of unknown words of the stupid backoff models.")
+    parser.add_argument("--lexicon",
+                        type=str,
+                        default=None,
+                        help="A phonemization lexicon used to phonemize task sentences word by word.")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=1,
+                        help="The number of processes running the folds.")
+    parser.add_argument("--out_filename",
+                        type=str,
+                        help="The results are written to results/<out_filename>.csv\
+                            and results/<out_filename>_summary.csv",
+                        required=True)
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    if max(args.orders) > args.ngram_size :
+        parser.error("The orders of the models cannot exceed --ngram_size.")
+
+    with profiling(args.profile, args.cprofile) :
+        if args.lexicon :
+            load_lexicon(args.lexicon)
+        accuracies = cross_validate(args.csvs_directory,
+                                    args.counts_directory,
+                                    args.tasks_folder,
+                                    args.orders,
+                                    args.tokenizations,
+                                    args.estimator,
+                                    args.alpha,
+                                    args.smooth,
+                                    args.ngram_size,
+                                    args.workers)
+        summary = summarize_folds(accuracies)
+        out_directory = Path("results")
+        out_directory.mkdir(exist_ok=True, parents=True)
+        accuracies.to_csv(out_directory / f"{args.out_filename}.csv", index=False)
+        summary.to_csv(out_directory / f"{args.out_filename}_summary.csv", index=False)
+        for name, model_accuracies in accuracies.groupby("model", sort=False) :
+            print(f"\n{name}")
+            print(model_accuracies.pivot(index="held_out", columns="task", values="accuracy").round(4).to_string())
@@ -1,33 +1,48 @@
 """This script downloads the CSV data\
 of the 6 children of the Providence corpus"""
 
+from functools import partial
 from pathlib import Path
-import os
 from typing import Set
-import childespy
+from childes_download import download_chunks, fetch_table
+from instrumentation import add_profiling_arguments, profiling
 
 # instead of loading all the data once in the memory,
 # load the data one child by child.
 CHILDREN: Set[str] = {'Alex', 'Ethan', 'Lily',
                       'Naima', 'Violet', 'William'}
 
-def downloads_children_csvs(out_directory_name: str) -> None:
+def downloads_children_csvs(out_directory_name: str,
+                            workers: int=2,
+                            fetch=None) -> None:
     """
     This function will download CSV data for each child in\
     the providence corpus. We will use childespy of version\
     1.0.1 to do this.
 
+    The children are downloaded concurrently, each one to its\
+    own CSV file, which only appears once complete: running the\
+    function again only downloads the missing children.
+
     Parameters
     ----------
     - out_directory_name: str
       The directory where the CSV data will be stored.
+    - workers: int
+      The number of children downloaded concurrently.
+    - fetch: callable
+      Stand-in for `childes_download.fetch_table`.
     """
-    for children in CHILDREN :
-        childespy.get_utterances(language="eng",
-                                  collection="Eng-NA",
-                                  corpus="Providence",
-                                  target_child=children).to_csv(
-                                    f"{out_directory_name}/{children}.csv")
+    chunks = {children: {"language": "eng",
+                            "collection": "Eng-NA",
+                            "corpus": "Providence",
+                            "target_child": children}
+                for children in sorted(CHILDREN)}
+    download_chunks(partial(fetch or fetch_table, "utterances"),
+                    chunks,
+                    out_directory_name,
+                    workers=workers,
+                    index=True)
 
 if __name__ == "__main__" :
     from argparse import ArgumentParser
@@ -35,7 +50,14 @@ if __name__ == "__main__" :
     parser.add_argument("--out_directory_name",
                         help="The directory where outputs will be stored.",
                         required=True)
+    parser.add_argument("--workers",
+                        type=int,
+                        default=2,
+                        help="The number of children downloaded concurrently.",
+                        required=False)
+    add_profiling_arguments(parser)
     args = parser.parse_args()
     out_directory_name = Path(args.out_directory_name)
     out_directory_name.mkdir(parents=True, exist_ok=True)
-    downloads_children_csvs(out_directory_name)
+    with profiling(args.profile, args.cprofile) :
+        downloads_children_csvs(out_directory_name, args.workers)
@@ -1,43 +1,48 @@
 import argparse
+import shutil
 import sys
 from pathlib import Path
 
-import childespy
+from childes_download import download_table, list_corpora
+from instrumentation import add_profiling_arguments, profiling, span
 
+COLLECTION = "Eng-NA"
 
-def main(argv):
+
+def main(argv, fetch=None):
     parser = argparse.ArgumentParser(description='This script download American English '
                                                  'transcripts from the CHILDES database.')
     parser.add_argument('--out', type=str, default='data/transcripts',
                         help='Path where to store the transcripts.')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Number of corpora downloaded concurrently.')
+    parser.add_argument('--keep_chunks', action='store_true',
+                        help='Keep the per-corpus files once they are concatenated.')
+    add_profiling_arguments(parser)
     args = parser.parse_args(argv)
     args.out = Path(args.out)
     args.out.mkdir(parents=True, exist_ok=True)
-
-    print("Start downloading transcripts...")
-    transcripts = childespy.get_transcripts(collection="Eng-NA")
-    transcripts.to_csv(args.out / "transcripts.csv", index=False)
-    print("Done.")
-
-    print("Start downloading tokens...")
-    tokens = childespy.get_tokens(collection="Eng-NA", corpus="Brown", token='%')
-    tokens.to_csv(args.out / "tokens.csv", index=False)
-    print(tokens)
-    print("Done.")
-
-    print("Start downloading types...")
-    types = childespy.get_types(collection="Eng-NA")
-    types.to_csv(args.out / "types.csv", index=False)
-    print(types)
-    print("Done.")
-
-    print("Start downloading sentences...")
-    sentences = childespy.get_utterances(collection="Eng-NA")
-    sentences.to_csv(args.out / "sentences.csv", index=False)
-    print("Done.")
+    with profiling(args.profile, args.cprofile):
+        # Per-corpus checkpoints: an interrupted download resumes from the missing corpora.
+        chunks_directory = args.out / "chunks"
+
+        corpora = list_corpora(COLLECTION, chunks_directory / "corpora", fetch=fetch)
+        by_corpus = {corpus: {"collection": COLLECTION, "corpus": corpus} for corpus in corpora}
+        downloads = [("transcripts", by_corpus, "transcripts.csv"),
+                     ("tokens", {"Brown": {"collection": COLLECTION, "corpus": "Brown", "token": '%'}}, "tokens.csv"),
+                     ("types", by_corpus, "types.csv"),
+                     ("utterances", by_corpus, "sentences.csv")]
+        for table, chunks, filename in downloads:
+            print("Start downloading %s..." % table)
+            with span('download ' + table):
+                download_table(table, chunks, args.out / filename, chunks_directory / table,
+                               workers=args.workers, fetch=fetch, keep_chunks=args.keep_chunks)
+            print("Done.")
+        if not args.keep_chunks:
+            shutil.rmtree(chunks_directory)
 
 
 if __name__ == "__main__":
     # execute only if run as a script
     args = sys.argv[1:]
-    main(args)
\ No newline at end of file
+    main(args)
@@ -0,0 +1,192 @@
+"""Evaluate the scores of a model submission on a ZeroSpeech-like syntactic gold.csv (see zr_format.py).
+
+The submission is a text file with one `filename score` line per audio file of the gold
+(filenames without extension, as in gold.csv), where the score is the log-probability
+that the model gives to the file. Each grammatical sentence is compared with its
+ungrammatical counterpart pronounced by the same voice (same `id` and `voice`): the pair
+is correct if the grammatical sentence gets the highest score, and counts for 0.5 in case
+of a tie.
+
+The submission is read by chunks, and each chunk is joined to the gold table on the
+filename, so the memory does not grow with the size of the submission.
+"""
+import argparse
+import sys
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from instrumentation import add_profiling_arguments, profiling, span
+
+CHUNK_SIZE = 1000000
+# Groupings of the pairs of the summary, as gold.csv columns.
+GROUPINGS = [[], ['type'], ['subtype'], ['voice'], ['type', 'voice']]
+
+
+def read_scores(submission, gold_filenames, chunk_size=CHUNK_SIZE, sep=' '):
+    """
+    Read the scores of a submission in the order of the gold filenames.
+
+    Parameters
+    ----------
+    - submission: str
+        The submission file, without header.
+    - gold_filenames: pd.Index
+        The filenames of the gold.
+    - chunk_size: int
+        The number of lines read at once.
+    - sep: str
+        The separator of the submission file.
+
+    Return
+    ------
+    - tuple:
+        The score of each gold file (nan if it is missing from the submission), and the
+        numbers of submission lines that are not in the gold and that are duplicates.
+    """
+    scores = np.full(len(gold_filenames), np.nan)
+    seen = np.zeros(len(gold_filenames), dtype=bool)
+    unknown, duplicates = 0, 0
+    chunks = pd.read_csv(submission, sep=sep, header=None, names=['filename', 'score'],
+                         dtype={'filename': str, 'score': np.float64}, chunksize=chunk_size)
+    for chunk in chunks:
+        with span('join', items=len(chunk)):
+            filenames = chunk['filename'].str.replace(r'\.wav$', '', regex=True)
+            rows = gold_filenames.get_indexer(filenames)
+            known = rows >= 0
+            unknown += int(np.count_nonzero(~known))
+            rows = rows[known]
+            duplicates += int(np.count_nonzero(seen[rows])) + len(rows) - len(np.unique(rows))
+            seen[rows] = True
+            scores[rows] = chunk['score'].values[known]
+    return scores, unknown, duplicates
+
+
+def pair_accuracies(gold, scores):
+    """
+    Compare the scores of the grammatical and ungrammatical sentences of each pair.
+
+    Return
+    ------
+    - pd.DataFrame:
+        One row per (id, voice) pair, with its type, subtype, the scores of its two
+        sentences and its accuracy (1, 0.5 for a tie, 0, or nan if a score is missing).
+    """
+    pairs = gold.groupby(['id', 'voice'], sort=False).ngroup().values
+    n_pairs = pairs.max() + 1
+    correct = gold['correct'].values == 1
+    if np.any(np.bincount(pairs, minlength=n_pairs) != 2) \
+            or np.any(np.bincount(pairs[correct], minlength=n_pairs) != 1):
+        raise ValueError('Each (id, voice) of the gold must have one grammatical and one ungrammatical sentence.')
+    correct_scores = np.empty(n_pairs)
+    correct_scores[pairs[correct]] = scores[correct]
+    incorrect_scores = np.empty(n_pairs)
+    incorrect_scores[pairs[~correct]] = scores[~correct]
+    accuracy = (correct_scores > incorrect_scores) + 0.5 * (correct_scores == incorrect_scores)
+    accuracy[np.isnan(correct_scores) | np.isnan(incorrect_scores)] = np.nan
+    first_rows = gold.iloc[np.flatnonzero(correct)[np.argsort(pairs[correct])]]
+    return pd.DataFrame({'id': first_rows['id'].values,
+                         'voice': first_rows['voice'].values,
+                         'type': first_rows['type'].values,
+                         'subtype': first_rows['subtype'].values,
+                         'score_correct': correct_scores,
+                         'score_incorrect': incorrect_scores,
+                         'accuracy': accuracy})
+
+
+def summarize(pairs):
+    """Accuracy and number of scored pairs overall and for each grouping of GROUPINGS."""
+    scored = pairs.dropna(subset=['accuracy'])
+    rows = []
+    for grouping in GROUPINGS:
+        if not grouping:
+            rows.append({'grouping': 'all', 'key': 'all', 'pairs': len(scored), 'accuracy': scored['accuracy'].mean()})
+            continue
+        groups = scored.groupby(grouping)['accuracy'].agg(['size', 'mean']).reset_index()
+        keys = groups[grouping].astype(str).agg('/'.join, axis=1)
+        rows.extend({'grouping': '/'.join(grouping), 'key': key, 'pairs': size, 'accuracy': mean}
+                    for key, size, mean in zip(keys, groups['size'], groups['mean']))
+    return pd.DataFrame(rows, columns=['grouping', 'key', 'pairs', 'accuracy'])
+
+
+def evaluate_submission(gold_path, submission, chunk_size=CHUNK_SIZE, sep=' ', allow_missing=False):
+    """
+    Evaluate a submission against a gold.csv file.
+
+    Parameters
+    ----------
+    - gold_path: str
+        The gold.csv written by zr_format.py.
+    - submission: str
+        The `filename score` file of the submission.
+    - chunk_size: int
+        The number of submission lines read at once.
+    - sep: str
+        The separator of the submission file.
+    - allow_missing: bool
+        Whether to ignore the pairs with a missing score instead of failing.
+
+    Return
+    ------
+    - tuple:
+        The accuracy of each pair (see pair_accuracies) and the summary (see summarize).
+    """
+    with span('load_gold') as stage:
+        gold = pd.read_csv(gold_path, usecols=['id', 'filename', 'voice', 'type', 'subtype', 'correct'],
+                           dtype={'filename': str, 'voice': str, 'type': str, 'subtype': str})
+        stage.add(len(gold))
+    # A sentence of several tasks has a single audio file, hence a single score.
+    gold_rows, gold_filenames = pd.factorize(gold['filename'])
+    file_scores, unknown, duplicates = read_scores(submission, pd.Index(gold_filenames), chunk_size, sep)
+    scores = file_scores[gold_rows]
+    missing = int(np.count_nonzero(np.isnan(file_scores)))
+    if unknown:
+        print('%d lines of the submission are not in the gold and were ignored.' % unknown)
+    if duplicates:
+        print('%d lines of the submission are duplicates, the last score of each file was kept.' % duplicates)
+    if missing:
+        message = '%d files of the gold have no score, e.g. %s.' % (missing, gold_filenames[np.isnan(file_scores)][0])
+        if not allow_missing:
+            raise ValueError(message)
+        print(message + ' Their pairs are ignored.')
+    with span('pairs', items=len(gold)):
+        pairs = pair_accuracies(gold, scores)
+    with span('summarize', items=len(pairs)):
+        summary = summarize(pairs)
+    return pairs, summary
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='This script evaluates the scores of a model submission on a '
+                                                 'syntactic gold.csv written by zr_format.py.')
+    parser.add_argument('--gold', type=str, default='data/zr_format/syntactic/dev/gold.csv',
+                        help='The gold.csv file.')
+    parser.add_argument('--submission', type=str, required=True,
+                        help='The scores of the submission: one "filename score" line per file of the gold.')
+    parser.add_argument('--out', type=str, required=True,
+                        help='Where to write the summary (accuracy by type, subtype and voice), as csv.')
+    parser.add_argument('--pairs_out', type=str, default=None,
+                        help='If given, also write the scores and the accuracy of each pair to this csv.')
+    parser.add_argument('--sep', type=str, default=' ',
+                        help='The separator of the submission file (default to a space).')
+    parser.add_argument('--chunk_size', type=int, default=CHUNK_SIZE,
+                        help='The number of submission lines read at once.')
+    parser.add_argument('--allow_missing', action='store_true',
+                        help='Ignore the pairs with a missing score instead of failing.')
+    add_profiling_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with profiling(args.profile, args.cprofile):
+        pairs, summary = evaluate_submission(args.gold, args.submission, args.chunk_size, args.sep,
+                                             args.allow_missing)
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        summary.to_csv(args.out, index=False)
+        if args.pairs_out:
+            Path(args.pairs_out).parent.mkdir(parents=True, exist_ok=True)
+            pairs.to_csv(args.pairs_out, index=False)
+        print(summary[summary.grouping.isin(['all', 'type'])].to_string(index=False))
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    args = sys.argv[1:]
+    main(args)
@@ -1,9 +1,70 @@
 import argparse
 import sys
 from pathlib import Path
-import pandas as pd
 import numpy as np
-import itertools
+import pandas as pd
+from scipy import sparse
+from word_pos_index import read_tokens, build_index, is_up_to_date, query_candidates
+from instrumentation import add_profiling_arguments, profiling, span
+
+# POS tags of each category of words
+CATEGORIES = {'noun': ['n', 'n:adj', 'n:gerund', 'n:let', 'n:prop', 'n:pt'],
+              'adj': ['adj'],
+              'verb': ['v']}
+
+NOUNS_TO_EXCLUDE = ['chi', 'ross', 'laura', 'lot', 'bit', 'top', 'ma', 'e', 'sarah',
+                    'naima', 'adam', 'b', 'william', 'o', 'carl', 'momma', 'michael',
+                    'alex', 'd', 'nomi', 'bro', 's', 'henry', 'lily', 'david', 'peter',
+                    't', 'abe', 'c', 'paul', 'sis', 'r',  'm']
+ADJS_TO_EXCLUDE = ['thirst', 'craze', 'eensie', 'weensie', 'loll', 'ying', 'shag', 'able', 'past', 'left', 'born',
+                   'full', 'ease', 'sharp', 'wide', 'own']
+VERBS_TO_EXCLUDE = ['ooh', 'best', 'zipper', 'pishie', 'sticker', 'dirty', 'scoot',
+                    'sprout', 'pant', 'jingle', 'bicycle', 'clink', 'scallop', 'boog',
+                    'muddy', 'headquarter']
+
+
+def pos_probabilities(tokens):
+    """
+    Compute, for each word, its frequency and its probability of belonging to each category
+    (sum of the probabilities of the POS tags of the category), sorted by decreasing count.
+
+    Words and tags are integer coded and counted in a sparse word x tag matrix, whose counts
+    are summed over the tags of each category with a sparse product.
+    """
+    word_ids, words = pd.factorize(tokens.word)
+    tag_ids, tags = pd.factorize(tokens.pos)
+    # Duplicated (word, tag) entries are summed when converting to CSR.
+    counts = sparse.coo_matrix((np.ones(len(word_ids), dtype=np.int64), (word_ids, tag_ids)),
+                               shape=(len(words), len(tags))).tocsr()
+    word_counts = np.asarray(counts.sum(axis=1)).ravel()
+
+    # Find proba that a word is a noun, an adjective, or a verb
+    tag_index = {tag: idx for idx, tag in enumerate(tags)}
+    rows, columns = [], []
+    for category_idx, category_tags in enumerate(CATEGORIES.values()):
+        for tag in category_tags:
+            if tag in tag_index:
+                rows.append(tag_index[tag])
+                columns.append(category_idx)
+    membership = sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, columns)),
+                                   shape=(len(tags), len(CATEGORIES)))
+    # Row normalization of the category counts (words x categories) rather than of the
+    # whole word x tag matrix: the sum of the counts of a category is divided only once.
+    category_probabilities = (counts @ membership).toarray() / word_counts[:, None]
+
+    data = pd.DataFrame({'word': words, 'count': word_counts, 'freq': word_counts / word_counts.sum()})
+    for category_idx, category in enumerate(CATEGORIES):
+        data['%s_prob' % category] = category_probabilities[:, category_idx]
+    return data.sort_values(by=['count', 'word'], ascending=[False, True]).reset_index(drop=True)
+
+
+def select_candidates(data, category, threshold, to_exclude, n_to_keep=None):
+    """Select the words whose probability of belonging to the category is greater than the threshold."""
+    prob_col = '%s_prob' % category
+    candidates = data.loc[data[prob_col] > threshold, ['word', 'freq', prob_col]]
+    candidates = candidates[~candidates.word.isin(to_exclude)]
+    return candidates[:n_to_keep]
+
 
 def main(argv):
     parser = argparse.ArgumentParser(description='This script find words that will be used in the syntactic'
@@ -14,74 +75,65 @@ def main(argv):
                         help='Path where to store the transcripts.')
     parser.add_argument('--n_to_keep', type=int, default=100,
                         help='Number of words to keep in each category')
+    parser.add_argument('--index', type=str, default=None,
+                        help='Path of the word/POS index (e.g. data/transcripts/word_pos_index.sqlite). It is built '
+                             'once from the input file, then candidates are queried from it. Without index, '
+                             'the statistics are computed from the input file.')
+    parser.add_argument('--rebuild_index', action='store_true',
+                        help='Rebuild the index even if it is up to date.')
+    parser.add_argument('--noun_threshold', type=float, default=0.9,
+                        help='Minimal probability of being a noun.')
+    parser.add_argument('--adj_threshold', type=float, default=0.9,
+                        help='Minimal probability of being an adjective.')
+    parser.add_argument('--verb_threshold', type=float, default=0.6,
+                        help='Minimal probability of being a verb.')
+    parser.add_argument('--speaker_roles', type=str, nargs='+', default=None,
+                        help='Only count the words produced by these speaker roles (default to all).')
+    parser.add_argument('--exclude_roles', type=str, nargs='*', default=None,
+                        help='Do not count the words produced by these speaker roles, e.g. Media Environment '
+                             '(default to none, as for the candidates of data/word_candidates).')
+    add_profiling_arguments(parser)
     args = parser.parse_args(argv)
     args.out = Path(args.out)
     args.out.mkdir(parents=True, exist_ok=True)
 
-    # Load sentences
-    data = pd.read_csv(args.input)
-
-    # Filter Media/Environment
-    data = data[~data.speaker_role.isin([['Media', 'Environment']])]
-
-    # Filter rows for which POS tags or stem is NA
-    data = data[['stem', 'part_of_speech']]
-    len1 = len(data)
-    data = data.dropna(axis=0, how='any')
-    len2 = len(data)
-    print("Lost %.1f %% data when excluding items for which the number of POS or stem is NA." % (100 - len2 * 100 / len1))
-    stem = [s.lower().split(' ') for s in data.stem]
-    pos = [p.split(' ') for p in data.part_of_speech]
-
-    # Filter rows for which number of POS tags != number of words
-    len1 = len(data)
-    data = [(s, p) for s, p in zip(stem, pos) if len(s) == len(p)]
-    len2 = len(data)
-    print("Lost %.1f %% data when excluding items for which the number of POS is different from the number of words" % (100 - len2*100/len1))
-
-    word = list(itertools.chain.from_iterable([s for s, _ in data]))
-    pos = list(itertools.chain.from_iterable([p for _, p in data]))
-    data = pd.DataFrame.from_dict({'word': word, 'pos': pos})
-    data = data.groupby('word')['pos'].value_counts().unstack().fillna(0)
-    data['count'] = data.sum(axis=1)
-    data = data.sort_values(by='count', ascending=False).reset_index()
-    columns = list(data.columns)
-    columns = [c for c in columns if c not in ['count', 'word']]
-    for col in columns:
-        data[col] = data[col] / data['count']
-
-    data['freq'] = data['count'] / data['count'].sum()
-
-    # Find proba that a word is a noun, an adjective, or a verb
-    nouns_col = ['n', 'n:adj', 'n:gerund', 'n:let', 'n:prop', 'n:pt']
-    data['noun_prob'] = data[nouns_col].sum(axis=1)
-    adj_col = ['adj']
-    data['adj_prob'] = data[adj_col].sum(axis=1)
-    verb_col = ['v']
-    data['verb_prob'] = data[verb_col].sum(axis=1)
-
-    # Filter words whose proba is lower than 0.9 and save to csv file
-    nouns = data.loc[data.noun_prob > 0.9, ['word', 'freq', 'noun_prob']]
-    to_exclude = ['chi', 'ross', 'laura', 'lot', 'bit', 'top', 'ma', 'e', 'sarah',
-                  'naima', 'adam', 'b', 'william', 'o', 'carl', 'momma', 'michael',
-                  'alex', 'd', 'nomi', 'bro', 's', 'henry', 'lily', 'david', 'peter',
-                  't', 'abe', 'c', 'paul', 'sis', 'r',  'm']
-    nouns = nouns[~nouns.word.isin(to_exclude)]
-    nouns[:args.n_to_keep].to_csv(args.out / 'nouns.csv', index=False)
-    nouns[:2000].to_csv(args.out / '2000_nouns.csv', index=False)
-
-    adjs = data.loc[data.adj_prob > 0.9, ['word', 'freq', 'adj_prob']]
-    to_exclude = ['thirst', 'craze', 'eensie', 'weensie', 'loll', 'ying', 'shag', 'able', 'past', 'left', 'born',
-                  'full', 'ease', 'sharp', 'wide', 'own']
-    adjs = adjs[~adjs.word.isin(to_exclude)]
-    adjs[:args.n_to_keep].to_csv(args.out / 'adjs.csv', index=False)
+    with profiling(args.profile, args.cprofile):
+        selections = [('noun', args.noun_threshold, NOUNS_TO_EXCLUDE, max(args.n_to_keep, 2000)),
+                      ('adj', args.adj_threshold, ADJS_TO_EXCLUDE, args.n_to_keep),
+                      ('verb', args.verb_threshold, VERBS_TO_EXCLUDE, args.n_to_keep)]
+        candidates = {}
+        if args.index is not None:
+            if args.rebuild_index or not is_up_to_date(args.index, args.input):
+                print("Building the index...")
+                with span('build_index'):
+                    build_index(args.input, args.index)
+            for category, threshold, to_exclude, n_to_keep in selections:
+                with span('query ' + category):
+                    candidates[category] = query_candidates(args.index, CATEGORIES[category], threshold,
+                                                            speaker_roles=args.speaker_roles,
+                                                            exclude_roles=args.exclude_roles,
+                                                            exclude_words=to_exclude,
+                                                            n_to_keep=n_to_keep)
+                candidates[category] = candidates[category].rename(columns={'prob': '%s_prob' % category})
+        else:
+            with span('read_tokens') as stage:
+                tokens = read_tokens(args.input)
+                stage.add(len(tokens))
+            if args.speaker_roles:
+                tokens = tokens[tokens.speaker_role.isin(args.speaker_roles)]
+            if args.exclude_roles:
+                tokens = tokens[~tokens.speaker_role.isin(args.exclude_roles)]
+            with span('pos_probabilities', items=len(tokens)):
+                data = pos_probabilities(tokens)
+            for category, threshold, to_exclude, n_to_keep in selections:
+                with span('select ' + category, items=len(data)):
+                    candidates[category] = select_candidates(data, category, threshold, to_exclude, n_to_keep)
 
-    verbs = data.loc[data.verb_prob > 0.6, ['word', 'freq', 'verb_prob']]
-    to_exclude = ['ooh', 'best', 'zipper', 'pishie', 'sticker', 'dirty', 'scoot',
-                  'sprout', 'pant', 'jingle', 'bicycle', 'clink', 'scallop', 'boog',
-                  'muddy', 'headquarter']
-    verbs = verbs[~verbs.word.isin(to_exclude)]
-    verbs[:args.n_to_keep].to_csv(args.out / 'verbs.csv', index=False)
+        # Save the most frequent candidates of each category
+        candidates['noun'][:args.n_to_keep].to_csv(args.out / 'nouns.csv', index=False)
+        candidates['noun'][:2000].to_csv(args.out / '2000_nouns.csv', index=False)
+        candidates['adj'][:args.n_to_keep].to_csv(args.out / 'adjs.csv', index=False)
+        candidates['verb'][:args.n_to_keep].to_csv(args.out / 'verbs.csv', index=False)
 
 
 if __name__ == "__main__":
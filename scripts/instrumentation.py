@@ -0,0 +1,188 @@
+"""This module implements lightweight instrumentation shared by all the\
+scripts: timed spans, memory usage, throughput and optional cProfile dumps.
+
+Stages are wrapped in spans:
+
+    with span("phonemize", items=len(batch)) :
+        ...
+
+Spans are always timed (the overhead is a few microseconds), but they are\
+only recorded, along with the memory usage, while a profiling session is\
+active, usually started through the `--profile out.json` option of the\
+scripts. The trace is then written as\
+JSON, in the Chrome trace event format (readable with chrome://tracing,\
+Perfetto or speedscope) along with a per-stage summary.
+"""
+import cProfile
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+# Beyond this number of spans, spans are only aggregated in the summary.
+MAX_EVENTS = 100000
+
+def current_rss_mb() -> float:
+    """Get the current resident memory of the process, in MB."""
+    try :
+        with open("/proc/self/statm") as statm :
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, IndexError) :
+        return peak_rss_mb()
+
+def peak_rss_mb(children: bool=False) -> float:
+    """Get the peak resident memory of the process (or of its finished children), in MB."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return usage.ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+class Span:
+    """A timed stage. `items` can be set inside the span to report a throughput."""
+    __slots__ = ("name", "items", "start", "duration", "depth")
+
+    def __init__(self, name: str, items: Optional[int], depth: int) :
+        self.name = name
+        self.items = items
+        self.depth = depth
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def add(self, items: int) -> None:
+        """Count processed items."""
+        self.items = (self.items or 0) + items
+
+class Tracer:
+    """Collects the spans of the process while `active` is set."""
+    def __init__(self) :
+        self.active = False
+        self.origin = time.perf_counter()
+        self.events = []
+        self.summary = OrderedDict()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def reset(self) -> None:
+        self.__init__()
+
+    @contextmanager
+    def span(self, name: str, items: int=None) -> Iterator[Span]:
+        depth = getattr(self.local, "depth", 0)
+        current = Span(name, items, depth)
+        self.local.depth = depth + 1
+        try :
+            yield current
+        finally :
+            self.local.depth = depth
+            current.duration = time.perf_counter() - current.start
+            if self.active :
+                self.record(current)
+
+    def record(self, current: Span) -> None:
+        rss = current_rss_mb()
+        with self.lock :
+            stats = self.summary.setdefault(current.name, {"calls": 0,
+                                                            "seconds": 0.0,
+                                                            "items": None,
+                                                            "max_rss_mb": 0.0})
+            stats["calls"] += 1
+            stats["seconds"] += current.duration
+            if current.items is not None :
+                stats["items"] = (stats["items"] or 0) + current.items
+            stats["max_rss_mb"] = max(stats["max_rss_mb"], rss)
+            if len(self.events) < MAX_EVENTS :
+                args = {"rss_mb": round(rss, 1), "depth": current.depth}
+                if current.items is not None :
+                    args["items"] = current.items
+                    args["items_per_second"] = current.items / max(current.duration, 1e-9)
+                self.events.append({"name": current.name,
+                                    "ph": "X",
+                                    "ts": (current.start - self.origin) * 1e6,
+                                    "dur": current.duration * 1e6,
+                                    "pid": os.getpid(),
+                                    "tid": threading.get_ident(),
+                                    "args": args})
+
+    def stage_summary(self) -> Dict[str, dict]:
+        """Total time, items and throughput of each span name."""
+        summary = OrderedDict()
+        for name, stats in self.summary.items() :
+            summary[name] = dict(stats)
+            if stats["items"] is not None :
+                summary[name]["items_per_second"] = stats["items"] / max(stats["seconds"], 1e-9)
+        return summary
+
+    def write(self, path: str, extra: dict=None) -> None:
+        """Write the trace and the summary as JSON."""
+        trace = {"traceEvents": self.events,
+                    "displayTimeUnit": "ms",
+                    "argv": sys.argv,
+                    "wall_seconds": time.perf_counter() - self.origin,
+                    "peak_rss_mb": peak_rss_mb(),
+                    "children_peak_rss_mb": peak_rss_mb(children=True),
+                    "truncated": sum(stats["calls"] for stats in self.summary.values()) > len(self.events),
+                    "stages": self.stage_summary()}
+        trace.update(extra or {})
+        with open(path, mode="w") as trace_file :
+            json.dump(trace, trace_file, indent=1)
+
+TRACER = Tracer()
+
+def span(name: str, items: int=None):
+    """Time a stage of the process tracer (see `Tracer.span`)."""
+    return TRACER.span(name, items)
+
+def add_profiling_arguments(parser) -> None:
+    """Add the --profile and --cprofile options to an argument parser."""
+    parser.add_argument("--profile",
+                        type=str,
+                        default=None,
+                        help="Write a JSON trace of the stages (time, memory,\
+                            items/sec) to this file.")
+    parser.add_argument("--cprofile",
+                        action="store_true",
+                        help="With --profile, also write a cProfile dump\
+                            (<profile>.prof, readable with pstats or snakeviz).")
+
+@contextmanager
+def profiling(profile_path: Optional[str], use_cprofile: bool=False, name: str=None):
+    """
+    Profiling session of a whole script: everything runs in a root span,\
+    and the trace is written to `profile_path` at the end, even if the\
+    script fails. Nothing is written if `profile_path` is None.
+
+    Parameters
+    ----------
+    - profile_path: str
+        The output JSON trace.
+    - use_cprofile: bool
+        Whether to also run cProfile and dump its stats to <profile_path>.prof.
+    - name: str
+        The name of the root span (default to the script name).
+    """
+    profiler = cProfile.Profile() if profile_path and use_cprofile else None
+    TRACER.reset()
+    TRACER.active = profile_path is not None
+    if profiler is not None :
+        profiler.enable()
+    try :
+        with span(name or Path(sys.argv[0]).stem) :
+            yield TRACER
+    finally :
+        if profiler is not None :
+            profiler.disable()
+        TRACER.active = False
+        if profile_path :
+            Path(profile_path).parent.mkdir(parents=True, exist_ok=True)
+            extra = {}
+            if profiler is not None :
+                stats_path = str(Path(profile_path).with_suffix(".prof"))
+                profiler.dump_stats(stats_path)
+                extra["cprofile"] = stats_path
+            TRACER.write(profile_path, extra)
+            print(f"Profile written to {profile_path}")
@@ -0,0 +1,389 @@
+"""This script checks whether the task sentences occur in the training\
+corpora, verbatim or as high-order n-grams.
+
+The n-grams of a training file are hashed to 64 bits and stored once, as\
+one sorted array per order, in an index directory:
+
+    <index directory>/<tokenization>/index.json     the indexed files, orders and sizes
+    <index directory>/<tokenization>/sentences.npy  the hashes of the utterances
+    <index directory>/<tokenization>/<k>grams.npy   the hashes of the k-grams
+
+The tokens of the orthographic tokenization are casefolded, in the index\
+and in the queries, since task sentences are capitalized but not the\
+training utterances. The index is built again only when the training\
+files, the orders or the casefolding change.\
+The sentences of every task are then looked up in the memory mapped arrays\
+(binary search) in a single pass, giving a per-task leakage report and,\
+optionally, a copy of the tasks without the leaked pairs.
+"""
+import csv
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from run_tasks import load_tasks, preprocess_tasks
+from tokenizations import TOKENIZATIONS, TRAINING_FILES
+from models.corpus_files import expand_paths
+from models.ngram_estimators import read_sentences
+from instrumentation import add_profiling_arguments, profiling, span
+
+INDEX_VERSION = 2
+# Tokenizations whose tokens are casefolded before hashing.
+CASEFOLDED_TOKENIZATIONS = ["orthographic_words"]
+# Multiplier of the polynomial hash of the k-grams, over the hashes of their words.
+HASH_MULTIPLIER = np.uint64(0x100000001B3)
+
+def token_hash(token: str) -> int :
+    """A 64-bit hash of a token, stable across processes (unlike `hash`)."""
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+
+def sentence_hash(tokens: Sequence[str]) -> int :
+    """A 64-bit hash of a whole tokenized sentence."""
+    return int.from_bytes(hashlib.blake2b(" ".join(tokens).encode("utf-8"), digest_size=8).digest(), "little")
+
+def casefold_sentences(sentences: Sequence[Sequence[str]]) -> List[List[str]] :
+    """Casefold the tokens of tokenized sentences."""
+    return [[token.casefold() for token in sentence] for sentence in sentences]
+
+def hash_ngrams(sentences: Sequence[Sequence[str]],
+                orders: Sequence[int],
+                cache: Dict[str, int]) -> Dict[int, Tuple[np.ndarray, np.ndarray]] :
+    """
+    Hash all the k-grams of a batch of sentences, for each order k.
+
+    Parameters
+    ----------
+    - sentences: list
+        The tokenized sentences.
+    - orders: list
+        The orders of the k-grams.
+    - cache: dict
+        The hashes of the tokens already seen, completed in place.
+
+    Return
+    ------
+    - dict:
+        For each order, the hashes of the k-grams and the index of the\
+        sentence of each k-gram. The k-grams do not span sentences.
+    """
+    lengths = np.fromiter((len(sentence) for sentence in sentences), dtype=np.int64, count=len(sentences))
+    tokens = [token for sentence in sentences for token in sentence]
+    for token in set(tokens).difference(cache) :
+        cache[token] = token_hash(token)
+    words = np.fromiter((cache[token] for token in tokens), dtype=np.uint64, count=len(tokens))
+    sentence_ids = np.repeat(np.arange(len(sentences)), lengths)
+    # Number of tokens from each position to the end of its sentence.
+    remaining = np.cumsum(lengths)[sentence_ids] - np.arange(len(words))
+    ngrams = {}
+    hashes = words
+    for order in range(1, max(orders) + 1) :
+        if order > 1 :
+            hashes = hashes[:-1] * HASH_MULTIPLIER + words[order - 1:]
+        if order in orders :
+            complete = remaining[:len(hashes)] >= order
+            ngrams[order] = (hashes[complete], sentence_ids[:len(hashes)][complete])
+    return ngrams
+
+def _merge_hashes(arrays: List[np.ndarray]) -> np.ndarray :
+    return np.unique(np.concatenate(arrays + [np.zeros(0, dtype=np.uint64)]))
+
+def training_sources(train_file: str) -> List[list] :
+    """The files of a training corpus with their size and modification time."""
+    return [[str(path), path.stat().st_size, path.stat().st_mtime_ns] for path in expand_paths(train_file)]
+
+def load_index_metadata(index_directory: Path) -> dict :
+    metadata_path = Path(index_directory) / "index.json"
+    if not metadata_path.exists() :
+        return {}
+    with open(metadata_path) as metadata_file :
+        return json.load(metadata_file)
+
+def build_index(train_file: str,
+                index_directory: str,
+                orders: Sequence[int]=(3, 4, 5),
+                batch_size: int=100_000,
+                max_pending: int=20_000_000,
+                casefold: bool=False,
+                force: bool=False) -> dict :
+    """
+    Hash the utterances and the k-grams of a training corpus into sorted\
+    arrays, unless the index of the same files and orders already exists.
+
+    Parameters
+    ----------
+    - train_file: str
+        The training file, possibly compressed or a glob pattern of shards.
+    - index_directory: str
+        Where to store the index.
+    - orders: list
+        The orders of the indexed k-grams.
+    - batch_size: int
+        The number of utterances hashed at once.
+    - max_pending: int
+        The number of hashes kept before removing the duplicates.
+    - casefold: bool
+        Whether to casefold the tokens before hashing them.
+    - force: bool
+        Whether to build the index even if it is up to date.
+
+    Return
+    ------
+    - dict:
+        The metadata of the index (stored in index.json).
+    """
+    index_directory = Path(index_directory)
+    sources = training_sources(train_file)
+    metadata = load_index_metadata(index_directory)
+    if not force and metadata.get("version") == INDEX_VERSION and metadata.get("sources") == sources \
+            and metadata.get("orders") == sorted(orders) and metadata.get("casefold") == casefold :
+        return metadata
+    index_directory.mkdir(parents=True, exist_ok=True)
+    cache = {}
+    hashes = {order: [] for order in ["sentences"] + sorted(orders)}
+    pending = 0
+    n_sentences = 0
+
+    def add_batch(batch: List[List[str]]) -> None :
+        nonlocal pending
+        if casefold :
+            batch = casefold_sentences(batch)
+        hashes["sentences"].append(np.unique(np.fromiter((sentence_hash(sentence) for sentence in batch),
+                                                            dtype=np.uint64, count=len(batch))))
+        for order, (ngram_hashes, _) in hash_ngrams(batch, orders, cache).items() :
+            hashes[order].append(np.unique(ngram_hashes))
+        pending += sum(len(arrays[-1]) for arrays in hashes.values())
+        if pending > max_pending :
+            for key, arrays in hashes.items() :
+                hashes[key] = [_merge_hashes(arrays)]
+            pending = sum(len(arrays[0]) for arrays in hashes.values())
+
+    with span("hash") as stage :
+        batch = []
+        for sentence in read_sentences(train_file) :
+            batch.append(sentence)
+            if len(batch) == batch_size :
+                add_batch(batch)
+                n_sentences += len(batch)
+                batch = []
+        if batch :
+            add_batch(batch)
+            n_sentences += len(batch)
+        stage.add(n_sentences)
+    sizes = {}
+    for key, arrays in hashes.items() :
+        name = key if key == "sentences" else f"{key}grams"
+        merged = _merge_hashes(arrays)
+        np.save(index_directory / f"{name}.npy", merged)
+        sizes[name] = len(merged)
+    metadata = {"version": INDEX_VERSION,
+                "sources": sources,
+                "orders": sorted(orders),
+                "casefold": casefold,
+                "utterances": n_sentences,
+                "sizes": sizes}
+    tmp_path = index_directory / "index.json.tmp"
+    with open(tmp_path, mode="w") as metadata_file :
+        json.dump(metadata, metadata_file, indent=1)
+    os.replace(tmp_path, index_directory / "index.json")
+    return metadata
+
+def load_index(index_directory: str) -> Dict[object, np.ndarray] :
+    """Memory map the sorted hashes of an index: "sentences" and each order."""
+    metadata = load_index_metadata(Path(index_directory))
+    if not metadata :
+        raise FileNotFoundError(f"No leakage index in {index_directory}")
+    index = {"sentences": np.load(Path(index_directory) / "sentences.npy", mmap_mode="r")}
+    for order in metadata["orders"] :
+        index[order] = np.load(Path(index_directory) / f"{order}grams.npy", mmap_mode="r")
+    return index
+
+def contains(sorted_hashes: np.ndarray, queries: np.ndarray) -> np.ndarray :
+    """Whether each query is in a sorted array of hashes."""
+    if not len(sorted_hashes) :
+        return np.zeros(len(queries), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_hashes, queries), len(sorted_hashes) - 1)
+    return np.asarray(sorted_hashes[positions] == queries)
+
+def check_sentences(sentences: Sequence[Sequence[str]],
+                    index: Dict[object, np.ndarray],
+                    casefold: bool=False) -> Dict[str, np.ndarray] :
+    """
+    Look up tokenized sentences in an index, casefolding their tokens\
+    if the index was built with `casefold`.
+
+    Return
+    ------
+    - dict:
+        For "exact", whether each sentence is an utterance of the corpus,\
+        and for each indexed order k, whether it contains a k-gram of the corpus.
+    """
+    orders = [key for key in index if key != "sentences"]
+    if casefold :
+        sentences = casefold_sentences(sentences)
+    queries = np.fromiter((sentence_hash(sentence) for sentence in sentences), dtype=np.uint64, count=len(sentences))
+    found = {"exact": contains(index["sentences"], queries)}
+    for order, (ngram_hashes, sentence_ids) in hash_ngrams(sentences, orders, {}).items() :
+        seen = sentence_ids[contains(index[order], ngram_hashes)]
+        found[f"{order}gram"] = np.bincount(seen, minlength=len(sentences)) > 0
+    return found
+
+def check_tasks(tasks: Dict[str, List[Tuple[str, str]]],
+                index_directories: Dict[str, str],
+                filter_on: str="exact") -> pd.DataFrame :
+    """
+    Check every pair of the tasks against the index of each tokenization.
+
+    Parameters
+    ----------
+    - tasks: dict
+        The pairs of each task, as returned by `load_tasks`.
+    - index_directories: dict
+        The index directory of each tokenization (keys of TOKENIZATIONS).
+    - filter_on: str
+        "exact", or a "<k>gram" of the indexed orders: a pair is leaked if\
+        one of its sentences is an utterance of a corpus, or contains a\
+        k-gram of a corpus.
+
+    Return
+    ------
+    - pd.DataFrame:
+        One row per tokenization, task and pair, with, for its grammatical\
+        (real_) and ungrammatical (modified_) sentences, the checks of\
+        `check_sentences`, and whether the pair is leaked in any tokenization.
+    """
+    frames = []
+    n_sentences = 2 * sum(len(pairs) for pairs in tasks.values())
+    for tokenization, index_directory in index_directories.items() :
+        index = load_index(index_directory)
+        with span(f"preprocess {tokenization}", items=n_sentences) :
+            preprocessed = preprocess_tasks(tasks, *TOKENIZATIONS[tokenization])
+        # Task sentences repeat a lot across pairs: each one is looked up once.
+        sentence_ids = {}
+        for real_sentences, modified_sentences in preprocessed.values() :
+            for sentence in real_sentences + modified_sentences :
+                sentence_ids.setdefault(" ".join(sentence), len(sentence_ids))
+        casefold = load_index_metadata(Path(index_directory)).get("casefold", False)
+        with span(f"lookup {tokenization}", items=len(sentence_ids)) :
+            found = check_sentences([sentence.split(" ") for sentence in sentence_ids], index, casefold)
+        if filter_on not in found :
+            raise ValueError(f"Cannot filter on {filter_on}, the index has {', '.join(found)}")
+        for task_name, (real_sentences, modified_sentences) in preprocessed.items() :
+            real_ids = np.array([sentence_ids[" ".join(sentence)] for sentence in real_sentences], dtype=np.int64)
+            modified_ids = np.array([sentence_ids[" ".join(sentence)] for sentence in modified_sentences], dtype=np.int64)
+            frame = pd.DataFrame({"tokenization": tokenization, "task": task_name, "pair": np.arange(len(real_ids))})
+            for check, values in found.items() :
+                frame[f"real_{check}"] = values[real_ids]
+                frame[f"modified_{check}"] = values[modified_ids]
+            frame["leaked"] = frame[f"real_{filter_on}"] | frame[f"modified_{filter_on}"]
+            frames.append(frame)
+    pairs = pd.concat(frames, ignore_index=True)
+    pairs["leaked"] = pairs.groupby(["task", "pair"]).leaked.transform("any")
+    return pairs
+
+def leakage_report(pairs: pd.DataFrame) -> pd.DataFrame :
+    """The number of pairs of each tokenization and task, and the proportion of pairs of each check."""
+    checks = [column for column in pairs.columns if column.startswith(("real_", "modified_"))] + ["leaked"]
+    report = pairs.groupby(["tokenization", "task"], sort=False)[checks].mean()
+    report.insert(0, "pairs", pairs.groupby(["tokenization", "task"], sort=False).size())
+    return report.reset_index()
+
+def write_filtered_tasks(tasks: Dict[str, List[Tuple[str, str]]],
+                            pairs: pd.DataFrame,
+                            out_folder: str) -> Dict[str, int] :
+    """
+    Write the pairs that are not leaked, in the format of the task csvs.
+
+    Return
+    ------
+    - dict:
+        The number of pairs kept in each task.
+    """
+    Path(out_folder).mkdir(parents=True, exist_ok=True)
+    leaked = pairs.drop_duplicates(["task", "pair"]).set_index(["task", "pair"]).leaked
+    kept = {}
+    for task_name, task_pairs in tasks.items() :
+        task_leaked = leaked.loc[task_name].sort_index().values
+        with open(Path(out_folder) / f"{task_name}.csv", mode="w", encoding="utf-8", newline="") as task_file :
+            csv_writer = csv.writer(task_file, delimiter="\t")
+            csv_writer.writerows(pair for pair, is_leaked in zip(task_pairs, task_leaked) if not is_leaked)
+        kept[task_name] = int(np.sum(~task_leaked))
+    return kept
+
+if __name__ == "__main__" :
+    from argparse import ArgumentParser
+    from preprocessing_tools import load_lexicon
+    parser = ArgumentParser()
+    parser.add_argument("--tasks_folder",
+                        type=str,
+                        help="The folder containing the tasks",
+                        required=True)
+    parser.add_argument("--tokenized_directory",
+                        type=str,
+                        default="data/tokenized",
+                        help="The directory of the training files written by create_training_files.py.")
+    parser.add_argument("--index_directory",
+                        type=str,
+                        default="data/leakage_index",
+                        help="Where the index of each tokenization is stored.")
+    parser.add_argument("--tokenizations",
+                        nargs="+",
+                        choices=list(TOKENIZATIONS),
+                        default=["orthographic_words"],
+                        help="The tokenizations of the training files to check.")
+    parser.add_argument("--orders",
+                        type=int,
+                        nargs="+",
+                        default=[3, 4, 5],
+                        help="The orders of the indexed n-grams.")
+    parser.add_argument("--filter_on",
+                        type=str,
+                        default="exact",
+                        help="What makes a pair leaked: 'exact' (a sentence is an utterance of the corpus)\
+                            or '<k>gram' (a sentence contains a k-gram of the corpus, k being an indexed order).")
+    parser.add_argument("--filtered_tasks_folder",
+                        type=str,
+                        default=None,
+                        help="If given, the pairs that are not leaked are written there, one csv per task.")
+    parser.add_argument("--lexicon",
+                        type=str,
+                        default=None,
+                        help="A phonemization lexicon used to phonemize task sentences word by word.")
+    parser.add_argument("--force",
+                        action="store_true",
+                        help="Build the index again even if it is up to date.")
+    parser.add_argument("--out_filename",
+                        type=str,
+                        help="The report is written to results/<out_filename>.csv\
+                            and the checks of each pair to results/<out_filename>_pairs.csv",
+                        required=True)
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+
+    with profiling(args.profile, args.cprofile) :
+        if args.lexicon :
+            load_lexicon(args.lexicon)
+        index_directories = {}
+        for tokenization in args.tokenizations :
+            index_directories[tokenization] = str(Path(args.index_directory) / tokenization)
+            with span(f"index {tokenization}") :
+                metadata = build_index(str(Path(args.tokenized_directory) / TRAINING_FILES[tokenization]),
+                                        index_directories[tokenization],
+                                        args.orders,
+                                        casefold=tokenization in CASEFOLDED_TOKENIZATIONS,
+                                        force=args.force)
+            print(f"{tokenization}: {metadata['utterances']} utterances indexed ({metadata['sizes']})")
+        tasks = load_tasks(args.tasks_folder)
+        pairs = check_tasks(tasks, index_directories, args.filter_on)
+        report = leakage_report(pairs)
+        out_directory = Path("results")
+        out_directory.mkdir(exist_ok=True, parents=True)
+        report.to_csv(out_directory / f"{args.out_filename}.csv", index=False)
+        pairs.to_csv(out_directory / f"{args.out_filename}_pairs.csv", index=False)
+        print(report.round(4).to_string(index=False))
+        if args.filtered_tasks_folder :
+            kept = write_filtered_tasks(tasks, pairs, args.filtered_tasks_folder)
+            for task_name, task_pairs in tasks.items() :
+                print(f"{task_name}: {kept[task_name]} of {len(task_pairs)} pairs kept")
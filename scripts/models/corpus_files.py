@@ -0,0 +1,114 @@
+"""This module reads and writes the tokenized training files, one\
+utterance per line, either as plain text or as gzip or zstd compressed\
+shards."""
+import glob
+import gzip
+from pathlib import Path
+from typing import IO, List, Sequence
+
+COMPRESSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+def open_text(path: str, mode: str="r", buffer_size: int=1 << 20) -> IO[str]:
+    """
+    Open a text file, compressed or not depending on its extension\
+    (.gz for gzip, .zst for zstd).
+
+    Parameters
+    ----------
+    - path: str
+        The path of the file.
+    - mode: str
+        "r" or "w".
+    - buffer_size: int
+        The size of the write buffer of uncompressed files.
+
+    Return
+    ------
+    - file object:
+        The opened file, in text mode.
+    """
+    suffix = Path(path).suffix
+    if suffix == ".gz" :
+        return gzip.open(path, mode=f"{mode}t", encoding="utf-8")
+    if suffix == ".zst" :
+        try :
+            import zstandard
+        except ImportError :
+            raise ImportError("Reading or writing .zst files requires the zstandard package.")
+        return zstandard.open(path, mode=f"{mode}t", encoding="utf-8")
+    return open(path, mode=mode, encoding="utf-8", buffering=buffer_size)
+
+def expand_paths(train_file: str) -> List[Path]:
+    """
+    Get the files of a training corpus: the file itself if it exists,\
+    otherwise the files matching it as a glob pattern (e.g. the shards\
+    `providence_orthographic_tokenized_in_words.*.txt.zst`), in sorted order.
+    """
+    if Path(train_file).is_file() :
+        return [Path(train_file)]
+    paths = sorted(Path(path) for path in glob.glob(str(train_file)))
+    if not paths :
+        raise FileNotFoundError(f"No training file matches {train_file}")
+    return paths
+
+class ShardedWriter:
+    """
+    Buffered writer of a training file, optionally compressed and split\
+    into shards of a given number of lines.
+
+    Lines are written by batches: each batch is joined into a single string\
+    before being written. Without sharding, the output is `path` (plus the\
+    compression extension); with sharding, the shards are\
+    `<stem>.00000.txt`, `<stem>.00001.txt`... next to `path`.
+    """
+    def __init__(self,
+                    path: str,
+                    compression: str=None,
+                    shard_size: int=None,
+                    buffer_size: int=1 << 20) :
+        if compression not in COMPRESSIONS :
+            raise ValueError(f"Unknown compression {compression}, expected one of {list(COMPRESSIONS)}")
+        self.path = Path(path)
+        self.extension = COMPRESSIONS[compression]
+        self.shard_size = shard_size
+        self.buffer_size = buffer_size
+        self.paths = []
+        self.file = None
+        self.lines_in_shard = 0
+
+    def _next_file(self) -> None:
+        """Close the current shard and open the next one."""
+        if self.file is not None :
+            self.file.close()
+        if self.shard_size is None :
+            path = self.path.with_name(self.path.name + self.extension)
+        else :
+            path = self.path.with_name(f"{self.path.stem}.{len(self.paths):05d}{self.path.suffix}{self.extension}")
+        self.file = open_text(path, mode="w", buffer_size=self.buffer_size)
+        self.paths.append(path)
+        self.lines_in_shard = 0
+
+    def write_lines(self, lines: Sequence[str]) -> None:
+        """Write a batch of lines (without their newline)."""
+        start = 0
+        while start < len(lines) or self.file is None :
+            if self.file is None or (self.shard_size is not None and self.lines_in_shard >= self.shard_size) :
+                self._next_file()
+            end = len(lines) if self.shard_size is None \
+                else min(len(lines), start + self.shard_size - self.lines_in_shard)
+            if end > start :
+                self.file.write("\n".join(lines[start:end]) + "\n")
+            self.lines_in_shard += end - start
+            start = end
+
+    def close(self) -> None:
+        """Close the current file, creating an empty one if nothing was written."""
+        if self.file is None :
+            self._next_file()
+        self.file.close()
+
+    def __enter__(self) -> "ShardedWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,275 @@
+"""This module implements an LSTM language model trained and evaluated\
+on CPU with PyTorch.
+"""
+import sys
+from collections import Counter
+from pathlib import Path
+from typing import List, Sequence
+import numpy as np
+import torch
+from torch import nn
+from torch.nn.utils.rnn import pad_sequence, pack_padded_sequence, pad_packed_sequence
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from models.ngram_estimators import read_sentences
+from models.ngram_store import SPECIAL_TOKENS, UNK_ID, BOS_ID, EOS_ID
+from models.scorer import Scorer
+
+PAD_ID = -100
+
+class _LSTMNetwork(nn.Module):
+    def __init__(self,
+                    vocabulary_size: int,
+                    embedding_dim: int,
+                    hidden_dim: int,
+                    num_layers: int,
+                    dropout: float) :
+        super().__init__()
+        self.embeddings = nn.Embedding(vocabulary_size, embedding_dim)
+        self.lstm = nn.LSTM(embedding_dim,
+                            hidden_dim,
+                            num_layers=num_layers,
+                            dropout=dropout if num_layers > 1 else 0.0,
+                            batch_first=True)
+        self.dropout = nn.Dropout(dropout)
+        self.output = nn.Linear(hidden_dim, vocabulary_size)
+
+    def forward(self, inputs: torch.Tensor, lengths: torch.Tensor, enforce_sorted: bool) -> torch.Tensor:
+        """Compute the log-softmax outputs of padded input sequences."""
+        packed = pack_padded_sequence(self.dropout(self.embeddings(inputs)),
+                                        lengths,
+                                        batch_first=True,
+                                        enforce_sorted=enforce_sorted)
+        outputs, _ = self.lstm(packed)
+        outputs, _ = pad_packed_sequence(outputs, batch_first=True)
+        return torch.log_softmax(self.output(self.dropout(outputs)), dim=-1)
+
+class LSTMLanguageModel(Scorer):
+    """
+    LSTM language model over any of the tokenizations produced by\
+    `create_training_files.py` (words or phonemes).
+
+    Scores are natural log-probabilities.
+    """
+    def __init__(self,
+                    embedding_dim: int=128,
+                    hidden_dim: int=256,
+                    num_layers: int=2,
+                    dropout: float=0.2,
+                    num_threads: int=None) :
+        self.config = {"embedding_dim": embedding_dim,
+                        "hidden_dim": hidden_dim,
+                        "num_layers": num_layers,
+                        "dropout": dropout}
+        self.vocabulary = []
+        self.word_to_id = {}
+        self.network = None
+        if num_threads :
+            self.set_num_threads(num_threads)
+
+    @staticmethod
+    def set_num_threads(num_threads: int) -> None:
+        """Set the number of threads used by PyTorch on CPU."""
+        torch.set_num_threads(num_threads)
+
+    def build_vocabulary(self, train_file: str, min_count: int=2) -> None:
+        """Build the vocabulary, mapping words seen less than min_count times to <unk>."""
+        frequencies = Counter(word for sentence in read_sentences(train_file) for word in sentence)
+        self.vocabulary = SPECIAL_TOKENS + [word for word, count in frequencies.most_common()
+                                            if count >= min_count and word not in SPECIAL_TOKENS]
+        self.word_to_id = {word: idx for idx, word in enumerate(self.vocabulary)}
+
+    def to_tensor(self, utterance: Sequence[str]) -> torch.Tensor:
+        """Map an utterance to its ids, padded with <s> and </s>."""
+        return torch.tensor([BOS_ID] + [self.word_to_id.get(word, UNK_ID) for word in utterance] + [EOS_ID],
+                            dtype=torch.long)
+
+    def _batch_loss(self, sequences: List[torch.Tensor], enforce_sorted: bool) -> torch.Tensor:
+        """Compute the summed log-probabilities of each sequence of a batch."""
+        lengths = torch.tensor([len(sequence) - 1 for sequence in sequences])
+        inputs = pad_sequence([sequence[:-1] for sequence in sequences], batch_first=True)
+        targets = pad_sequence([sequence[1:] for sequence in sequences],
+                                batch_first=True,
+                                padding_value=PAD_ID)
+        log_probs = self.network(inputs, lengths, enforce_sorted)
+        mask = targets != PAD_ID
+        target_log_probs = log_probs.gather(-1, targets.clamp(min=0).unsqueeze(-1)).squeeze(-1)
+        return (target_log_probs * mask).sum(dim=1)
+
+    def estimate(self,
+                    train_file: str,
+                    epochs: int=5,
+                    batch_size: int=64,
+                    learning_rate: float=1e-3,
+                    min_count: int=2,
+                    clip: float=1.0,
+                    seed: int=0) -> None:
+        """
+        Train the model with Adam on batches of utterances of similar lengths.
+
+        Parameters
+        ----------
+        - train_file: str
+            The tokenized training file.
+        - epochs: int
+            The number of passes over the training utterances.
+        - batch_size: int
+            The number of utterances per batch.
+        - learning_rate: float
+            The learning rate of Adam.
+        - min_count: int
+            The minimal frequency of the words kept in the vocabulary.
+        - clip: float
+            The maximal norm of the gradients.
+        - seed: int
+            The random seed.
+        """
+        from tqdm import tqdm
+        torch.manual_seed(seed)
+        rng = np.random.default_rng(seed)
+        self.build_vocabulary(train_file, min_count)
+        self.network = _LSTMNetwork(len(self.vocabulary), **self.config)
+        optimizer = torch.optim.Adam(self.network.parameters(), lr=learning_rate)
+        sequences = sorted((self.to_tensor(sentence) for sentence in read_sentences(train_file)), key=len)
+        # Batches of utterances of similar lengths waste little computation on padding.
+        batches = [sequences[start:start + batch_size] for start in range(0, len(sequences), batch_size)]
+        for epoch in range(epochs) :
+            self.network.train()
+            total_log_prob, total_tokens = 0.0, 0
+            for batch_idx in tqdm(rng.permutation(len(batches)), desc=f"Epoch {epoch + 1}") :
+                batch = batches[batch_idx]
+                log_probs = self._batch_loss(batch, enforce_sorted=False)
+                n_tokens = sum(len(sequence) - 1 for sequence in batch)
+                loss = -log_probs.sum() / n_tokens
+                optimizer.zero_grad()
+                loss.backward()
+                nn.utils.clip_grad_norm_(self.network.parameters(), clip)
+                optimizer.step()
+                total_log_prob += log_probs.sum().item()
+                total_tokens += n_tokens
+            print(f"Epoch {epoch + 1}: perplexity {np.exp(-total_log_prob / total_tokens):.2f}")
+
+    def score_sentences(self,
+                        utterances: Sequence[Sequence[str]],
+                        batch_size: int=512) -> np.ndarray:
+        """
+        Compute the log-probabilities of many tokenized utterances.
+
+        Utterances are sorted by length and packed into padded batches, so that\
+        a whole task file is scored in a handful of forward passes.
+
+        Parameters
+        ----------
+        - utterances: list
+            The tokenized utterances.
+        - batch_size: int
+            The number of utterances per forward pass.
+
+        Return
+        ------
+        - np.ndarray:
+            The log-probability of each utterance, in the input order.
+        """
+        self.network.eval()
+        sequences = [self.to_tensor(utterance) for utterance in utterances]
+        order = sorted(range(len(sequences)), key=lambda idx: len(sequences[idx]), reverse=True)
+        log_probs = np.zeros(len(sequences))
+        with torch.no_grad() :
+            for start in range(0, len(order), batch_size) :
+                batch = order[start:start + batch_size]
+                log_probs[batch] = self._batch_loss([sequences[idx] for idx in batch],
+                                                    enforce_sorted=True).numpy()
+        return log_probs
+
+    score_batch = score_sentences
+
+    def save_parameters(self, out_directory: str, out_filename: str) -> Path:
+        """Save the model in a PyTorch .pt file."""
+        out_path = Path(out_directory) / f"{out_filename}.pt"
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        torch.save({"config": self.config,
+                    "vocabulary": self.vocabulary,
+                    "state_dict": self.network.state_dict()},
+                    out_path)
+        return out_path
+
+    def load_parameters(self, path: str) -> None:
+        """Load a model saved by `save_parameters`."""
+        checkpoint = torch.load(path, map_location="cpu")
+        self.config = checkpoint["config"]
+        self.vocabulary = checkpoint["vocabulary"]
+        self.word_to_id = {word: idx for idx, word in enumerate(self.vocabulary)}
+        self.network = _LSTMNetwork(len(self.vocabulary), **self.config)
+        self.network.load_state_dict(checkpoint["state_dict"])
+        self.network.eval()
+
+if __name__ == "__main__" :
+    from argparse import ArgumentParser
+    from instrumentation import add_profiling_arguments, profiling, span
+    parser = ArgumentParser()
+    parser.add_argument("--train_file",
+                        type=str,
+                        help="The tokenized train file.",
+                        required=True)
+    parser.add_argument("--embedding_dim",
+                        type=int,
+                        default=128,
+                        required=False)
+    parser.add_argument("--hidden_dim",
+                        type=int,
+                        default=256,
+                        required=False)
+    parser.add_argument("--num_layers",
+                        type=int,
+                        default=2,
+                        required=False)
+    parser.add_argument("--dropout",
+                        type=float,
+                        default=0.2,
+                        required=False)
+    parser.add_argument("--epochs",
+                        type=int,
+                        default=5,
+                        required=False)
+    parser.add_argument("--batch_size",
+                        type=int,
+                        default=64,
+                        required=False)
+    parser.add_argument("--learning_rate",
+                        type=float,
+                        default=1e-3,
+                        required=False)
+    parser.add_argument("--min_count",
+                        type=int,
+                        default=2,
+                        help="Words seen less often are replaced by <unk>.",
+                        required=False)
+    parser.add_argument("--num_threads",
+                        type=int,
+                        default=None,
+                        help="The number of CPU threads used by PyTorch.",
+                        required=False)
+    parser.add_argument("--out_directory",
+                        type=str,
+                        help="The directory where the model will be stored",
+                        required=True)
+    parser.add_argument("--out_filename",
+                        help="The filename for the model.",
+                        required=True)
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    with profiling(args.profile, args.cprofile) :
+        lstm_lm = LSTMLanguageModel(embedding_dim=args.embedding_dim,
+                                    hidden_dim=args.hidden_dim,
+                                    num_layers=args.num_layers,
+                                    dropout=args.dropout,
+                                    num_threads=args.num_threads)
+        print("Training the model...")
+        with span("estimate") :
+            lstm_lm.estimate(args.train_file,
+                                epochs=args.epochs,
+                                batch_size=args.batch_size,
+                                learning_rate=args.learning_rate,
+                                min_count=args.min_count)
+        print("Saving the model...")
+        with span("write") :
+            lstm_lm.save_parameters(args.out_directory, args.out_filename)
@@ -0,0 +1,282 @@
+"""This module implements a feed-forward neural n-gram language model\
+(Bengio et al., 2003) trained and evaluated on CPU with NumPy.
+"""
+import sys
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, Sequence, Tuple
+import numpy as np
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from models.ngram_estimators import read_sentences
+from models.ngram_store import SPECIAL_TOKENS, UNK_ID, BOS_ID, EOS_ID
+from models.scorer import Scorer
+
+class NeuralNGramLanguageModel(Scorer):
+    """
+    Feed-forward n-gram language model: the embeddings of the n-1 previous\
+    words are concatenated and fed to a tanh hidden layer followed by a\
+    softmax over the vocabulary.
+
+    Scores are natural log-probabilities.
+    """
+    def __init__(self,
+                    ngram_size: int=3,
+                    embedding_dim: int=64,
+                    hidden_dim: int=256,
+                    seed: int=0) :
+        self.ngram_size = ngram_size
+        self.embedding_dim = embedding_dim
+        self.hidden_dim = hidden_dim
+        self.rng = np.random.default_rng(seed)
+        self.vocabulary = []
+        self.word_to_id = {}
+        self.parameters = {}
+
+    def build_vocabulary(self, train_file: str, min_count: int=2) -> None:
+        """
+        Build the vocabulary once from the training file. Words seen less than\
+        min_count times are mapped to <unk>, so that <unk> is trained.
+        """
+        frequencies = Counter(word for sentence in read_sentences(train_file) for word in sentence)
+        self.vocabulary = SPECIAL_TOKENS + [word for word, count in frequencies.most_common()
+                                            if count >= min_count and word not in SPECIAL_TOKENS]
+        self.word_to_id = {word: idx for idx, word in enumerate(self.vocabulary)}
+
+    def init_parameters(self) -> None:
+        """Initialize the weights of the network."""
+        vocabulary_size = len(self.vocabulary)
+        input_dim = (self.ngram_size - 1) * self.embedding_dim
+        scale_hidden = np.sqrt(1.0 / input_dim)
+        scale_output = np.sqrt(1.0 / self.hidden_dim)
+        self.parameters = {
+            "embeddings": self.rng.normal(0, 0.1, (vocabulary_size, self.embedding_dim)),
+            "hidden_weights": self.rng.uniform(-scale_hidden, scale_hidden, (input_dim, self.hidden_dim)),
+            "hidden_bias": np.zeros(self.hidden_dim),
+            "output_weights": self.rng.uniform(-scale_output, scale_output, (self.hidden_dim, vocabulary_size)),
+            "output_bias": np.zeros(vocabulary_size),
+        }
+        self.parameters = {name: value.astype(np.float32) for name, value in self.parameters.items()}
+
+    def get_windows(self, utterances: Iterable[Sequence[str]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Turn utterances into (context, target) training or scoring examples.
+
+        Utterances are left-padded with n-1 <s> and end with </s>.
+
+        Return
+        ------
+        - tuple:
+            The context ids (number of examples, n-1), the target ids and\
+            the index of the utterance of each example.
+        """
+        contexts, targets, utterance_ids = [], [], []
+        for utterance_idx, utterance in enumerate(utterances) :
+            ids = [BOS_ID] * (self.ngram_size - 1) \
+                + [self.word_to_id.get(word, UNK_ID) for word in utterance] + [EOS_ID]
+            for idx in range(self.ngram_size - 1, len(ids)) :
+                contexts.append(ids[idx - self.ngram_size + 1:idx])
+                targets.append(ids[idx])
+                utterance_ids.append(utterance_idx)
+        return np.array(contexts, dtype=np.int64).reshape(-1, self.ngram_size - 1), \
+            np.array(targets, dtype=np.int64), \
+            np.array(utterance_ids, dtype=np.int64)
+
+    def _forward(self, contexts: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Compute the inputs, hidden activations and log-softmax outputs."""
+        inputs = self.parameters["embeddings"][contexts].reshape(len(contexts), -1)
+        hidden = np.tanh(inputs @ self.parameters["hidden_weights"] + self.parameters["hidden_bias"])
+        logits = hidden @ self.parameters["output_weights"] + self.parameters["output_bias"]
+        logits -= logits.max(axis=1, keepdims=True)
+        log_probs = logits - np.log(np.exp(logits).sum(axis=1, keepdims=True))
+        return inputs, hidden, log_probs
+
+    def _backward(self,
+                    contexts: np.ndarray,
+                    targets: np.ndarray,
+                    inputs: np.ndarray,
+                    hidden: np.ndarray,
+                    log_probs: np.ndarray) -> dict:
+        """Compute the gradients of the mean cross-entropy."""
+        batch_size = len(targets)
+        grad_logits = np.exp(log_probs)
+        grad_logits[np.arange(batch_size), targets] -= 1.0
+        grad_logits /= batch_size
+        grad_hidden = (grad_logits @ self.parameters["output_weights"].T) * (1.0 - hidden ** 2)
+        grad_inputs = grad_hidden @ self.parameters["hidden_weights"].T
+        grad_embeddings = np.zeros_like(self.parameters["embeddings"])
+        np.add.at(grad_embeddings,
+                    contexts.ravel(),
+                    grad_inputs.reshape(-1, self.embedding_dim))
+        return {"embeddings": grad_embeddings,
+                "hidden_weights": inputs.T @ grad_hidden,
+                "hidden_bias": grad_hidden.sum(axis=0),
+                "output_weights": hidden.T @ grad_logits,
+                "output_bias": grad_logits.sum(axis=0)}
+
+    def estimate(self,
+                    train_file: str,
+                    epochs: int=5,
+                    batch_size: int=512,
+                    learning_rate: float=1e-3,
+                    min_count: int=2) -> None:
+        """
+        Train the model with minibatched Adam.
+
+        Parameters
+        ----------
+        - train_file: str
+            The tokenized training file.
+        - epochs: int
+            The number of passes over the training examples.
+        - batch_size: int
+            The number of examples per minibatch.
+        - learning_rate: float
+            The learning rate of Adam.
+        - min_count: int
+            The minimal frequency of the words kept in the vocabulary.
+        """
+        from tqdm import tqdm
+        self.build_vocabulary(train_file, min_count)
+        self.init_parameters()
+        contexts, targets, _ = self.get_windows(read_sentences(train_file))
+        first_moments = {name: np.zeros_like(value) for name, value in self.parameters.items()}
+        second_moments = {name: np.zeros_like(value) for name, value in self.parameters.items()}
+        beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+        step = 0
+        for epoch in range(epochs) :
+            permutation = self.rng.permutation(len(targets))
+            total_loss = 0.0
+            for start in tqdm(range(0, len(targets), batch_size), desc=f"Epoch {epoch + 1}") :
+                batch = permutation[start:start + batch_size]
+                inputs, hidden, log_probs = self._forward(contexts[batch])
+                total_loss -= log_probs[np.arange(len(batch)), targets[batch]].sum()
+                gradients = self._backward(contexts[batch], targets[batch], inputs, hidden, log_probs)
+                step += 1
+                for name, gradient in gradients.items() :
+                    first_moments[name] = beta1 * first_moments[name] + (1 - beta1) * gradient
+                    second_moments[name] = beta2 * second_moments[name] + (1 - beta2) * gradient ** 2
+                    corrected_first = first_moments[name] / (1 - beta1 ** step)
+                    corrected_second = second_moments[name] / (1 - beta2 ** step)
+                    self.parameters[name] -= (learning_rate * corrected_first
+                                                / (np.sqrt(corrected_second) + epsilon)).astype(np.float32)
+            print(f"Epoch {epoch + 1}: perplexity {np.exp(total_loss / len(targets)):.2f}")
+
+    def score_sentences(self,
+                        utterances: Sequence[Sequence[str]],
+                        chunk_size: int=8192) -> np.ndarray:
+        """
+        Compute the log-probabilities of many tokenized utterances at once.
+
+        All the (context, target) windows of all the utterances are stacked\
+        and scored by chunks, so an entire task file takes a few matrix\
+        multiplications.
+
+        Parameters
+        ----------
+        - utterances: list
+            The tokenized utterances.
+        - chunk_size: int
+            The number of windows scored per forward pass.
+
+        Return
+        ------
+        - np.ndarray:
+            The log-probability of each utterance.
+        """
+        contexts, targets, utterance_ids = self.get_windows(utterances)
+        window_log_probs = np.zeros(len(targets))
+        for start in range(0, len(targets), chunk_size) :
+            _, _, log_probs = self._forward(contexts[start:start + chunk_size])
+            window_log_probs[start:start + chunk_size] = \
+                log_probs[np.arange(len(log_probs)), targets[start:start + chunk_size]]
+        return np.bincount(utterance_ids, weights=window_log_probs, minlength=len(utterances))
+
+    score_batch = score_sentences
+
+    def save_parameters(self, out_directory: str, out_filename: str) -> Path:
+        """Save the model in a NumPy .npz archive."""
+        out_path = Path(out_directory) / f"{out_filename}.npz"
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(out_path,
+                    ngram_size=self.ngram_size,
+                    embedding_dim=self.embedding_dim,
+                    hidden_dim=self.hidden_dim,
+                    vocabulary=np.array(self.vocabulary),
+                    **self.parameters)
+        return out_path
+
+    def load_parameters(self, path: str) -> None:
+        """Load a model saved by `save_parameters`."""
+        archive = np.load(path)
+        self.ngram_size = int(archive["ngram_size"])
+        self.embedding_dim = int(archive["embedding_dim"])
+        self.hidden_dim = int(archive["hidden_dim"])
+        self.vocabulary = archive["vocabulary"].tolist()
+        self.word_to_id = {word: idx for idx, word in enumerate(self.vocabulary)}
+        self.parameters = {name: archive[name] for name in ("embeddings",
+                                                            "hidden_weights",
+                                                            "hidden_bias",
+                                                            "output_weights",
+                                                            "output_bias")}
+
+if __name__ == "__main__" :
+    from argparse import ArgumentParser
+    from instrumentation import add_profiling_arguments, profiling, span
+    parser = ArgumentParser()
+    parser.add_argument("--train_file",
+                        type=str,
+                        help="The tokenized train file.",
+                        required=True)
+    parser.add_argument("--ngram_size",
+                        type=int,
+                        default=3,
+                        help="The size of the n-grams (context + predicted word).",
+                        required=False)
+    parser.add_argument("--embedding_dim",
+                        type=int,
+                        default=64,
+                        required=False)
+    parser.add_argument("--hidden_dim",
+                        type=int,
+                        default=256,
+                        required=False)
+    parser.add_argument("--epochs",
+                        type=int,
+                        default=5,
+                        required=False)
+    parser.add_argument("--batch_size",
+                        type=int,
+                        default=512,
+                        required=False)
+    parser.add_argument("--learning_rate",
+                        type=float,
+                        default=1e-3,
+                        required=False)
+    parser.add_argument("--min_count",
+                        type=int,
+                        default=2,
+                        help="Words seen less often are replaced by <unk>.",
+                        required=False)
+    parser.add_argument("--out_directory",
+                        type=str,
+                        help="The directory where the model will be stored",
+                        required=True)
+    parser.add_argument("--out_filename",
+                        help="The filename for the model.",
+                        required=True)
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    with profiling(args.profile, args.cprofile) :
+        neural_lm = NeuralNGramLanguageModel(ngram_size=args.ngram_size,
+                                                embedding_dim=args.embedding_dim,
+                                                hidden_dim=args.hidden_dim)
+        print("Training the model...")
+        with span("estimate") :
+            neural_lm.estimate(args.train_file,
+                                epochs=args.epochs,
+                                batch_size=args.batch_size,
+                                learning_rate=args.learning_rate,
+                                min_count=args.min_count)
+        print("Saving the model...")
+        with span("write") :
+            neural_lm.save_parameters(args.out_directory, args.out_filename)
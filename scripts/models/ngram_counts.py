@@ -0,0 +1,189 @@
+"""This module counts n-grams in bounded memory.
+
+Counts are accumulated in memory until a given number of distinct n-grams\
+is reached, then sorted and spilled to disk. The spilled runs are finally\
+merged (external merge sort) into one sorted table per order, stored as raw\
+binary files that are memory mapped when read back.
+"""
+import shutil
+import tempfile
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, Sequence, Tuple
+import numpy as np
+from .ngram_store import UNK_ID, BOS_ID, EOS_ID
+from .ngram_estimators import NGramCounts, sort_ngrams
+
+MERGE_BLOCK_SIZE = 2 ** 16
+
+def write_counts(ids: np.ndarray, counts: np.ndarray, prefix: Path) -> None:
+    """Write sorted n-grams and their counts under a given prefix."""
+    np.ascontiguousarray(ids, dtype=np.uint32).tofile(f"{prefix}.ids")
+    np.ascontiguousarray(counts, dtype=np.int64).tofile(f"{prefix}.counts")
+
+def _write_run(counter: Counter, order: int, prefix: Path) -> None:
+    """Sort the counts of a counter and write them as a run on disk."""
+    ids = np.array(list(counter.keys()), dtype=np.uint32).reshape(-1, order)
+    counts = np.fromiter(counter.values(), dtype=np.int64, count=len(counter))
+    write_counts(*sort_ngrams(ids, counts), prefix)
+
+def load_counts(prefix: Path, order: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Memory map the sorted n-grams and counts stored under a given prefix.
+    """
+    ids_path, counts_path = Path(f"{prefix}.ids"), Path(f"{prefix}.counts")
+    if not counts_path.stat().st_size :
+        return np.zeros((0, order), dtype=np.uint32), np.zeros(0, dtype=np.int64)
+    return np.memmap(ids_path, dtype=np.uint32, mode="r").reshape(-1, order), \
+        np.memmap(counts_path, dtype=np.int64, mode="r")
+
+def _rows_up_to(ids: np.ndarray, bound: np.ndarray) -> int:
+    """Count the leading rows of sorted n-grams that are lexicographically\
+    lower than or equal to a bound n-gram."""
+    differences = ids != bound
+    first = differences.argmax(axis=1)
+    lower = ~differences.any(axis=1) | (ids[np.arange(len(ids)), first] < bound[first])
+    return int(np.count_nonzero(lower))
+
+def merge_counts(runs: Sequence[Tuple[np.ndarray, np.ndarray]],
+                    order: int,
+                    prefix: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merge sorted runs of n-gram counts, summing the counts of identical\
+    n-grams, and write the result under the given prefix.
+
+    The runs are merged block by block: at each step, the next block of\
+    every run is read, and all the n-grams up to the smallest last n-gram\
+    of these blocks are merged with `sum_counts`, so that memory only holds\
+    one block per run.
+
+    Parameters
+    ----------
+    - runs: list
+        Sorted (ids, counts) arrays, possibly memory mapped.
+    - order: int
+        The order of the n-grams.
+    - prefix: Path
+        The prefix of the output files.
+
+    Return
+    ------
+    - tuple:
+        The memory mapped merged ids and counts.
+    """
+    runs = [(np.asarray(ids).reshape(-1, order), counts) for ids, counts in runs]
+    positions = [0] * len(runs)
+    with open(f"{prefix}.ids", mode="wb") as ids_file, \
+            open(f"{prefix}.counts", mode="wb") as counts_file :
+        while True :
+            blocks = [(ids[position:position + MERGE_BLOCK_SIZE], counts, position)
+                        for (ids, counts), position in zip(runs, positions)]
+            if not any(len(block) for block, _, _ in blocks) :
+                break
+            # N-grams after this bound may still appear in the next block of a run.
+            bound = min((tuple(block[-1]) for block, _, _ in blocks if len(block)))
+            bound = np.array(bound, dtype=np.uint32)
+            merged = []
+            for run, (block, counts, position) in enumerate(blocks) :
+                if not len(block) :
+                    continue
+                n_rows = _rows_up_to(block, bound)
+                merged.append((block[:n_rows], counts[position:position + n_rows]))
+                positions[run] += n_rows
+            ids, counts = sum_counts(merged, order)
+            ids.tofile(ids_file)
+            counts.tofile(counts_file)
+    return load_counts(prefix, order)
+
+def sum_counts(runs: Sequence[Tuple[np.ndarray, np.ndarray]], order: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sum the counts of identical n-grams over runs held in memory, which\
+    do not need to be sorted (e.g. counts whose word ids were remapped).
+
+    Return
+    ------
+    - tuple:
+        The sorted distinct n-grams and their summed counts.
+    """
+    ids = np.concatenate([np.asarray(ids, dtype=np.uint32).reshape(-1, order) for ids, _ in runs]
+                            + [np.zeros((0, order), dtype=np.uint32)])
+    counts = np.concatenate([np.asarray(counts, dtype=np.int64) for _, counts in runs]
+                            + [np.zeros(0, dtype=np.int64)])
+    if not len(counts) :
+        return ids, counts
+    ids, counts = sort_ngrams(ids, counts)
+    starts = np.flatnonzero(np.concatenate([[True], np.any(ids[1:] != ids[:-1], axis=1)]))
+    return ids[starts], np.add.reduceat(counts, starts)
+
+def count_ngrams_external(sentences: Iterable[Sequence[str]],
+                            vocabulary: Sequence[str],
+                            ngram_size: int,
+                            out_directory: str,
+                            max_entries: int=5_000_000,
+                            tmp_directory: str=None) -> NGramCounts:
+    """
+    Count all the n-grams of order 1 to ngram_size in bounded memory.
+
+    Utterances are padded with a single <s> and a single </s>, as in\
+    `ngram_estimators.count_ngrams`.
+
+    Parameters
+    ----------
+    - sentences: iterable
+        The tokenized utterances.
+    - vocabulary: list
+        The vocabulary, as returned by `build_vocabulary`.
+    - ngram_size: int
+        The maximal order.
+    - out_directory: str
+        The directory where the sorted counts of each order will be stored.
+    - max_entries: int
+        The maximal number of distinct n-grams (all orders together)\
+        kept in memory before spilling to disk.
+    - tmp_directory: str
+        Where to spill the sorted runs. Defaults to the system temporary\
+        directory.
+
+    Return
+    ------
+    - list:
+        For each order, the memory mapped sorted ids and counts.
+    """
+    out_directory = Path(out_directory)
+    out_directory.mkdir(parents=True, exist_ok=True)
+    spill_directory = Path(tempfile.mkdtemp(dir=tmp_directory, prefix="ngram_counts_"))
+    word_to_id = {word: idx for idx, word in enumerate(vocabulary)}
+    counters = [Counter() for _ in range(ngram_size)]
+    n_runs = 0
+    try :
+        for sentence in sentences :
+            ids = [BOS_ID] + [word_to_id.get(word, UNK_ID) for word in sentence] + [EOS_ID]
+            for order, counter in enumerate(counters, start=1) :
+                counter.update(tuple(ids[idx:idx + order]) for idx in range(len(ids) - order + 1))
+            if sum(len(counter) for counter in counters) >= max_entries :
+                for order, counter in enumerate(counters, start=1) :
+                    _write_run(counter, order, spill_directory / f"run_{n_runs}_order_{order}")
+                    counter.clear()
+                n_runs += 1
+        counts = []
+        for order, counter in enumerate(counters, start=1) :
+            prefix = out_directory / f"order_{order}"
+            if not n_runs :
+                _write_run(counter, order, prefix)
+                counts.append(load_counts(prefix, order))
+                continue
+            if counter :
+                _write_run(counter, order, spill_directory / f"run_{n_runs}_order_{order}")
+            counter.clear()
+            runs = [load_counts(spill_directory / f"run_{run}_order_{order}", order)
+                    for run in range(n_runs + 1)
+                    if Path(spill_directory / f"run_{run}_order_{order}.ids").exists()]
+            counts.append(merge_counts(runs, order, prefix))
+    finally :
+        shutil.rmtree(spill_directory, ignore_errors=True)
+    return counts
+
+def load_count_directory(directory: str, ngram_size: int) -> NGramCounts:
+    """Memory map the counts written by `count_ngrams_external`."""
+    return [load_counts(Path(directory) / f"order_{order}", order)
+            for order in range(1, ngram_size + 1)]
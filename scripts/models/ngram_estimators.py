@@ -0,0 +1,268 @@
+"""This module implements the counting of n-grams and the estimation\
+of backoff n-gram language models that are written in the compact\
+binary format of `ngram_store`."""
+from collections import Counter
+from typing import Iterable, List, Sequence, Tuple
+import numpy as np
+from .corpus_files import open_text, expand_paths
+from .ngram_store import SPECIAL_TOKENS, UNK_ID, BOS_ID, EOS_ID, MIN_LOGPROB, hash_ngrams
+
+# For each order, the sorted n-gram ids and their counts.
+NGramCounts = List[Tuple[np.ndarray, np.ndarray]]
+
+def read_sentences(train_file: str) -> Iterable[List[str]]:
+    """
+    Read a tokenized training file, one utterance per line.
+
+    Parameters
+    ----------
+    - train_file: str
+        The path of the training file, possibly gzip (.gz) or zstd (.zst)\
+        compressed, or a glob pattern matching its shards.
+
+    Return
+    ------
+    - iterable:
+        The list of tokens of each non-empty utterance.
+    """
+    for path in expand_paths(train_file) :
+        with open_text(path, mode="r") as sentences :
+            for sentence in sentences :
+                tokens = sentence.split()
+                if tokens :
+                    yield tokens
+
+def build_vocabulary(sentences: Iterable[Sequence[str]]) -> List[str]:
+    """
+    Build the vocabulary of a corpus, special tokens first and then\
+    words sorted by decreasing frequency.
+    """
+    frequencies = Counter(word for sentence in sentences for word in sentence)
+    for token in SPECIAL_TOKENS :
+        frequencies.pop(token, None)
+    return SPECIAL_TOKENS + [word for word, _ in frequencies.most_common()]
+
+def sort_ngrams(ids: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sort n-grams lexicographically on their word ids."""
+    permutation = np.lexsort(ids.T[::-1])
+    return ids[permutation], counts[permutation]
+
+def count_ngrams(sentences: Iterable[Sequence[str]],
+                    vocabulary: Sequence[str],
+                    ngram_size: int) -> NGramCounts:
+    """
+    Count all the n-grams of order 1 to ngram_size in memory.
+
+    Utterances are padded with a single <s> and a single </s>.
+
+    Return
+    ------
+    - list:
+        For each order n, an array of shape (number of ngrams, n) of\
+        lexicographically sorted word ids and the array of their counts.
+    """
+    word_to_id = {word: idx for idx, word in enumerate(vocabulary)}
+    counters = [Counter() for _ in range(ngram_size)]
+    for sentence in sentences :
+        ids = [BOS_ID] + [word_to_id.get(word, UNK_ID) for word in sentence] + [EOS_ID]
+        for order, counter in enumerate(counters, start=1) :
+            counter.update(tuple(ids[idx:idx + order]) for idx in range(len(ids) - order + 1))
+    counts = []
+    for order, counter in enumerate(counters, start=1) :
+        ids = np.array(list(counter.keys()), dtype=np.uint32).reshape(-1, order)
+        values = np.fromiter(counter.values(), dtype=np.int64, count=len(counter))
+        counts.append(sort_ngrams(ids, values))
+    return counts
+
+def context_groups(ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Group lexicographically sorted n-grams by their context (all the words\
+    but the last one).
+
+    Return
+    ------
+    - tuple:
+        The index of the group of each n-gram and the index of the first\
+        n-gram of each group.
+    """
+    if ids.shape[1] == 1 :
+        return np.zeros(len(ids), dtype=np.int64), np.zeros(min(len(ids), 1), dtype=np.int64)
+    contexts = ids[:, :-1]
+    starts = np.ones(len(ids), dtype=bool)
+    starts[1:] = np.any(contexts[1:] != contexts[:-1], axis=1)
+    return np.cumsum(starts) - 1, np.flatnonzero(starts)
+
+def stupid_backoff(counts: NGramCounts,
+                    alpha: float=0.4,
+                    unk_logprob: float=-6.0) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Estimate a stupid backoff model (Brants et al., 2007) from raw counts.
+
+    The scores are relative frequencies, multiplied by alpha at each\
+    backoff step. They are not normalized probabilities but are good enough\
+    to compare sentences.
+
+    Parameters
+    ----------
+    - counts: list
+        The counts returned by `count_ngrams`.
+    - alpha: float
+        The backoff penalty.
+    - unk_logprob: float
+        The log10 score of unknown words.
+
+    Return
+    ------
+    - list:
+        For each order, the (ids, logprobs, backoffs) arrays expected by\
+        `write_ngram_store`.
+    """
+    orders = []
+    for order, (ids, ngram_counts) in enumerate(counts, start=1) :
+        groups, _ = context_groups(ids)
+        if order == 1 :
+            predicted = ids[:, 0] != BOS_ID
+            denominators = np.full(len(ids), ngram_counts[predicted].sum())
+        else :
+            denominators = np.bincount(groups, weights=ngram_counts)[groups]
+        with np.errstate(divide="ignore") :
+            logprobs = np.log10(ngram_counts / denominators)
+        if order == 1 :
+            logprobs[ids[:, 0] == BOS_ID] = MIN_LOGPROB
+            ids, logprobs = _with_unk(ids, logprobs, unk_logprob)
+        backoff = np.log10(alpha) if order < len(counts) else 0.0
+        orders.append((ids, logprobs, np.full(len(ids), backoff)))
+    return orders
+
+def find_rows(ids: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    Find the row of each query n-gram in a table of n-grams of the same order.
+
+    Return
+    ------
+    - np.ndarray:
+        The row index of each query, -1 for queries missing from the table.
+    """
+    rows = np.full(len(queries), -1, dtype=np.int64)
+    if not len(ids) or not len(queries) :
+        return rows
+    hashes = hash_ngrams(ids)
+    permutation = np.argsort(hashes, kind="stable")
+    sorted_hashes = hashes[permutation]
+    query_hashes = hash_ngrams(queries)
+    positions = np.minimum(np.searchsorted(sorted_hashes, query_hashes), len(ids) - 1)
+    candidates = permutation[positions]
+    found = (sorted_hashes[positions] == query_hashes) & \
+        np.all(ids[candidates] == queries, axis=1)
+    rows[found] = candidates[found]
+    # Hash collisions are resolved by a linear scan over the equal hashes.
+    for query in np.flatnonzero((sorted_hashes[positions] == query_hashes) & ~found) :
+        position = positions[query] + 1
+        while position < len(ids) and sorted_hashes[position] == query_hashes[query] :
+            if np.array_equal(ids[permutation[position]], queries[query]) :
+                rows[query] = permutation[position]
+                break
+            position += 1
+    return rows
+
+def kneser_ney_discounts(counts: np.ndarray) -> np.ndarray:
+    """
+    Compute the three discounts D1, D2 and D3+ of modified Kneser-Ney\
+    (Chen and Goodman, 1998) from the counts of counts.
+    """
+    counts_of_counts = np.bincount(np.minimum(counts, 4), minlength=5)[1:].astype(np.float64)
+    n1, n2, n3, n4 = counts_of_counts
+    with np.errstate(divide="ignore", invalid="ignore") :
+        y = n1 / (n1 + 2 * n2)
+        discounts = np.array([1 - 2 * y * n2 / n1,
+                                2 - 3 * y * n3 / n2,
+                                3 - 4 * y * n4 / n3])
+    # Tiny corpora can lack some counts of counts: fall back to usual values.
+    fallback = np.array([0.5, 1.0, 1.5])
+    invalid = ~np.isfinite(discounts) | (discounts <= 0) | (discounts >= [1, 2, 3])
+    discounts[invalid] = fallback[invalid]
+    return discounts
+
+def adjusted_counts(counts: NGramCounts) -> List[np.ndarray]:
+    """
+    Compute the adjusted counts of Kneser-Ney: raw counts for the highest\
+    order and for the n-grams starting with <s>, continuation counts (number\
+    of distinct words preceding the n-gram) for the others.
+    """
+    adjusted = []
+    for order, (ids, ngram_counts) in enumerate(counts, start=1) :
+        if order == len(counts) :
+            adjusted.append(np.asarray(ngram_counts, dtype=np.int64))
+            continue
+        extensions = np.asarray(counts[order][0])
+        continuations = np.bincount(find_rows(np.asarray(ids), extensions[:, 1:]),
+                                    minlength=len(ids))
+        ids = np.asarray(ids)
+        adjusted.append(np.where(ids[:, 0] == BOS_ID, ngram_counts, continuations).astype(np.int64))
+    return adjusted
+
+def modified_kneser_ney(counts: NGramCounts,
+                        vocabulary_size: int) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Estimate an interpolated modified Kneser-Ney model from raw counts, and\
+    express it as a backoff model (as in the ARPA files written by KenLM).
+
+    Parameters
+    ----------
+    - counts: list
+        The raw counts of each order, lexicographically sorted.
+    - vocabulary_size: int
+        The size of the vocabulary (including the special tokens).
+
+    Return
+    ------
+    - list:
+        For each order, the (ids, logprobs, backoffs) arrays expected by\
+        `write_ngram_store`.
+    """
+    probabilities, gammas = [], []
+    for order, ((ids, _), ngram_counts) in enumerate(zip(counts, adjusted_counts(counts)), start=1) :
+        ids = np.asarray(ids)
+        if order == 1 :
+            ngram_counts = np.where(ids[:, 0] == BOS_ID, 0, ngram_counts)
+        discounts = kneser_ney_discounts(ngram_counts[ngram_counts > 0])
+        ngram_discounts = np.where(ngram_counts > 0,
+                                    discounts[np.clip(ngram_counts, 1, 3) - 1],
+                                    0.0)
+        groups, _ = context_groups(ids)
+        denominators = np.bincount(groups, weights=ngram_counts)
+        context_gammas = np.bincount(groups, weights=ngram_discounts) / denominators
+        if order == 1 :
+            # Interpolate with the uniform distribution (<s> is never predicted).
+            lower_probabilities = np.full(len(ids), 1.0 / (vocabulary_size - 1))
+        else :
+            lower_probabilities = probabilities[-1][find_rows(np.asarray(counts[order - 2][0]), ids[:, 1:])]
+        probabilities.append((ngram_counts - ngram_discounts) / denominators[groups] \
+                                + context_gammas[groups] * lower_probabilities)
+        gammas.append(context_gammas)
+    orders = []
+    for order, (ids, _) in enumerate(counts, start=1) :
+        ids = np.asarray(ids)
+        with np.errstate(divide="ignore") :
+            logprobs = np.log10(probabilities[order - 1])
+        backoffs = np.zeros(len(ids))
+        if order < len(counts) :
+            # The backoff weight of an n-gram is the gamma of the context it forms.
+            higher_ids = np.asarray(counts[order][0])
+            _, starts = context_groups(higher_ids)
+            context_rows = find_rows(ids, higher_ids[starts, :-1])
+            backoffs[context_rows] = np.log10(gammas[order])
+        if order == 1 :
+            logprobs[ids[:, 0] == BOS_ID] = MIN_LOGPROB
+            ids, logprobs = _with_unk(ids, logprobs, np.log10(gammas[0][0] / (vocabulary_size - 1)))
+            backoffs = np.concatenate([np.zeros(len(ids) - len(backoffs)), backoffs])
+        orders.append((ids, logprobs, backoffs))
+    return orders
+
+def _with_unk(unigrams: np.ndarray,
+                logprobs: np.ndarray,
+                unk_logprob: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Make sure that the unigram table contains <unk>."""
+    if np.any(unigrams[:, 0] == UNK_ID) :
+        return unigrams, logprobs
+    return np.vstack([[[UNK_ID]], unigrams]).astype(np.uint32), np.concatenate([[unk_logprob], logprobs])
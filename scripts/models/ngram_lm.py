@@ -1,13 +1,135 @@
 """This module implements a trainer of ngram language models.
 """
-from paraphone.ngrams_tools import NGramLanguageModel
+import sys
+from pathlib import Path
+from typing import List, Tuple
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+ESTIMATORS = ["stupid_backoff", "kneser_ney"]
+
+def count_corpus(train_file: str,
+                    ngram_size: int,
+                    counts_directory: str,
+                    max_entries: int=5_000_000,
+                    tmp_directory: str=None) -> Tuple[List[str], list]:
+    """
+    Build the vocabulary of a training corpus and count its n-grams of\
+    order 1 to ngram_size in bounded memory.
+
+    The counts of each order do not depend on the maximal order, so the\
+    counts of a model of order n also give every model of lower order.
+
+    Return
+    ------
+    - tuple:
+        The vocabulary and, for each order, the memory mapped sorted ids\
+        and counts, stored in counts_directory.
+    """
+    from models.ngram_estimators import read_sentences, build_vocabulary
+    from models.ngram_counts import count_ngrams_external
+    from instrumentation import span
+    with span("vocabulary") as stage :
+        vocabulary = build_vocabulary(read_sentences(train_file))
+        stage.add(len(vocabulary))
+    with span("count") :
+        counts = count_ngrams_external(read_sentences(train_file),
+                                        vocabulary,
+                                        ngram_size,
+                                        counts_directory,
+                                        max_entries=max_entries,
+                                        tmp_directory=tmp_directory)
+    return vocabulary, counts
+
+def estimate_model(counts: list,
+                    vocabulary_size: int,
+                    estimator: str,
+                    alpha: float=0.4,
+                    smooth: float=1e-6) -> Tuple[list, dict]:
+    """
+    Estimate a backoff model from the counts of its orders (the first\
+    orders of the counts returned by `count_corpus`).
+
+    Return
+    ------
+    - tuple:
+        For each order, the (ids, logprobs, backoffs) arrays expected by\
+        `write_ngram_store`, and the metadata of the model.
+    """
+    import numpy as np
+    from models.ngram_estimators import stupid_backoff, modified_kneser_ney
+    if estimator == "kneser_ney" :
+        return modified_kneser_ney(counts, vocabulary_size), {"estimator": estimator}
+    orders = stupid_backoff(counts, alpha=alpha, unk_logprob=np.log10(smooth))
+    return orders, {"estimator": estimator, "alpha": alpha, "smooth": smooth}
+
+def train_compiled_model(train_file: str,
+                            ngram_size: int,
+                            estimator: str,
+                            alpha: float,
+                            smooth: float,
+                            out_directory: str,
+                            out_filename: str,
+                            max_entries: int=5_000_000,
+                            tmp_directory: str=None) -> Path:
+    """
+    Train a backoff n-gram language model and write it in\
+    the compact binary format.
+
+    The n-grams are counted in bounded memory: sorted counts are spilled\
+    to disk and merged, and kept next to the model for later use. The\
+    estimation and the compilation hold all the orders in memory, about\
+    100 bytes per distinct n-gram.
+
+    Parameters
+    ----------
+    - train_file: str
+        The tokenized training file.
+    - ngram_size: int
+        The order of the model.
+    - estimator: str
+        Either 'stupid_backoff' or 'kneser_ney' (modified Kneser-Ney).
+    - alpha: float
+        The backoff penalty of stupid backoff.
+    - smooth: float
+        The probability given to unknown words by stupid backoff.
+    - out_directory: str
+        The directory where the model will be stored.
+    - out_filename: str
+        The filename of the model, without extension.
+    - max_entries: int
+        The maximal number of distinct n-grams counted in memory.
+    - tmp_directory: str
+        The directory where the sorted runs of counts are spilled.
+
+    Return
+    ------
+    - Path:
+        The path of the compiled model.
+    """
+    from models.ngram_store import write_ngram_store
+    from instrumentation import span
+    out_directory = Path(out_directory)
+    vocabulary, counts = count_corpus(train_file,
+                                        ngram_size,
+                                        out_directory / f"{out_filename}_counts",
+                                        max_entries,
+                                        tmp_directory)
+    with span("estimate") :
+        orders, metadata = estimate_model(counts, len(vocabulary), estimator, alpha, smooth)
+    out_path = out_directory / f"{out_filename}.bin"
+    with span("write") :
+        write_ngram_store(out_path, vocabulary, orders, metadata=metadata)
+    return out_path
 
 if __name__ == "__main__" :
     from argparse import ArgumentParser
+    from instrumentation import add_profiling_arguments, profiling, span
     parser = ArgumentParser()
     parser.add_argument("--train_file",
                         type=str,
-                        help="The directory containing the train file.",
+                        help="The train file. With --binary, it can also be\
+                            gzip (.gz) or zstd (.zst) compressed, or be a glob\
+                            pattern matching its shards.",
                         required=True)
     parser.add_argument("--ngram_size",
                         type=int,
@@ -28,9 +150,53 @@ if __name__ == "__main__" :
     parser.add_argument("--out_filename",
                         help="The filename for the model.",
                         required=True)
+    parser.add_argument("--binary",
+                        action="store_true",
+                        help="Train a backoff model, counting its n-grams in bounded memory, and store it in the compact\
+                            binary format (memory mapped at loading time)\
+                            instead of the paraphone JSON format.")
+    parser.add_argument("--estimator",
+                        choices=ESTIMATORS,
+                        default="stupid_backoff",
+                        help="The estimator of the binary model.",
+                        required=False)
+    parser.add_argument("--max_entries_in_memory",
+                        type=int,
+                        default=5_000_000,
+                        help="The maximal number of distinct n-grams counted\
+                            in memory before spilling sorted counts to disk.",
+                        required=False)
+    parser.add_argument("--tmp_directory",
+                        type=str,
+                        default=None,
+                        help="Where to spill the sorted counts.",
+                        required=False)
+    parser.add_argument("--alpha",
+                        type=float,
+                        default=0.4,
+                        help="The backoff penalty of the binary model.",
+                        required=False)
+    add_profiling_arguments(parser)
     args = parser.parse_args()
-    ngram_lm = NGramLanguageModel(ngram_size=args.ngram_size, smooth=args.smooth)
-    print("Training the model...")
-    ngram_lm.estimate(args.train_file)
-    print("Saving the model...")
-    ngram_lm.save_parameters(args.out_directory, args.out_filename)
+    with profiling(args.profile, args.cprofile) :
+        if args.binary :
+            print("Training and compiling the model...")
+            model_path = train_compiled_model(args.train_file,
+                                                args.ngram_size,
+                                                args.estimator,
+                                                args.alpha,
+                                                args.smooth,
+                                                args.out_directory,
+                                                args.out_filename,
+                                                args.max_entries_in_memory,
+                                                args.tmp_directory)
+            print(f"Model saved to {model_path}")
+        else :
+            from paraphone.ngrams_tools import NGramLanguageModel
+            ngram_lm = NGramLanguageModel(ngram_size=args.ngram_size, smooth=args.smooth)
+            print("Training the model...")
+            with span("estimate") :
+                ngram_lm.estimate(args.train_file)
+            print("Saving the model...")
+            with span("write") :
+                ngram_lm.save_parameters(args.out_directory, args.out_filename)
@@ -0,0 +1,361 @@
+"""This module implements a compact binary store for backoff n-gram\
+language models.
+
+The store is a single file holding the vocabulary and, for each order,\
+a table of integer-id n-grams sorted by a 64 bits hash of their ids, along\
+with their log-probabilities and backoff weights quantized on 16 bits.\
+The tables are memory mapped, so loading a model only parses a small\
+header and the pages are shared between all the processes reading the\
+same file.
+"""
+import json
+import mmap
+import struct
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple
+import numpy as np
+from .scorer import Scorer
+
+MAGIC = b"CDSNGRAM"
+VERSION = 1
+ALIGNMENT = 8
+QUANTIZATION_LEVELS = 2 ** 16 - 1
+
+UNK = "<unk>"
+BOS = "<s>"
+EOS = "</s>"
+SPECIAL_TOKENS = [UNK, BOS, EOS]
+UNK_ID, BOS_ID, EOS_ID = 0, 1, 2
+# ARPA convention for the probability of tokens that are never predicted.
+MIN_LOGPROB = -99.0
+
+# FNV-1a constants, applied on word ids instead of bytes.
+HASH_OFFSET = np.uint64(0xCBF29CE484222325)
+HASH_PRIME = np.uint64(0x100000001B3)
+
+def hash_ngrams(ids: np.ndarray) -> np.ndarray:
+    """
+    Hash a batch of n-grams of the same order.
+
+    Parameters
+    ----------
+    - ids: np.ndarray
+        Array of shape (number of ngrams, order) containing word ids.
+
+    Return
+    ------
+    - np.ndarray:
+        The uint64 hash of each n-gram.
+    """
+    ids = np.asarray(ids, dtype=np.uint64)
+    hashes = np.full(len(ids), HASH_OFFSET, dtype=np.uint64)
+    for column in range(ids.shape[1]):
+        hashes = (hashes ^ ids[:, column]) * HASH_PRIME
+    return hashes
+
+def _quantize(values: np.ndarray) -> Tuple[np.ndarray, float, float]:
+    """
+    Linearly quantize float values on 16 bits.
+
+    Return
+    ------
+    - tuple:
+        The quantized values, the offset and the scale such that\
+        values ~= offset + quantized * scale.
+    """
+    # MIN_LOGPROB only flags tokens that are never predicted: it is kept\
+    # out of the quantization range so that it does not waste precision.
+    in_range = values[values > MIN_LOGPROB]
+    if not len(in_range):
+        return np.zeros(len(values), dtype=np.uint16), 0.0, 0.0
+    low, high = float(in_range.min()), float(in_range.max())
+    values = np.clip(values, low, high)
+    scale = (high - low) / QUANTIZATION_LEVELS
+    if scale == 0.0:
+        return np.zeros(len(values), dtype=np.uint16), low, 0.0
+    quantized = np.rint((values - low) / scale).astype(np.uint16)
+    return quantized, low, scale
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def compile_tables(orders: Sequence[Tuple[np.ndarray, np.ndarray, np.ndarray]]) -> List[Dict]:
+    """
+    Build the hash-sorted tables of a model, with quantized log-probabilities\
+    and backoffs, as stored in the compact binary format.
+
+    Parameters
+    ----------
+    - orders: list
+        For each order, the (ids, logprobs, backoffs) arrays (see `write_ngram_store`).
+
+    Return
+    ------
+    - list:
+        For each order, a dictionary holding the count, the quantization\
+        offsets and scales, and the "hashes", "ids", "logprobs" and\
+        "backoffs" arrays.
+    """
+    tables = []
+    for order, (ids, logprobs, backoffs) in enumerate(orders, start=1):
+        ids = np.asarray(ids, dtype=np.uint32).reshape(-1, order)
+        hashes = hash_ngrams(ids)
+        permutation = np.argsort(hashes, kind="stable")
+        quantized_logprobs, logprob_offset, logprob_scale = \
+            _quantize(np.asarray(logprobs, dtype=np.float64)[permutation])
+        quantized_backoffs, backoff_offset, backoff_scale = \
+            _quantize(np.asarray(backoffs, dtype=np.float64)[permutation])
+        tables.append({"count": len(ids),
+                        "logprob_offset": logprob_offset,
+                        "logprob_scale": logprob_scale,
+                        "backoff_offset": backoff_offset,
+                        "backoff_scale": backoff_scale,
+                        "hashes": hashes[permutation],
+                        "ids": np.ascontiguousarray(ids[permutation]),
+                        "logprobs": quantized_logprobs,
+                        "backoffs": quantized_backoffs})
+    return tables
+
+def write_ngram_store(path: str,
+                        vocabulary: Sequence[str],
+                        orders: Sequence[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+                        metadata: Dict=None) -> None:
+    """
+    Write a backoff n-gram language model in the compact binary format.
+
+    Parameters
+    ----------
+    - path: str
+        The path of the output file.
+    - vocabulary: list
+        The words of the model, indexed by their id. The first three\
+        words must be the special tokens `<unk>`, `<s>` and `</s>`.
+    - orders: list
+        For each order n (starting from unigrams), a tuple (ids, logprobs,\
+        backoffs) where ids is an array of shape (number of ngrams, n),\
+        logprobs and backoffs are log10 values.
+    - metadata: dict
+        Additional information stored in the header (estimator, smoothing...).
+    """
+    if list(vocabulary[:len(SPECIAL_TOKENS)]) != SPECIAL_TOKENS:
+        raise ValueError(f"The vocabulary must start with {SPECIAL_TOKENS}")
+    arrays = [np.frombuffer("\n".join(vocabulary).encode("utf-8"), dtype=np.uint8)]
+    header = {"version": VERSION,
+                "ngram_size": len(orders),
+                "metadata": metadata or {},
+                "orders": []}
+    for table in compile_tables(orders):
+        header["orders"].append({name: table[name] for name in ("count",
+                                                                "logprob_offset",
+                                                                "logprob_scale",
+                                                                "backoff_offset",
+                                                                "backoff_scale")})
+        arrays.extend([table["hashes"], table["ids"], table["logprobs"], table["backoffs"]])
+    offsets = []
+    offset = 0
+    for array in arrays:
+        offsets.append(offset)
+        offset = _align(offset + array.nbytes)
+    header["offsets"] = offsets
+    header["vocabulary_bytes"] = int(arrays[0].nbytes)
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+    with open(path, mode="wb") as out_file:
+        out_file.write(MAGIC)
+        out_file.write(struct.pack("<Q", len(header_bytes)))
+        out_file.write(header_bytes)
+        for array, array_offset in zip(arrays, offsets):
+            out_file.write(b"\0" * (data_start + array_offset - out_file.tell()))
+            out_file.write(array.tobytes())
+
+class CompiledNGramModel(Scorer):
+    """
+    Backoff n-gram language model loaded from the compact binary format.
+
+    Lookups are done through a binary search on the hash-sorted tables.\
+    Scores are log10 probabilities, as in the ARPA format.
+    """
+    def __init__(self, path: str=None) :
+        self.ngram_size = 0
+        self.metadata = {}
+        self.vocabulary = []
+        self.word_to_id = {}
+        self._tables = []
+        if path is not None :
+            self.load_parameters(path)
+
+    @classmethod
+    def from_orders(cls,
+                    vocabulary: Sequence[str],
+                    orders: Sequence[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+                    metadata: Dict=None) -> "CompiledNGramModel":
+        """
+        Build a model in memory from estimated n-gram tables, without writing\
+        it to disk. The model gives the same scores as the model written by\
+        `write_ngram_store` with the same arguments.
+        """
+        model = cls()
+        model.vocabulary = list(vocabulary)
+        model.word_to_id = {word: idx for idx, word in enumerate(model.vocabulary)}
+        model.ngram_size = len(orders)
+        model.metadata = metadata or {}
+        model._tables = compile_tables(orders)
+        return model
+
+    def load_parameters(self, path: str) -> None:
+        """
+        Memory map a model written by `write_ngram_store`.
+
+        Parameters
+        ----------
+        - path: str
+            The path of the compiled model.
+        """
+        with open(path, mode="rb") as model_file :
+            self._buffer = mmap.mmap(model_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._buffer[:len(MAGIC)] != MAGIC :
+            raise ValueError(f"{path} is not a compiled n-gram model.")
+        header_size, = struct.unpack_from("<Q", self._buffer, len(MAGIC))
+        header_start = len(MAGIC) + 8
+        header = json.loads(self._buffer[header_start:header_start + header_size].decode("utf-8"))
+        if header["version"] != VERSION :
+            raise ValueError(f"Unsupported model version {header['version']}")
+        data_start = _align(header_start + header_size)
+        offsets = iter(header["offsets"])
+        vocabulary_offset = data_start + next(offsets)
+        self.vocabulary = bytes(self._buffer[vocabulary_offset:\
+                                vocabulary_offset + header["vocabulary_bytes"]])\
+                                    .decode("utf-8").split("\n")
+        self.word_to_id = {word: idx for idx, word in enumerate(self.vocabulary)}
+        self.ngram_size = header["ngram_size"]
+        self.metadata = header["metadata"]
+        self._tables = []
+        for order, order_header in enumerate(header["orders"], start=1):
+            count = order_header["count"]
+            table = dict(order_header)
+            for name, dtype, shape in (("hashes", np.uint64, (count,)),
+                                        ("ids", np.uint32, (count, order)),
+                                        ("logprobs", np.uint16, (count,)),
+                                        ("backoffs", np.uint16, (count,))):
+                array_offset = data_start + next(offsets)
+                if not count :
+                    table[name] = np.zeros(shape, dtype=dtype)
+                    continue
+                table[name] = np.frombuffer(self._buffer,
+                                            dtype=dtype,
+                                            count=int(np.prod(shape)),
+                                            offset=array_offset).reshape(shape)
+            self._tables.append(table)
+
+    def _lookup(self, ngrams: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Look up n-grams of the same order.
+
+        Return
+        ------
+        - tuple:
+            A boolean array telling whether each n-gram was found,\
+            and its dequantized log-probability and backoff (0 when missing).
+        """
+        table = self._tables[ngrams.shape[1] - 1]
+        hashes = hash_ngrams(ngrams)
+        positions = np.searchsorted(table["hashes"], hashes)
+        positions = np.minimum(positions, max(len(table["hashes"]) - 1, 0))
+        found = np.zeros(len(ngrams), dtype=bool)
+        if len(table["hashes"]) :
+            same_hash = table["hashes"][positions] == hashes
+            found = same_hash & np.all(table["ids"][positions] == ngrams, axis=1)
+            # Hash collisions: the n-gram may sit after its colliding neighbours.
+            for query in np.flatnonzero(same_hash & ~found) :
+                position = positions[query] + 1
+                while position < len(table["hashes"]) and table["hashes"][position] == hashes[query] :
+                    if np.array_equal(table["ids"][position], ngrams[query]) :
+                        positions[query] = position
+                        found[query] = True
+                        break
+                    position += 1
+        logprobs = np.where(found,
+                            table["logprob_offset"] + table["logprobs"][positions] * table["logprob_scale"],
+                            0.0)
+        backoffs = np.where(found,
+                            table["backoff_offset"] + table["backoffs"][positions] * table["backoff_scale"],
+                            0.0)
+        return found, logprobs, backoffs
+
+    def to_ids(self, utterance: Sequence[str]) -> List[int]:
+        """Map the words of an utterance to their ids, padded with <s> and </s>."""
+        return [BOS_ID] + [self.word_to_id.get(word, UNK_ID) for word in utterance] + [EOS_ID]
+
+    def get_ngrams(self, utterance: Sequence[str]) -> List[Tuple[int, ...]]:
+        """
+        Get the n-grams, as tuples of word ids, whose log-probabilities\
+        sum up to the log-probability of the utterance.
+
+        Each n-gram is the predicted word preceded by its (possibly shorter)\
+        left context.
+        """
+        ids = self.to_ids(utterance)
+        return [tuple(ids[max(0, idx - self.ngram_size + 1):idx + 1])
+                for idx in range(1, len(ids))]
+
+    def ngrams_logprobs(self, ngrams: Sequence[Tuple[int, ...]]) -> np.ndarray:
+        """
+        Compute, in a vectorized way, the backoff log-probability of each n-gram.
+        """
+        n_ngrams = len(ngrams)
+        # Left-pad the n-grams so that they all have the maximal order.
+        windows = np.zeros((n_ngrams, self.ngram_size), dtype=np.uint32)
+        lengths = np.zeros(n_ngrams, dtype=np.int64)
+        for idx, ngram in enumerate(ngrams) :
+            ngram = ngram[-self.ngram_size:]
+            windows[idx, self.ngram_size - len(ngram):] = ngram
+            lengths[idx] = len(ngram)
+        logprobs = np.zeros(n_ngrams)
+        accumulated_backoffs = np.zeros(n_ngrams)
+        pending = np.ones(n_ngrams, dtype=bool)
+        for order in range(self.ngram_size, 0, -1) :
+            queries = np.flatnonzero(pending & (lengths >= order))
+            if not len(queries) :
+                continue
+            found, ngram_logprobs, _ = self._lookup(windows[queries, self.ngram_size - order:])
+            hits = queries[found]
+            logprobs[hits] = accumulated_backoffs[hits] + ngram_logprobs[found]
+            pending[hits] = False
+            misses = queries[~found]
+            if order > 1 and len(misses) :
+                _, _, context_backoffs = self._lookup(windows[misses, self.ngram_size - order:-1])
+                accumulated_backoffs[misses] += context_backoffs
+        # Words missing from the vocabulary are mapped to <unk>, whose unigram\
+        # is always stored, so this only happens for malformed queries.
+        logprobs[pending] = accumulated_backoffs[pending] + MIN_LOGPROB
+        return logprobs
+
+    def to_ngram_logprob(self, ngrams: Sequence[Tuple[int, ...]]) -> float:
+        """Compute the log-probability of an utterance from its n-grams."""
+        return float(self.ngrams_logprobs(ngrams).sum())
+
+    def score_sentences(self, utterances: Iterable[Sequence[str]]) -> np.ndarray:
+        """
+        Compute the log-probabilities of many tokenized utterances in a single\
+        vectorized pass over the tables.
+        """
+        ngrams = []
+        lengths = []
+        for utterance in utterances :
+            utterance_ngrams = self.get_ngrams(utterance)
+            ngrams.extend(utterance_ngrams)
+            lengths.append(len(utterance_ngrams))
+        sentence_ids = np.repeat(np.arange(len(lengths)), lengths)
+        return np.bincount(sentence_ids,
+                            weights=self.ngrams_logprobs(ngrams),
+                            minlength=len(lengths))
+
+    score_batch = score_sentences
+
+def is_compiled_model(path: str) -> bool:
+    """Whether the given file is a model written by `write_ngram_store`."""
+    path = Path(path)
+    if not path.is_file() :
+        return False
+    with open(path, mode="rb") as model_file :
+        return model_file.read(len(MAGIC)) == MAGIC
@@ -0,0 +1,37 @@
+"""This module defines the interface shared by all the language models\
+evaluated on the syntactic tasks."""
+from abc import ABCMeta, abstractmethod
+from typing import Sequence
+import numpy as np
+
+class Scorer(metaclass=ABCMeta):
+    """
+    A language model that scores batches of tokenized sentences.
+    """
+    @abstractmethod
+    def score_batch(self, sentences: Sequence[Sequence[str]]) -> np.ndarray:
+        """
+        Compute the log-probability of each tokenized sentence.
+
+        Parameters
+        ----------
+        - sentences: list
+            The tokenized sentences.
+
+        Return
+        ------
+        - np.ndarray:
+            The log-probability of each sentence, in the input order.
+        """
+
+class ParaphoneScorer(Scorer):
+    """
+    Adapter for the n-gram language models of paraphone, which score\
+    one sentence at a time.
+    """
+    def __init__(self, ngram_lm) :
+        self.ngram_lm = ngram_lm
+
+    def score_batch(self, sentences: Sequence[Sequence[str]]) -> np.ndarray:
+        return np.array([self.ngram_lm.to_ngram_logprob(list(self.ngram_lm.get_ngrams(sentence)))
+                            for sentence in sentences])
@@ -0,0 +1,427 @@
+"""Runner of the whole pipeline, from the download of the corpora to the results.
+
+The steps of commands.txt (download, tokenization, training, evaluation) and of
+the evaluation set (word candidates, tasks, synthesis, ZeroSpeech format) are
+declared as stages with their command, input files and output files. A stage is
+run only if one of its outputs is missing or if its command or the content of
+one of its inputs (including its own code) changed since its last successful
+run. Stages whose inputs are ready run in parallel, e.g. the training and the
+evaluation of the three tokenizations x n-gram orders.
+
+The hashes of the inputs of each successful stage are kept in
+data/.pipeline/state.json, and the output of each stage in
+data/.pipeline/logs/<stage>.log.
+"""
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+from download_providence_csvs import CHILDREN
+from tokenizations import TOKENIZATIONS, TRAINING_FILES, model_name
+
+ROOT = Path(__file__).resolve().parent.parent
+STATE_DIRECTORY = Path('data/.pipeline')
+# The evaluations of the binary models are kept apart from the results of
+# results/, which come from the paraphone models.
+RESULTS_DIRECTORY = Path('results/pipeline')
+
+TASKS = ['adj_noun_order', 'noun_verb_order', 'anaphor_gender_agreement', 'anaphor_number_agreement',
+         'determiner_noun_agreement', 'noun_verb_agreement']
+# Files of data/word_candidates written by find_word_candidates.py and read by the tasks.
+CANDIDATE_WORD_FILES = ['nouns.csv', 'adjs.csv', 'verbs.csv']
+# Files of data/word_candidates that are written by hand from the candidates (see docs/build_evaluation.md).
+MANUAL_WORD_FILES = ['nouns_animate.csv', 'nouns_gendered.csv', 'verbs_intransitive.csv', 'verbs_reflexive.csv',
+                     'verbs_noun_verb_agreement.csv']
+PREPROCESSING_CODE = ['scripts/preprocessing_tools.py']
+MODELS_CODE = ['scripts/models/ngram_lm.py', 'scripts/models/ngram_estimators.py', 'scripts/models/ngram_counts.py',
+               'scripts/models/ngram_store.py', 'scripts/models/corpus_files.py']
+
+
+class Stage:
+    """
+    A command of the pipeline with its inputs and outputs, as paths relative to the
+    root of the repository. Inputs can be directories, in which case all their files
+    are hashed. The script is an input of the stage, as well as the modules listed in
+    `code`.
+    """
+    def __init__(self, name, script, arguments, inputs=(), outputs=(), code=()):
+        self.name = name
+        self.script = script
+        self.arguments = [str(argument) for argument in arguments]
+        self.inputs = [Path(path) for path in inputs]
+        self.outputs = [Path(path) for path in outputs]
+        self.code = [Path(script)] + [Path(path) for path in code]
+
+    def command(self, profile_path=None):
+        command = [sys.executable, self.script] + self.arguments
+        if profile_path is not None:
+            command += ['--profile', str(profile_path)]
+        return command
+
+    def __repr__(self):
+        return 'Stage(%s)' % self.name
+
+
+def build_stages(orders=(3, 5), estimator='stupid_backoff', workers=1, credentials_path=None):
+    """
+    Declare the stages of the pipeline.
+
+    Parameters
+    ----------
+    - orders: list
+        The n-gram orders trained for each tokenization.
+    - estimator: str
+        The estimator of the binary n-gram models.
+    - workers: int
+        The number of processes of each evaluation.
+    - credentials_path: str
+        The Google TTS credentials. Without them, the synthesis and ZeroSpeech
+        format stages are not declared.
+
+    Return
+    ------
+    - list:
+        The stages.
+    """
+    tokenized = Path('data/tokenized')
+    lexicon = tokenized / 'providence_lexicon.tsv'
+    word_candidates = Path('data/word_candidates')
+    tasks = [Path('data/tasks') / (task + '.csv') for task in TASKS]
+    stages = [
+        Stage('download_providence', 'scripts/download_providence_csvs.py',
+              ['--out_directory_name', 'data/children_csvs'],
+              outputs=[Path('data/children_csvs') / (child + '.csv') for child in sorted(CHILDREN)],
+              code=['scripts/childes_download.py']),
+        Stage('tokenize', 'scripts/create_training_files.py',
+              ['--csvs_directory', 'data/children_csvs', '--out_directory_name', tokenized],
+              inputs=[Path('data/children_csvs') / (child + '.csv') for child in sorted(CHILDREN)],
+              outputs=[tokenized / filename for filename in TRAINING_FILES.values()] + [lexicon],
+              code=PREPROCESSING_CODE + ['scripts/models/corpus_files.py']),
+        Stage('download_transcripts', 'scripts/download_transcript.py',
+              ['--out', 'data/transcripts'],
+              outputs=['data/transcripts/sentences.csv'],
+              code=['scripts/childes_download.py']),
+        Stage('find_word_candidates', 'scripts/find_word_candidates.py',
+              ['--input', 'data/transcripts/sentences.csv', '--out', word_candidates],
+              inputs=['data/transcripts/sentences.csv'],
+              outputs=[word_candidates / filename for filename in CANDIDATE_WORD_FILES],
+              code=['scripts/word_pos_index.py']),
+        Stage('build_tasks', 'scripts/build_tasks.py',
+              ['--input', word_candidates, '--out', 'data/tasks'],
+              inputs=[word_candidates / filename for filename in CANDIDATE_WORD_FILES + MANUAL_WORD_FILES],
+              outputs=tasks,
+              code=['scripts/tasks']),
+    ]
+    for tokenization, (phonemized, tokenized_in_words) in TOKENIZATIONS.items():
+        for order in orders:
+            model = model_name(order, tokenization)
+            stages.append(Stage('train_' + model, 'scripts/models/ngram_lm.py',
+                                ['--train_file', tokenized / TRAINING_FILES[tokenization], '--ngram_size', order,
+                                 '--out_directory', 'trained', '--out_filename', model,
+                                 '--binary', '--estimator', estimator],
+                                inputs=[tokenized / TRAINING_FILES[tokenization]],
+                                outputs=[Path('trained') / (model + '.bin')],
+                                code=MODELS_CODE))
+            stages.append(Stage('evaluate_' + model, 'scripts/run_tasks.py',
+                                ['--tasks_folder', 'data/tasks', '--ngram_model', Path('trained') / (model + '.bin'),
+                                 '--phonemize' if phonemized else '--no-phonemize',
+                                 '--tokenize_in_words' if tokenized_in_words else '--no-tokenize_in_words',
+                                 '--out_directory', RESULTS_DIRECTORY, '--out_filename', model, '--workers', workers]
+                                + (['--lexicon', lexicon] if phonemized else []),
+                                inputs=tasks + [Path('trained') / (model + '.bin')] + ([lexicon] if phonemized else []),
+                                outputs=[RESULTS_DIRECTORY / (model + '.csv')],
+                                code=PREPROCESSING_CODE + ['scripts/models/scorer.py', 'scripts/models/ngram_store.py']))
+    if credentials_path is not None:
+        audio = [Path('data/synth/audio') / task for task in TASKS]
+        stages.append(Stage('synthesize', 'scripts/synthesize_sentences.py',
+                            ['--input', 'data/tasks', '--out', 'data/synth', '--credentials_path', credentials_path],
+                            inputs=tasks,
+                            outputs=audio,
+                            code=['scripts/tasks/synthetizer.py']))
+        stages.append(Stage('zr_format', 'scripts/zr_format.py',
+                            ['--input', 'data/synth', '--sentences', 'data/tasks', '--out', 'data/zr_format'],
+                            inputs=tasks + audio,
+                            outputs=['data/zr_format/syntactic/dev/gold.csv',
+                                     'data/zr_format/syntactic/test/gold.csv']))
+    return stages
+
+
+def _contains(parent, path):
+    return path.parts[:len(parent.parts)] == parent.parts
+
+
+class Pipeline:
+    """
+    Schedules the stages: a stage depends on the stages producing its inputs
+    (or files inside its input directories).
+    """
+    def __init__(self, stages, root=ROOT, state_directory=STATE_DIRECTORY):
+        self.stages = {stage.name: stage for stage in stages}
+        self.root = Path(root)
+        self.state_directory = self.root / state_directory
+        self.state_path = self.state_directory / 'state.json'
+        self.state = {'stages': {}, 'files': {}}
+        if self.state_path.exists():
+            with open(self.state_path) as state_file:
+                self.state = json.load(state_file)
+        self.dependencies = {stage.name: sorted(set(producer.name for producer in stages
+                                                    if producer is not stage
+                                                    and any(_contains(input_path, output) or _contains(output, input_path)
+                                                            for input_path in stage.inputs
+                                                            for output in producer.outputs)))
+                             for stage in stages}
+
+    def select(self, targets, adopted=()):
+        """
+        Get the stages needed by the targets, in an order where every stage comes after
+        its dependencies. A target is a stage name, a glob pattern over the stage names
+        (e.g. 'evaluate_*'), 'results' for all the evaluations or 'all'. The dependencies
+        of the `adopted` stages are not needed.
+        """
+        names = []
+        for target in targets:
+            pattern = {'results': 'evaluate_*', 'all': '*'}.get(target, target)
+            matches = fnmatch.filter(self.stages, pattern)
+            if not matches:
+                hint = ' (synthesis needs --credentials_path)' if target in ('synthesize', 'zr_format') else ''
+                raise ValueError("Unknown stage %s%s. Stages are: %s" % (target, hint, ', '.join(self.stages)))
+            names.extend(matches)
+        ordered = []
+
+        def visit(name):
+            if name in ordered:
+                return
+            for dependency in [] if name in adopted else self.dependencies[name]:
+                visit(dependency)
+            ordered.append(name)
+        for name in names:
+            visit(name)
+        return [self.stages[name] for name in ordered]
+
+    def check_inputs(self, stages):
+        """Raise an error if an input of the stages is missing and produced by none of them."""
+        produced = [output for stage in stages for output in stage.outputs]
+        for stage in stages:
+            for input_path in stage.inputs + stage.code:
+                if not (self.root / input_path).exists() \
+                        and not any(_contains(input_path, output) or _contains(output, input_path)
+                                    for output in produced):
+                    raise FileNotFoundError("Input %s of %s is missing and is not produced by any stage."
+                                            % (input_path, stage.name))
+
+    def file_hash(self, path):
+        """Hash the content of a file, reusing the previous hash if its size and mtime did not change."""
+        stat = (self.root / path).stat()
+        cached = self.state['files'].get(str(path))
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(self.root / path, 'rb') as input_file:
+            for block in iter(lambda: input_file.read(1 << 20), b''):
+                digest.update(block)
+        self.state['files'][str(path)] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def path_hash(self, path):
+        """Hash a file, or all the files of a directory, or return None if it does not exist."""
+        full_path = self.root / path
+        if full_path.is_file():
+            return self.file_hash(path)
+        if not full_path.is_dir():
+            return None
+        digest = hashlib.sha256()
+        for file_path in sorted(full_path.rglob('*')):
+            if file_path.is_file() and '__pycache__' not in file_path.parts:
+                relative_path = file_path.relative_to(self.root)
+                digest.update(('%s %s\n' % (relative_path, self.file_hash(relative_path))).encode('utf-8'))
+        return digest.hexdigest()
+
+    def fingerprint(self, stage):
+        """Hash of the command of a stage and of the content of its inputs."""
+        description = {'command': [stage.script] + stage.arguments,
+                       'inputs': {str(path): self.path_hash(path) for path in stage.inputs + stage.code}}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def is_up_to_date(self, stage):
+        record = self.state['stages'].get(stage.name)
+        return record is not None \
+            and all((self.root / output).exists() for output in stage.outputs) \
+            and record['fingerprint'] == self.fingerprint(stage)
+
+    def save_state(self):
+        self.state_directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_name(self.state_path.name + '.tmp')
+        with open(tmp_path, 'w') as state_file:
+            json.dump(self.state, state_file, indent=1)
+        os.replace(tmp_path, self.state_path)
+
+    def execute(self, stage, profile_directory=None):
+        """Run the command of a stage, with its output written to its log file. Return its exit code."""
+        log_directory = self.state_directory / 'logs'
+        log_directory.mkdir(parents=True, exist_ok=True)
+        profile_path = None if profile_directory is None else Path(profile_directory).resolve() / (stage.name + '.json')
+        with open(log_directory / (stage.name + '.log'), 'w') as log_file:
+            return subprocess.run(stage.command(profile_path), cwd=self.root, stdout=log_file,
+                                  stderr=subprocess.STDOUT).returncode
+
+    def adoptable(self, stage):
+        """Whether the outputs of a stage exist although the pipeline never ran it."""
+        return stage.name not in self.state['stages'] \
+            and all((self.root / output).exists() for output in stage.outputs)
+
+    def run(self, targets, jobs=1, force=False, dry_run=False, adopt=None, profile_directory=None):
+        """
+        Run the stages needed by the targets that are not up to date.
+
+        Parameters
+        ----------
+        - targets: list
+            Stage names or patterns (see `select`).
+        - jobs: int
+            The maximal number of stages running at the same time.
+        - force: bool
+            Run the selected stages even if they are up to date.
+        - dry_run: bool
+            Only print the stages that would run.
+        - adopt: bool
+            Record the stages whose outputs already exist as up to date, without running
+            them or the stages they depend on (e.g. for outputs produced by hand before
+            using the pipeline, such as the tasks of the repository). Default to True on
+            the first run (when there is no state yet) without `force`, and False afterwards.
+        - profile_directory: str
+            If given, each stage writes its --profile trace to <profile_directory>/<stage>.json.
+
+        Return
+        ------
+        - bool:
+            Whether all the stages succeeded.
+        """
+        if adopt is None:
+            adopt = not force and not self.state_path.exists()
+        # Adopted stages stand for the stages they depend on, as long as they are up to date.
+        candidates = self.select(targets)
+        adopted = set(stage.name for stage in candidates if adopt and self.adoptable(stage))
+        kept = set(stage.name for stage in candidates
+                   if not force and self.state['stages'].get(stage.name, {}).get('adopted')
+                   and self.is_up_to_date(stage))
+        stages = self.select(targets, adopted | kept)
+        self.check_inputs([stage for stage in stages if stage.name not in adopted | kept])
+        if dry_run:
+            outdated = set()
+            for stage in stages:
+                if stage.name in adopted | kept:
+                    print('%-45s %s' % (stage.name, 'adopted' if stage.name in adopted else 'up to date'))
+                    continue
+                if force or outdated.intersection(self.dependencies[stage.name]) or not self.is_up_to_date(stage):
+                    outdated.add(stage.name)
+                print('%-45s %s' % (stage.name, 'run' if stage.name in outdated else 'up to date'))
+            return True
+        # The adopted stages that are not needed now are recorded too, so that they stand
+        # for their own dependencies when the stages depending on them have to run again.
+        for stage in candidates:
+            if stage.name in adopted:
+                self.state['stages'][stage.name] = {'fingerprint': self.fingerprint(stage), 'time': time.time(),
+                                                    'adopted': True}
+                print('%-45s adopted' % stage.name)
+            elif stage.name in kept and stage in stages:
+                print('%-45s up to date' % stage.name)
+        pending = [stage for stage in stages if stage.name not in adopted | kept]
+        done, failed = adopted | kept, []
+        running = {}
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while pending or running:
+                for stage in list(pending):
+                    if failed or not all(name in done for name in self.dependencies[stage.name]):
+                        continue
+                    pending.remove(stage)
+                    fingerprint = self.fingerprint(stage)
+                    outputs_exist = all((self.root / output).exists() for output in stage.outputs)
+                    record = self.state['stages'].get(stage.name)
+                    if not force and outputs_exist and record is not None and record['fingerprint'] == fingerprint:
+                        print('%-45s up to date' % stage.name)
+                        done.add(stage.name)
+                    else:
+                        print('%-45s started' % stage.name)
+                        future = pool.submit(self.execute, stage, profile_directory)
+                        running[future] = (stage, fingerprint, time.perf_counter())
+                if not running:
+                    if pending and not failed and any(all(name in done for name in self.dependencies[stage.name])
+                                                      for stage in pending):
+                        continue
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, fingerprint, start = running.pop(future)
+                    duration = time.perf_counter() - start
+                    if future.result() == 0 and all((self.root / output).exists() for output in stage.outputs):
+                        self.state['stages'][stage.name] = {'fingerprint': fingerprint, 'time': time.time(),
+                                                            'seconds': duration}
+                        done.add(stage.name)
+                        print('%-45s done in %.1fs' % (stage.name, duration))
+                    else:
+                        failed.append(stage.name)
+                        print('%-45s FAILED after %.1fs, see %s' % (stage.name, duration,
+                                                                     self.state_directory / 'logs' / (stage.name + '.log')))
+                self.save_state()
+        self.save_state()
+        if failed or pending:
+            print("Failed: %s. Not run: %s." % (', '.join(failed) or '-',
+                                               ', '.join(stage.name for stage in pending) or '-'))
+            return False
+        return True
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='This script runs the stages of the pipeline that are not up to '
+                                                 'date, in parallel when they are independent.')
+    parser.add_argument('targets', type=str, nargs='*', default=['results'],
+                        help="Stages to run with the stages they depend on: stage names, glob patterns "
+                             "(e.g. 'train_*'), 'results' (all the evaluations, default) or 'all'.")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Maximal number of stages running at the same time.')
+    parser.add_argument('--orders', type=int, nargs='+', default=[3, 5],
+                        help='N-gram orders trained for each tokenization.')
+    parser.add_argument('--estimator', type=str, choices=['stupid_backoff', 'kneser_ney'], default='stupid_backoff',
+                        help='Estimator of the n-gram models.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes of each evaluation (see run_tasks.py).')
+    parser.add_argument('--credentials_path', type=str, default=None,
+                        help='Google TTS credentials, required by the synthesize and zr_format stages.')
+    parser.add_argument('--force', action='store_true',
+                        help='Run the selected stages even if they are up to date.')
+    parser.add_argument('--dry_run', action='store_true',
+                        help='Only print the stages that would run.')
+    parser.add_argument('--adopt', action='store_true', default=None,
+                        help='Record the stages whose outputs already exist as up to date instead of running them '
+                             '(default on the first run).')
+    parser.add_argument('--no_adopt', dest='adopt', action='store_false',
+                        help='Run the stages whose outputs already exist, even on the first run.')
+    parser.add_argument('--list', action='store_true',
+                        help='List the stages with their dependencies.')
+    parser.add_argument('--profile_directory', type=str, default=None,
+                        help='Write the --profile trace of each stage to this directory.')
+    args = parser.parse_args(argv)
+
+    pipeline = Pipeline(build_stages(args.orders, args.estimator, args.workers, args.credentials_path))
+    if args.list:
+        for stage in pipeline.stages.values():
+            print('%-45s <- %s' % (stage.name, ', '.join(pipeline.dependencies[stage.name]) or '-'))
+        return
+    try:
+        success = pipeline.run(args.targets, args.jobs, args.force, args.dry_run, args.adopt, args.profile_directory)
+    except (ValueError, FileNotFoundError) as error:
+        parser.error(str(error))
+    if not success:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    args = sys.argv[1:]
+    main(args)
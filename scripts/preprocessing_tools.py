@@ -2,12 +2,22 @@
     raw text corpora or sentences."""
 
 import string, re
+from typing import Dict, Iterable, List, Sequence
 import pylangacq
-from phonemizer.backend import EspeakBackend
-from phonemizer.separator import Separator
 
-SEPARATOR = Separator(phone='$', word='@')
-BACKEND = EspeakBackend(language="en-us", language_switch="remove-utterance")
+# Separators of the phonemized utterances
+PHONE_SEPARATOR = '$'
+WORD_SEPARATOR = '@'
+# The espeak backend is slow to start: it is created on first use (see `get_backend`).
+BACKEND = None
+SEPARATOR = None
+# Per-word phonemization lexicon used by `phonemization` once loaded.
+LEXICON = None
+# Built once: these used to be rebuilt on every call.
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+# Same replacements as `clean_utterance`, in a single pass
+SEPARATORS_TABLE = str.maketrans("_+", "  ")
+MULTIPLE_SPACES = re.compile(' +')
 
 def clean_utterance(utterance: str) -> str:
     """
@@ -43,7 +53,7 @@ def remove_ponctuations(utterance: str) -> str:
     str :
         The utterance without punctuations.
     """
-    return utterance.translate(str.maketrans('', '', string.punctuation))
+    return utterance.translate(PUNCTUATION_TABLE)
 
 def remove_multiple_spaces(utterance: str) -> str:
     """
@@ -60,7 +70,104 @@ def remove_multiple_spaces(utterance: str) -> str:
     - str
         Utterance without multiple successive spaces.
     """
-    return re.sub(' +', ' ', utterance)
+    return MULTIPLE_SPACES.sub(' ', utterance)
+
+def get_backend():
+    """
+    Get the espeak phonemizer backend and its separator,\
+    creating them on the first call.
+
+    Return
+    ------
+    - tuple:
+        The EspeakBackend and the phonemizer Separator.
+    """
+    global BACKEND, SEPARATOR
+    if BACKEND is None :
+        from phonemizer.backend import EspeakBackend
+        from phonemizer.separator import Separator
+        SEPARATOR = Separator(phone=PHONE_SEPARATOR, word=WORD_SEPARATOR)
+        BACKEND = EspeakBackend(language="en-us", language_switch="remove-utterance")
+    return BACKEND, SEPARATOR
+
+class Cleaner:
+    """
+    Text cleaner applying, in a single object, the punctuation removal,\
+    the pylangacq cleaning, the multiword separators replacement and\
+    optionally the collapsing of multiple spaces, with translation tables\
+    and regexes compiled once.
+
+    `clean` gives the same output as the original chain of the module\
+    functions (`remove_ponctuations`, `clean_utterance`,\
+    `remove_multiple_spaces`), which `check_cleaner` verifies. There is no\
+    vectorized path: `clean_many` cleans the utterances one by one.
+    """
+    def __init__(self,
+                    remove_punctuation: bool=True,
+                    collapse_spaces: bool=False) :
+        self.remove_punctuation = remove_punctuation
+        self.collapse_spaces = collapse_spaces
+
+    def clean(self, utterance: str) -> str:
+        """Clean a single utterance."""
+        if self.remove_punctuation :
+            utterance = utterance.translate(PUNCTUATION_TABLE)
+        utterance = pylangacq.chat._clean_utterance(utterance=utterance).translate(SEPARATORS_TABLE)
+        if self.collapse_spaces :
+            utterance = MULTIPLE_SPACES.sub(' ', utterance)
+        return utterance
+
+    def clean_many(self, utterances: Sequence[str]) -> List[str]:
+        """
+        Clean a list of utterances, applying `clean` to each of them.
+
+        Parameters
+        ----------
+        - utterances: list
+            The utterances to clean.
+
+        Return
+        ------
+        - list:
+            The cleaned utterances, in the input order.
+        """
+        return list(map(self.clean, utterances))
+
+def _original_clean(utterance: str,
+                    remove_punctuation: bool=True,
+                    collapse_spaces: bool=False) -> str:
+    """
+    Frozen copy of the cleaning done before `Cleaner`, by the chain of\
+    `remove_ponctuations`, `clean_utterance` and `remove_multiple_spaces`.\
+    It is the reference of `check_cleaner`: keep it as it is, even when\
+    these functions change.
+    """
+    if remove_punctuation :
+        utterance = utterance.translate(str.maketrans('', '', string.punctuation))
+    utterance = pylangacq.chat._clean_utterance(utterance=utterance)
+    utterance = utterance.replace("_", " ")
+    utterance = utterance.replace("+", " ")
+    if collapse_spaces :
+        utterance = re.sub(' +', ' ', utterance)
+    return utterance
+
+def check_cleaner(utterances: Sequence[str],
+                    remove_punctuation: bool=True,
+                    collapse_spaces: bool=False) -> List[int]:
+    """
+    Compare the output of `Cleaner.clean_many` with the one of the\
+    original cleaning (see `_original_clean`) on the given utterances.
+
+    Return
+    ------
+    - list:
+        The indices of the utterances cleaned differently.
+    """
+    cleaned = Cleaner(remove_punctuation, collapse_spaces).clean_many(utterances)
+    return [idx for idx, (utterance, clean) in enumerate(zip(utterances, cleaned))
+            if _original_clean(utterance, remove_punctuation, collapse_spaces) != clean]
+
+CLEANER = Cleaner()
 
 def phonemic_words_tokenization(utterance: str) -> str:
     """
@@ -77,8 +184,8 @@ def phonemic_words_tokenization(utterance: str) -> str:
     - str:
         The tokenized utterance.
     """
-    utterance = utterance.replace("$", "")
-    return utterance.replace("@", " ")
+    utterance = utterance.replace(PHONE_SEPARATOR, "")
+    return utterance.replace(WORD_SEPARATOR, " ")
 
 def phonemic_phonemes_tokenization(utterance: str) -> str:
     """
@@ -95,12 +202,80 @@ def phonemic_phonemes_tokenization(utterance: str) -> str:
     - str:
         The tokenized utterance
     """
-    utterance = utterance.replace("$", " ")
-    return utterance.replace("@", " ")
+    utterance = utterance.replace(PHONE_SEPARATOR, " ")
+    return utterance.replace(WORD_SEPARATOR, " ")
+
+class PhonemizationLexicon:
+    """
+    Per-word phonemization lexicon.
+
+    Utterances are phonemized by looking up each word and joining the\
+    phonemized words with the word separator, which gives the same format\
+    as the espeak backend. Words missing from the lexicon are phonemized\
+    with espeak once and cached. Note that words are phonemized out of\
+    context, so a few reduced forms may differ from a full utterance\
+    phonemization.
+    """
+    def __init__(self, entries: Dict[str, str]=None) :
+        self.entries = dict(entries or {})
+
+    def add_words(self, words: Iterable[str], batch_size: int=10000) -> None:
+        """Phonemize new words with espeak, by batches."""
+        words = sorted(set(word.lower() for word in words) - set(self.entries))
+        if not words :
+            return
+        backend, separator = get_backend()
+        for start in range(0, len(words), batch_size) :
+            batch = words[start:start + batch_size]
+            phonemized = backend.phonemize(batch, separator=separator, strip=True)
+            self.entries.update(zip(batch, phonemized))
+
+    def phonemize(self, utterance: str) -> str:
+        """
+        Phonemize an utterance by dictionary lookup, falling back to\
+        espeak for out-of-vocabulary words.
+        """
+        words = [word.lower() for word in utterance.split()]
+        missing = [word for word in words if word not in self.entries]
+        if missing :
+            self.add_words(missing)
+        return WORD_SEPARATOR.join(self.entries[word] for word in words if self.entries[word])
+
+    def save(self, path: str) -> None:
+        """Save the lexicon as a tab separated file."""
+        with open(path, mode="w", encoding="utf-8") as lexicon_file :
+            for word, phonemized in sorted(self.entries.items()) :
+                lexicon_file.write(f"{word}\t{phonemized}\n")
+
+    @classmethod
+    def load(cls, path: str) -> "PhonemizationLexicon":
+        """Load a lexicon saved by `save`."""
+        entries = {}
+        with open(path, mode="r", encoding="utf-8") as lexicon_file :
+            for line in lexicon_file :
+                word, _, phonemized = line.rstrip("\n").partition("\t")
+                entries[word] = phonemized
+        return cls(entries)
+
+def build_lexicon(vocabulary: Iterable[str], out_path: str) -> PhonemizationLexicon:
+    """
+    Build the phonemization lexicon of the vocabulary of an orthographic\
+    corpus and save it.
+    """
+    lexicon = PhonemizationLexicon()
+    lexicon.add_words(vocabulary)
+    lexicon.save(out_path)
+    return lexicon
+
+def load_lexicon(path: str) -> None:
+    """Make `phonemization` use the lexicon stored at the given path."""
+    global LEXICON
+    LEXICON = PhonemizationLexicon.load(path)
 
 def phonemization(utterance: str) -> str:
     """
-    Phonemize a given utterance.
+    Phonemize a given utterance, with the lexicon if one\
+    has been loaded, with espeak otherwise.
 
     Parameters
     ----------
@@ -111,7 +286,20 @@ def phonemization(utterance: str) -> str:
     ------
     The phonemized utterance.
     """
-    return BACKEND.phonemize([utterance], separator=SEPARATOR, strip=True)[0]
+    if LEXICON is not None :
+        return LEXICON.phonemize(utterance)
+    backend, separator = get_backend()
+    return backend.phonemize([utterance], separator=separator, strip=True)[0]
+
+def phonemize_many(utterances: List[str]) -> List[str]:
+    """
+    Phonemize many utterances at once: with the lexicon if one has been\
+    loaded, otherwise with a single call to espeak.
+    """
+    if LEXICON is not None :
+        return [LEXICON.phonemize(utterance) for utterance in utterances]
+    backend, separator = get_backend()
+    return backend.phonemize(utterances, separator=separator, strip=True)
 
 def preprocess(utterance: str,
                 phonemize: bool=True,
@@ -131,8 +319,7 @@ def preprocess(utterance: str,
     - str:
         The cleaned utterance.
     """
-    utterance = remove_ponctuations(utterance)
-    utterance = clean_utterance(utterance)
+    utterance = CLEANER.clean(utterance)
     if phonemize :
         utterance = phonemization(utterance)
         if words : 
@@ -1,73 +1,382 @@
 """This module will compute accuracies on the different tasks."""
 import csv
-from typing import Dict
+import multiprocessing
+from typing import Dict, List, Tuple
 from pathlib import Path
+import numpy as np
 from tqdm import tqdm
-from paraphone.ngrams_tools import NGramLanguageModel
+from models.scorer import Scorer, ParaphoneScorer
+from models.ngram_store import CompiledNGramModel, is_compiled_model
+from instrumentation import add_profiling_arguments, profiling, span
+from tokenizations import TOKENIZATIONS, tokenization_name
+
+# Per-pair scores of each (model, task): grammatical and ungrammatical log-probabilities.
+TaskScores = Dict[Tuple[str, str], Tuple[np.ndarray, np.ndarray]]
+
+# Models shared with the worker processes: they are set before the pool is\
+# forked, so workers use the parent's copy (copy-on-write, or the page\
+# cache for memory mapped models) instead of reloading or pickling them.
+_SHARED_MODELS: List[Tuple[str, Scorer, str]] = []
+
+def load_tasks(tasks_folder: str) -> Dict[str, List[Tuple[str, str]]]:
+    """
+    Read the (grammatical, ungrammatical) pairs of all the task csvs.
+
+    Parameters
+    ----------
+    - tasks_folder: str
+        The folder containing the task csvs
+
+    Return
+    ------
+    - dict:
+        Dictionnary mapping tasks and their pairs of sentences.
+    """
+    tasks = {}
+    for task in sorted(Path(tasks_folder).glob("*.csv")) :
+        with open(task, mode="r", encoding="utf-8") as task_file :
+            task_csv = csv.reader(task_file, delimiter="\t")
+            tasks[task.stem] = [(real_sentence.strip(), modified_sentence.strip())
+                                for real_sentence, modified_sentence in task_csv]
+    return tasks
+
+def preprocess_tasks(tasks: Dict[str, List[Tuple[str, str]]],
+                        phonemized: bool,
+                        tokenized_in_words: bool) -> Dict[str, Tuple[List[List[str]], List[List[str]]]]:
+    """
+    Preprocess and tokenize the pairs of sentences of all the tasks.
+
+    Return
+    ------
+    - dict:
+        Dictionnary mapping tasks to their tokenized grammatical sentences\
+        and their tokenized ungrammatical sentences.
+    """
+    from preprocessing_tools import preprocess
+    # Task sentences repeat a lot across pairs: each one is preprocessed once.
+    cache = {}
+    def tokenize(sentence: str) -> List[str] :
+        if sentence not in cache :
+            cache[sentence] = preprocess(sentence, phonemized, tokenized_in_words).split(" ")
+        return cache[sentence]
+    preprocessed_tasks = {}
+    for task_name, pairs in tqdm(tasks.items(), total=len(tasks)) :
+        preprocessed_tasks[task_name] = ([tokenize(real_sentence) for real_sentence, _ in pairs],
+                                            [tokenize(modified_sentence) for _, modified_sentence in pairs])
+    return preprocessed_tasks
+
+def score_tasks(scorer: Scorer,
+                preprocessed_tasks: Dict[str, Tuple[List[List[str]], List[List[str]]]]) \
+                    -> Dict[str, Tuple[np.ndarray, np.ndarray]] :
+    """
+    Score the grammatical and ungrammatical sentences of preprocessed tasks.
+
+    Return
+    ------
+    - dict:
+        Dictionnary mapping tasks to the log-probabilities of their\
+        grammatical sentences and of their ungrammatical sentences.
+    """
+    return {task_name: (np.asarray(scorer.score_batch(real_sentences), dtype=np.float64),
+                        np.asarray(scorer.score_batch(modified_sentences), dtype=np.float64))
+            for task_name, (real_sentences, modified_sentences) in preprocessed_tasks.items()}
+
+def accuracy(real_logprobs: np.ndarray, modified_logprobs: np.ndarray) -> float :
+    """The proportion of pairs for which the grammatical sentence gets the highest score."""
+    return int(np.sum(real_logprobs > modified_logprobs)) / len(real_logprobs)
+
+def evaluate(scorer: Scorer,
+                preprocessed_tasks: Dict[str, Tuple[List[List[str]], List[List[str]]]]) -> Dict[str, float] :
+    """
+    Compute the accuracy of a model on preprocessed tasks: the proportion\
+    of pairs for which the grammatical sentence gets the highest score.
+    """
+    return {task_name: accuracy(real_logprobs, modified_logprobs)
+            for task_name, (real_logprobs, modified_logprobs) in score_tasks(scorer, preprocessed_tasks).items()}
 
 def run_tasks(tasks_folder: str,
-                ngram_lm: NGramLanguageModel,
+                ngram_lm: Scorer,
                 phonemized: bool,
-                tokenized_in_words: bool) -> Dict[str, float] :
+                tokenized_in_words: bool,
+                workers: int=1) -> Dict[str, float] :
     """
-    Run the tasks on ngram language model.
+    Run the tasks on a language model.
 
     Parameters
     ----------
     - tasks_folder: str
         The folder containing the task csvs
-    - ngram_lm: NGramLanguageModel
-        The ngram language model object
+    - ngram_lm: Scorer
+        The language model object (any Scorer, paraphone models\
+        are wrapped in a ParaphoneScorer)
     - phonemized: bool
         Whether phonemize or not the utterance
     - tokenized_in_words: bool
         Whether tokenize the model in words or not
-    
+    - workers: int
+        The number of processes preprocessing and scoring the pairs.
+
     Return
     ------
     - dict:
         Dictionnaty mapping tasks and their accuracy.
     """
-    task_csvs = list(Path(tasks_folder).glob("*.csv"))
-    total_tasks = len(task_csvs)
-    task_scores = {}
-    for task in tqdm(task_csvs, total=total_tasks) :
-        task_name = task.stem
-        total = 0.0
-        goods = 0.0
-        with open(task, mode="r", encoding="utf-8") as task_file :
-            task_csv = csv.reader(task_file, delimiter="\t")
-            for real_sentence, modified_sentence in task_csv :
-                real_sentence, modified_sentence = real_sentence.strip(), modified_sentence.strip()
-                real_sentence = preprocess(real_sentence, phonemized, tokenized_in_words)
-                modified_sentence = preprocess(modified_sentence, phonemized, tokenized_in_words)
-                real_sentence = list(ngram_lm.get_ngrams(real_sentence.split(" ")))
-                modified_sentence = list(ngram_lm.get_ngrams(modified_sentence.split(" ")))
-                goods += (int(ngram_lm.to_ngram_logprob(real_sentence) > \
-                                ngram_lm.to_ngram_logprob(modified_sentence)))
-                total += 1
-        task_scores[task_name] = goods / total
-    return task_scores
+    if not isinstance(ngram_lm, Scorer) :
+        ngram_lm = ParaphoneScorer(ngram_lm)
+    if workers > 1 :
+        rows = run_models(tasks_folder,
+                            [("model", ngram_lm, tokenization_name(phonemized, tokenized_in_words))],
+                            workers=workers)
+        return {task_name: accuracy for _, task_name, accuracy in rows}
+    preprocessed_tasks = preprocess_tasks(load_tasks(tasks_folder), phonemized, tokenized_in_words)
+    return evaluate(ngram_lm, preprocessed_tasks)
+
+def _score_shard(shard: Tuple[str, int, List[str]]) -> Tuple[str, int, Dict[str, np.ndarray]] :
+    """
+    Preprocess a shard of distinct sentences and score it with each shared\
+    model using the shard's tokenization.
+    """
+    from preprocessing_tools import preprocess
+    tokenization, start, sentences = shard
+    phonemized, tokenized_in_words = TOKENIZATIONS[tokenization]
+    sentences = [preprocess(sentence, phonemized, tokenized_in_words).split(" ")
+                    for sentence in sentences]
+    scores = {model_name: np.asarray(scorer.score_batch(sentences), dtype=np.float64)
+                for model_name, scorer, model_tokenization in _SHARED_MODELS
+                if model_tokenization == tokenization}
+    return tokenization, start, scores
+
+def _score_models_parallel(tasks: Dict[str, List[Tuple[str, str]]],
+                            models: List[Tuple[str, Scorer, str]],
+                            workers: int,
+                            shard_size: int) -> TaskScores :
+    """
+    Shard the distinct sentences of all the tasks across a pool of forked\
+    processes, so that each sentence is preprocessed and scored once per\
+    tokenization, and put the scores back at the position of their pairs.
+    """
+    global _SHARED_MODELS
+    _SHARED_MODELS = models
+    tokenizations = sorted(set(tokenization for _, _, tokenization in models))
+    if any(TOKENIZATIONS[tokenization][0] for tokenization in tokenizations) :
+        # Start espeak once, before forking, rather than in every worker.
+        from preprocessing_tools import get_backend
+        get_backend()
+    # Task sentences repeat a lot across pairs and tasks.
+    sentences = sorted(set(sentence for pairs in tasks.values()
+                            for pair in pairs
+                            for sentence in pair))
+    sentence_ids = {sentence: idx for idx, sentence in enumerate(sentences)}
+    shards = [(tokenization, start, sentences[start:start + shard_size])
+                for tokenization in tokenizations
+                for start in range(0, len(sentences), shard_size)]
+    sentence_scores = {model_name: np.zeros(len(sentences)) for model_name, _, _ in models}
+    n_sentences = len(sentences) * len(models)
+    with span("preprocess and score (parallel)", items=n_sentences), \
+            multiprocessing.get_context("fork").Pool(workers) as pool :
+        for _, start, shard_scores in tqdm(pool.imap_unordered(_score_shard, shards),
+                                            total=len(shards)) :
+            for model_name, logprobs in shard_scores.items() :
+                sentence_scores[model_name][start:start + len(logprobs)] = logprobs
+    _SHARED_MODELS = []
+    scores = {}
+    for task_name, pairs in tasks.items() :
+        real_ids = np.array([sentence_ids[real_sentence] for real_sentence, _ in pairs], dtype=np.int64)
+        modified_ids = np.array([sentence_ids[modified_sentence] for _, modified_sentence in pairs],
+                                dtype=np.int64)
+        for model_name, _, _ in models :
+            scores[(model_name, task_name)] = (sentence_scores[model_name][real_ids],
+                                                sentence_scores[model_name][modified_ids])
+    return scores
+
+def score_models(tasks_folder: str,
+                    models: List[Tuple[str, Scorer, str]],
+                    workers: int=1,
+                    shard_size: int=500) -> TaskScores :
+    """
+    Score many models in a single pass: the tasks are read once and\
+    each tokenization is computed once, whatever the number of models using it.
+
+    Parameters
+    ----------
+    - tasks_folder: str
+        The folder containing the task csvs
+    - models: list
+        (name, scorer, tokenization) triplets, where tokenization is one of\
+        the keys of TOKENIZATIONS.
+    - workers: int
+        The number of processes. With more than one worker, the distinct\
+        sentences are split in shards that are preprocessed and scored in parallel.
+    - shard_size: int
+        The number of distinct sentences per shard.
+
+    Return
+    ------
+    - dict:
+        Dictionnary mapping (model, task) to the per-pair log-probabilities.
+    """
+    with span("load_tasks") as stage :
+        tasks = load_tasks(tasks_folder)
+        stage.add(sum(len(pairs) for pairs in tasks.values()))
+    if workers > 1 :
+        return _score_models_parallel(tasks, models, workers, shard_size)
+    n_sentences = 2 * sum(len(pairs) for pairs in tasks.values())
+    preprocessed = {}
+    scores = {}
+    for model_name, scorer, tokenization in models :
+        if tokenization not in preprocessed :
+            print(f"Preprocessing the tasks ({tokenization})...")
+            with span(f"preprocess {tokenization}", items=n_sentences) :
+                preprocessed[tokenization] = preprocess_tasks(tasks, *TOKENIZATIONS[tokenization])
+        print(f"Evaluating {model_name}...")
+        with span(f"score {model_name}", items=n_sentences) :
+            for task_name, task_scores in score_tasks(scorer, preprocessed[tokenization]).items() :
+                scores[(model_name, task_name)] = task_scores
+    return scores
+
+def score_models_remote(tasks_folder: str,
+                        client,
+                        model_names: List[str],
+                        chunk_size: int=4096) -> TaskScores :
+    """
+    Score the tasks with models served by a scoring server (see\
+    scoring_server.py), which preprocesses the sentences itself.
+
+    Parameters
+    ----------
+    - tasks_folder: str
+        The folder containing the task csvs
+    - client: ScoringClient
+        The client connected to the server.
+    - model_names: list
+        The names of the served models to evaluate.
+    - chunk_size: int
+        The number of sentences sent per request.
+
+    Return
+    ------
+    - dict:
+        Dictionnary mapping (model, task) to the per-pair log-probabilities.
+    """
+    with span("load_tasks") :
+        tasks = load_tasks(tasks_folder)
+    # Each distinct sentence is only sent once.
+    sentences = sorted(set(sentence for pairs in tasks.values() for pair in pairs for sentence in pair))
+    positions = {sentence: idx for idx, sentence in enumerate(sentences)}
+    scores = {}
+    for model_name in model_names :
+        print(f"Evaluating {model_name}...")
+        with span(f"score {model_name}", items=len(sentences)) :
+            sentence_scores = np.concatenate([client.score(model_name, sentences[start:start + chunk_size])
+                                                for start in range(0, len(sentences), chunk_size)] or [[]])
+        for task_name, pairs in tasks.items() :
+            scores[(model_name, task_name)] = \
+                (sentence_scores[[positions[real_sentence] for real_sentence, _ in pairs]],
+                    sentence_scores[[positions[modified_sentence] for _, modified_sentence in pairs]])
+    return scores
+
+def run_models(tasks_folder: str,
+                models: List[Tuple[str, Scorer, str]],
+                workers: int=1,
+                shard_size: int=500) -> List[Tuple[str, str, float]] :
+    """
+    Evaluate many models in a single pass (see `score_models`).
+
+    Return
+    ------
+    - list:
+        The (model, task, accuracy) rows.
+    """
+    scores = score_models(tasks_folder, models, workers, shard_size)
+    return [(model_name, task_name, accuracy(real_logprobs, modified_logprobs))
+            for (model_name, task_name), (real_logprobs, modified_logprobs) in scores.items()]
+
+def save_scores(path: str, scores: TaskScores) -> None :
+    """
+    Save per-pair scores as a compressed columnar file, with one row per\
+    (model, task, pair): model and task are stored as integer codes.
+
+    Parameters
+    ----------
+    - path: str
+        The output .npz file.
+    - scores: dict
+        The scores returned by `score_models`.
+    """
+    model_names = sorted(set(model_name for model_name, _ in scores))
+    task_names = sorted(set(task_name for _, task_name in scores))
+    keys = list(scores)
+    sizes = [len(scores[key][0]) for key in keys]
+    np.savez_compressed(path,
+                        model_names=np.array(model_names),
+                        task_names=np.array(task_names),
+                        model=np.repeat([model_names.index(model_name) for model_name, _ in keys],
+                                        sizes).astype(np.uint16),
+                        task=np.repeat([task_names.index(task_name) for _, task_name in keys],
+                                        sizes).astype(np.uint16),
+                        pair=np.concatenate([np.arange(size, dtype=np.uint32) for size in sizes]),
+                        real_logprob=np.concatenate([scores[key][0] for key in keys]),
+                        modified_logprob=np.concatenate([scores[key][1] for key in keys]))
+
+def load_model(model_path: str, num_threads: int=None) -> Scorer :
+    """
+    Load a trained language model, whose type is inferred from the file.
+
+    Parameters
+    ----------
+    - model_path: str
+        A paraphone JSON model, a compiled binary n-gram model,\
+        a neural n-gram model (.npz) or an LSTM model (.pt).
+    - num_threads: int
+        The number of CPU threads used by the LSTM models.
+
+    Return
+    ------
+    - Scorer:
+        The loaded model.
+    """
+    if is_compiled_model(model_path) :
+        return CompiledNGramModel(model_path)
+    if Path(model_path).suffix == ".npz" :
+        from models.neural_ngram_lm import NeuralNGramLanguageModel
+        model = NeuralNGramLanguageModel()
+    elif Path(model_path).suffix == ".pt" :
+        from models.lstm_lm import LSTMLanguageModel
+        model = LSTMLanguageModel(num_threads=num_threads)
+    else :
+        from paraphone.ngrams_tools import NGramLanguageModel
+        ngram_lm = NGramLanguageModel()
+        ngram_lm.load_parameters(model_path)
+        return ParaphoneScorer(ngram_lm)
+    model.load_parameters(model_path)
+    return model
 
 if __name__ == "__main__" :
     from argparse import ArgumentParser
     import csv
-    print("Loading phonemizer...")
-    from preprocessing_tools import preprocess
-    print("Phonemizer loaded !")
     parser = ArgumentParser()
     parser.add_argument("--train_file",
                         type=str,
                         help="The directory containing the train file.",
-                        required=True)
+                        required=False)
     parser.add_argument("--tasks_folder",
                     type=str,
                     help="The folder containing the tasks",
                     required=True)
     parser.add_argument("--ngram_model",
                         type=str,
-                        help="The trained ngram model.",
-                        required=True)
+                        help="The trained model (paraphone JSON, compiled\
+                            binary n-gram model, neural n-gram model or LSTM).",
+                        required=False)
+    parser.add_argument("--model",
+                        nargs=3,
+                        action="append",
+                        metavar=("NAME", "PATH", "TOKENIZATION"),
+                        help=f"A model to evaluate, with the tokenization it\
+                            expects (one of {', '.join(TOKENIZATIONS)}). Can be\
+                            repeated to evaluate many models in a single pass,\
+                            in which case --ngram_model and the tokenization\
+                            flags are ignored.")
 
     parser.add_argument('--phonemize', action='store_true')
     parser.add_argument('--no-phonemize', dest='phonemize', action='store_false')
@@ -77,21 +386,86 @@ if __name__ == "__main__" :
                         type=str,
                         help="The filename of the output file",
                         required=True)
+    parser.add_argument("--out_directory",
+                        type=str,
+                        default="results",
+                        help="The directory of the output files.")
+    parser.add_argument("--num_threads",
+                        type=int,
+                        default=None,
+                        help="The number of CPU threads used by LSTM models.")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=1,
+                        help="The number of processes preprocessing and\
+                            scoring shards of sentences in parallel.")
+    parser.add_argument("--lexicon",
+                        type=str,
+                        default=None,
+                        help="A phonemization lexicon (e.g. data/tokenized/providence_lexicon.tsv)\
+                            used to phonemize task sentences word by word.")
+    parser.add_argument("--server",
+                        type=str,
+                        default=None,
+                        help="The UNIX socket of a scoring server (see scoring_server.py):\
+                            the served models are evaluated without loading\
+                            any model or phonemizer in this process.")
+    parser.add_argument("--remote_model",
+                        type=str,
+                        action="append",
+                        help="With --server, a served model to evaluate. Can be repeated\
+                            (default to all the served models).")
+    parser.add_argument("--save_scores",
+                        action="store_true",
+                        help="Also save the per-pair log-probabilities in\
+                            <out_directory>/<out_filename>_scores.npz (see analyze_scores.py).")
+    add_profiling_arguments(parser)
     parser.set_defaults(feature=False)
     parser.set_defaults(tokenized_in_words=True)
     args = parser.parse_args()
+    if not args.model and not args.ngram_model and not args.server :
+        parser.error("Either --ngram_model, --model or --server is required.")
+    for _, _, tokenization in args.model or [] :
+        if tokenization not in TOKENIZATIONS :
+            parser.error(f"Unknown tokenization {tokenization}, choose among {', '.join(TOKENIZATIONS)}.")
 
-    out_directory = Path("results")
-    out_directory.mkdir(exist_ok=True, parents=True)
-    ngram_lm = NGramLanguageModel()
-    print("Loading the model...")
-    ngram_lm.load_parameters(args.ngram_model)
-    print("Running the tasks...")
-    result_tasks = run_tasks(args.tasks_folder,
-                                ngram_lm,
-                                args.phonemize,
-                                args.tokenize_in_words)
-    with open(out_directory / Path(f"{args.out_filename}.csv"), "w") as out_csv:
-        csv_writer = csv.writer(out_csv)
-        for task, accuracy in result_tasks.items():
-            csv_writer.writerow([task, accuracy])
+    with profiling(args.profile, args.cprofile) :
+        out_directory = Path(args.out_directory)
+        out_directory.mkdir(exist_ok=True, parents=True)
+        if args.server :
+            from scoring_server import ScoringClient
+            with ScoringClient(args.server) as client :
+                served_models = client.models()
+                for model_name in args.remote_model or [] :
+                    if model_name not in served_models :
+                        parser.error(f"{model_name} is not served, served models are {', '.join(served_models)}.")
+                print("Running the tasks...")
+                scores = score_models_remote(args.tasks_folder, client, args.remote_model or list(served_models))
+        else :
+            from preprocessing_tools import load_lexicon
+            if args.lexicon :
+                load_lexicon(args.lexicon)
+            if args.model :
+                print("Loading the models...")
+                with span("load_models", items=len(args.model)) :
+                    models = [(name, load_model(path, args.num_threads), tokenization)
+                                for name, path, tokenization in args.model]
+            else :
+                print("Loading the model...")
+                with span("load_models", items=1) :
+                    models = [(args.out_filename,
+                                load_model(args.ngram_model, args.num_threads),
+                                tokenization_name(args.phonemize, args.tokenize_in_words))]
+            print("Running the tasks...")
+            scores = score_models(args.tasks_folder, models, workers=args.workers)
+        many_models = bool(args.model or args.server)
+        with open(out_directory / Path(f"{args.out_filename}.csv"), "w") as out_csv:
+            csv_writer = csv.writer(out_csv)
+            if many_models :
+                csv_writer.writerow(["model", "task", "accuracy"])
+            for (model_name, task), (real_logprobs, modified_logprobs) in scores.items():
+                row = [task, accuracy(real_logprobs, modified_logprobs)]
+                csv_writer.writerow([model_name] + row if many_models else row)
+        if args.save_scores :
+            with span("save_scores") :
+                save_scores(out_directory / Path(f"{args.out_filename}_scores.npz"), scores)
@@ -0,0 +1,304 @@
+"""This module implements a local scoring server that keeps language models\
+and the phonemization backend loaded between evaluations, and its client.
+
+The server listens on a UNIX socket. Requests and responses are JSON\
+objects, one per line:
+
+    {"op": "models"}
+        -> {"models": {name: tokenization}}
+    {"op": "score", "model": name, "sentences": [raw sentences]}
+        -> {"scores": [log-probabilities]}
+    {"op": "score", "model": name, "tokens": [tokenized sentences]}
+        -> {"scores": [log-probabilities]}
+    {"op": "stats"}
+        -> {"requests": ..., "batches": ..., "sentences": ...}
+
+Raw sentences are preprocessed with the tokenization of the model, as in\
+run_tasks.py. The requests of concurrent clients for the same model are\
+micro-batched: they are gathered for a few milliseconds (or up to a maximal\
+number of sentences) and scored in a single `score_batch` call.
+"""
+import asyncio
+import json
+import os
+import signal
+import socket
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+import numpy as np
+from models.scorer import Scorer
+
+DEFAULT_SOCKET = "/tmp/cds_scoring.sock"
+# Maximal size of a request line.
+STREAM_LIMIT = 1 << 28
+# Beyond this number of sentences, the preprocessing cache of a tokenization is emptied.
+MAX_CACHED_SENTENCES = 1_000_000
+
+class MicroBatcher :
+    """
+    Gathers the sentences of concurrent requests and scores them together,\
+    in a thread so that the event loop keeps accepting requests.
+    """
+    def __init__(self,
+                    score: Callable[[list], np.ndarray],
+                    max_batch_size: int=4096,
+                    max_delay: float=0.005) :
+        self.score = score
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.queue = None
+        self.task = None
+        self.batches = 0
+
+    async def submit(self, items: list) -> np.ndarray :
+        """Score a list of sentences, possibly along with the sentences of other requests."""
+        if self.queue is None :
+            self.queue = asyncio.Queue()
+            self.task = asyncio.ensure_future(self.run())
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((items, future))
+        return await future
+
+    async def close(self) -> None :
+        """Stop the batching task."""
+        if self.task is not None :
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def run(self) -> None :
+        loop = asyncio.get_event_loop()
+        while True :
+            batch = [await self.queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_delay
+            while size < self.max_batch_size :
+                timeout = deadline - loop.time()
+                if timeout <= 0 :
+                    break
+                try :
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError :
+                    break
+                size += len(batch[-1][0])
+            items = [item for request_items, _ in batch for item in request_items]
+            self.batches += 1
+            try :
+                scores = await loop.run_in_executor(None, self.score, items)
+            except Exception as error :
+                for _, future in batch :
+                    if not future.done() :
+                        future.set_exception(error)
+                continue
+            start = 0
+            for request_items, future in batch :
+                if not future.done() :
+                    future.set_result(scores[start:start + len(request_items)])
+                start += len(request_items)
+
+class ScoringServer :
+    """
+    Serves loaded models: (name -> (scorer, tokenization)), where the\
+    tokenization is one of the keys of run_tasks.TOKENIZATIONS.
+    """
+    def __init__(self,
+                    models: Dict[str, Tuple[Scorer, str]],
+                    max_batch_size: int=4096,
+                    max_delay: float=0.005) :
+        self.models = models
+        self.caches = {}
+        # Batches are scored in executor threads: the preprocessing of a\
+        # tokenization (its cache) and the espeak backend, shared by the\
+        # phonemized tokenizations, are not thread-safe, so they are locked.
+        self.preprocessing_locks = {}
+        self.batchers = {name: MicroBatcher(self._scoring_function(scorer, tokenization),
+                                            max_batch_size,
+                                            max_delay)
+                            for name, (scorer, tokenization) in models.items()}
+        self.requests = 0
+        self.sentences = 0
+
+    def _scoring_function(self, scorer: Scorer, tokenization: str) -> Callable[[list], np.ndarray] :
+        from tokenizations import TOKENIZATIONS
+        from preprocessing_tools import preprocess
+        phonemized, tokenized_in_words = TOKENIZATIONS[tokenization]
+        cache = self.caches.setdefault(tokenization, {})
+        lock = self.preprocessing_locks.setdefault("espeak" if phonemized else tokenization, threading.Lock())
+
+        def tokenize(item: Union[str, List[str]]) -> List[str] :
+            if not isinstance(item, str) :
+                return item
+            if item not in cache :
+                if len(cache) >= MAX_CACHED_SENTENCES :
+                    cache.clear()
+                cache[item] = preprocess(item, phonemized, tokenized_in_words).split(" ")
+            return cache[item]
+
+        def score(items: list) -> np.ndarray :
+            with lock :
+                sentences = [tokenize(item) for item in items]
+            return np.asarray(scorer.score_batch(sentences), dtype=np.float64)
+        return score
+
+    async def handle_request(self, request: dict) -> dict :
+        operation = request.get("op")
+        if operation == "models" :
+            return {"models": {name: tokenization for name, (_, tokenization) in self.models.items()}}
+        if operation == "stats" :
+            return {"requests": self.requests,
+                    "sentences": self.sentences,
+                    "batches": {name: batcher.batches for name, batcher in self.batchers.items()}}
+        if operation == "score" :
+            if request.get("model") not in self.batchers :
+                return {"error": f"Unknown model {request.get('model')}, served models are {list(self.models)}"}
+            items = request["sentences"] if "sentences" in request else request.get("tokens", [])
+            self.requests += 1
+            self.sentences += len(items)
+            scores = await self.batchers[request["model"]].submit(items)
+            return {"scores": scores.tolist()}
+        return {"error": f"Unknown operation {operation}"}
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None :
+        try :
+            while True :
+                line = await reader.readline()
+                if not line :
+                    break
+                try :
+                    response = await self.handle_request(json.loads(line))
+                except Exception as error :
+                    response = {"error": f"{type(error).__name__}: {error}"}
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except (ConnectionResetError, BrokenPipeError) :
+            pass
+        finally :
+            writer.close()
+
+    async def serve(self, socket_path: str) -> None :
+        """Serve until SIGINT or SIGTERM, then remove the socket file."""
+        if Path(socket_path).exists() :
+            if is_serving(socket_path) :
+                raise RuntimeError(f"A server already listens on {socket_path}")
+            os.remove(socket_path)
+        server = await asyncio.start_unix_server(self.handle_client, path=socket_path, limit=STREAM_LIMIT)
+        stop = asyncio.get_event_loop().create_future()
+        for signal_number in (signal.SIGINT, signal.SIGTERM) :
+            asyncio.get_event_loop().add_signal_handler(signal_number, stop.set_result, None)
+        print(f"Serving {', '.join(self.models)} on {socket_path}")
+        try :
+            await stop
+        finally :
+            server.close()
+            await server.wait_closed()
+            for batcher in self.batchers.values() :
+                await batcher.close()
+            if Path(socket_path).exists() :
+                os.remove(socket_path)
+
+def is_serving(socket_path: str) -> bool :
+    """Whether a server accepts connections on the socket."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection :
+        try :
+            connection.connect(str(socket_path))
+        except OSError :
+            return False
+    return True
+
+class ScoringClient :
+    """Blocking client of a scoring server."""
+    def __init__(self, socket_path: str=DEFAULT_SOCKET) :
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.connect(str(socket_path))
+        self.stream = self.connection.makefile("rwb")
+
+    def request(self, **message) -> dict :
+        self.stream.write(json.dumps(message).encode("utf-8") + b"\n")
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line :
+            raise ConnectionError("The scoring server closed the connection.")
+        response = json.loads(line)
+        if "error" in response :
+            raise RuntimeError(response["error"])
+        return response
+
+    def models(self) -> Dict[str, str] :
+        """The served models and their tokenization."""
+        return self.request(op="models")["models"]
+
+    def score(self, model: str, sentences: Sequence[str]) -> np.ndarray :
+        """Score raw sentences, preprocessed by the server."""
+        return np.asarray(self.request(op="score", model=model, sentences=list(sentences))["scores"])
+
+    def score_tokens(self, model: str, sentences: Sequence[Sequence[str]]) -> np.ndarray :
+        """Score tokenized sentences."""
+        return np.asarray(self.request(op="score", model=model, tokens=[list(tokens) for tokens in sentences])["scores"])
+
+    def close(self) -> None :
+        self.stream.close()
+        self.connection.close()
+
+    def __enter__(self) -> "ScoringClient" :
+        return self
+
+    def __exit__(self, *exc_info) -> None :
+        self.close()
+
+class RemoteScorer(Scorer) :
+    """A model served by a scoring server, used as a local Scorer."""
+    def __init__(self, client: ScoringClient, model: str) :
+        self.client = client
+        self.model = model
+
+    def score_batch(self, sentences: Sequence[Sequence[str]]) -> np.ndarray :
+        return self.client.score_tokens(self.model, sentences)
+
+if __name__ == "__main__" :
+    from argparse import ArgumentParser
+    from run_tasks import load_model
+    from tokenizations import TOKENIZATIONS
+    from preprocessing_tools import get_backend, load_lexicon
+    parser = ArgumentParser()
+    parser.add_argument("--model",
+                        nargs=3,
+                        action="append",
+                        metavar=("NAME", "PATH", "TOKENIZATION"),
+                        required=True,
+                        help=f"A model to serve, with the tokenization it expects\
+                            (one of {', '.join(TOKENIZATIONS)}). Can be repeated.")
+    parser.add_argument("--socket",
+                        type=str,
+                        default=DEFAULT_SOCKET,
+                        help="The UNIX socket the server listens on.")
+    parser.add_argument("--lexicon",
+                        type=str,
+                        default=None,
+                        help="A phonemization lexicon used to phonemize sentences word by word.")
+    parser.add_argument("--num_threads",
+                        type=int,
+                        default=None,
+                        help="The number of CPU threads used by LSTM models.")
+    parser.add_argument("--max_batch_size",
+                        type=int,
+                        default=4096,
+                        help="The maximal number of sentences scored at once.")
+    parser.add_argument("--max_delay_ms",
+                        type=float,
+                        default=5.0,
+                        help="How long requests are gathered before being scored together.")
+    args = parser.parse_args()
+    for _, _, tokenization in args.model :
+        if tokenization not in TOKENIZATIONS :
+            parser.error(f"Unknown tokenization {tokenization}, choose among {', '.join(TOKENIZATIONS)}.")
+
+    if args.lexicon :
+        load_lexicon(args.lexicon)
+    if any(TOKENIZATIONS[tokenization][0] for _, _, tokenization in args.model) :
+        print("Loading the phonemizer...")
+        get_backend()
+    print("Loading the models...")
+    served_models = {name: (load_model(path, args.num_threads), tokenization)
+                        for name, path, tokenization in args.model}
+    scoring_server = ScoringServer(served_models, args.max_batch_size, args.max_delay_ms / 1000)
+    asyncio.get_event_loop().run_until_complete(scoring_server.serve(args.socket))
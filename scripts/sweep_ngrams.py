@@ -0,0 +1,211 @@
+"""This script evaluates grids of n-gram language models.
+
+For each tokenization, the n-grams of the training file are counted once,\
+up to the highest order of the grid. Every (order, estimator, alpha, smooth)\
+model is then estimated from these shared counts in memory (the counts of\
+order 1 to n are the same whatever the highest order) and evaluated on the\
+tasks in the same process, the tasks being preprocessed once per tokenization.
+"""
+import csv
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+from run_tasks import load_tasks, preprocess_tasks, evaluate
+from tokenizations import TOKENIZATIONS, TRAINING_FILES
+from models.ngram_lm import ESTIMATORS, count_corpus, estimate_model
+from models.ngram_store import CompiledNGramModel, write_ngram_store
+from instrumentation import add_profiling_arguments, profiling, span
+
+SWEEP_COLUMNS = ["model", "tokenization", "order", "estimator", "alpha", "smooth", "task", "accuracy"]
+
+def model_configurations(orders: Sequence[int],
+                            estimators: Sequence[str],
+                            alphas: Sequence[float],
+                            smooths: Sequence[float]) -> List[Tuple[int, str, float, float]] :
+    """
+    List the (order, estimator, alpha, smooth) configurations of a grid.\
+    Kneser-Ney models do not use alpha and smooth, so they appear once per\
+    order, with None values.
+    """
+    configurations = []
+    for order in sorted(orders) :
+        for estimator in estimators :
+            if estimator == "kneser_ney" :
+                configurations.append((order, estimator, None, None))
+                continue
+            configurations.extend((order, estimator, alpha, smooth)
+                                    for alpha in alphas
+                                    for smooth in smooths)
+    return configurations
+
+def model_name(tokenization: str, order: int, estimator: str, alpha: float, smooth: float) -> str :
+    """Name of a model of the grid, e.g. 3gram_stupid_backoff_alpha0.4_smooth1e-06_orthographic_words."""
+    name = f"{order}gram_{estimator}"
+    if alpha is not None :
+        name += f"_alpha{alpha:g}_smooth{smooth:g}"
+    return f"{name}_{tokenization}"
+
+def sweep(train_files: Dict[str, str],
+            tasks_folder: str,
+            orders: Sequence[int],
+            estimators: Sequence[str]=("stupid_backoff",),
+            alphas: Sequence[float]=(0.4,),
+            smooths: Sequence[float]=(1e-6,),
+            counts_directory: str=None,
+            models_directory: str=None,
+            max_entries: int=5_000_000,
+            tmp_directory: str=None) -> List[list] :
+    """
+    Evaluate all the models of a grid, counting the n-grams once per tokenization.
+
+    Parameters
+    ----------
+    - train_files: dict
+        The training file of each tokenization (keys of TOKENIZATIONS).
+    - tasks_folder: str
+        The folder containing the task csvs.
+    - orders: list
+        The orders of the models.
+    - estimators: list
+        The estimators ('stupid_backoff', 'kneser_ney').
+    - alphas: list
+        The backoff penalties of the stupid backoff models.
+    - smooths: list
+        The probabilities of unknown words of the stupid backoff models.
+    - counts_directory: str
+        Where to keep the counts of each tokenization. By default, they are\
+        written to a temporary directory and removed.
+    - models_directory: str
+        If given, every model is also written there in the compact binary format.
+    - max_entries: int
+        The maximal number of distinct n-grams counted in memory.
+    - tmp_directory: str
+        The directory where the sorted runs of counts are spilled.
+
+    Return
+    ------
+    - list:
+        One row (see SWEEP_COLUMNS) per model and task.
+    """
+    configurations = model_configurations(orders, estimators, alphas, smooths)
+    with span("load_tasks") :
+        tasks = load_tasks(tasks_folder)
+    n_sentences = 2 * sum(len(pairs) for pairs in tasks.values())
+    rows = []
+    for tokenization, train_file in train_files.items() :
+        print(f"Preprocessing the tasks ({tokenization})...")
+        with span(f"preprocess {tokenization}", items=n_sentences) :
+            preprocessed = preprocess_tasks(tasks, *TOKENIZATIONS[tokenization])
+        if counts_directory is None :
+            directory = Path(tempfile.mkdtemp(dir=tmp_directory, prefix="sweep_counts_"))
+        else :
+            directory = Path(counts_directory) / tokenization
+        try :
+            print(f"Counting the n-grams of {train_file} up to order {max(orders)}...")
+            vocabulary, counts = count_corpus(train_file, max(orders), directory, max_entries, tmp_directory)
+            for order, estimator, alpha, smooth in configurations :
+                name = model_name(tokenization, order, estimator, alpha, smooth)
+                with span("estimate") :
+                    tables, metadata = estimate_model(counts[:order], len(vocabulary), estimator, alpha, smooth)
+                    model = CompiledNGramModel.from_orders(vocabulary, tables, metadata)
+                if models_directory is not None :
+                    with span("write") :
+                        Path(models_directory).mkdir(parents=True, exist_ok=True)
+                        write_ngram_store(Path(models_directory) / f"{name}.bin", vocabulary, tables, metadata)
+                with span("score", items=n_sentences) :
+                    accuracies = evaluate(model, preprocessed)
+                rows.extend([name, tokenization, order, estimator, alpha, smooth, task, task_accuracy]
+                            for task, task_accuracy in accuracies.items())
+                print(f"{name}: {sum(accuracies.values()) / len(accuracies):.4f} mean accuracy")
+        finally :
+            if counts_directory is None :
+                shutil.rmtree(directory, ignore_errors=True)
+    return rows
+
+if __name__ == "__main__" :
+    from argparse import ArgumentParser
+    from preprocessing_tools import load_lexicon
+    parser = ArgumentParser()
+    parser.add_argument("--tasks_folder",
+                        type=str,
+                        help="The folder containing the tasks",
+                        required=True)
+    parser.add_argument("--tokenized_directory",
+                        type=str,
+                        default="data/tokenized",
+                        help="The directory of the training files written by create_training_files.py.")
+    parser.add_argument("--tokenizations",
+                        nargs="+",
+                        choices=list(TOKENIZATIONS),
+                        default=list(TOKENIZATIONS),
+                        help="The tokenizations to evaluate (default to all).")
+    parser.add_argument("--orders",
+                        type=int,
+                        nargs="+",
+                        default=[3, 5],
+                        help="The orders of the models.")
+    parser.add_argument("--estimators",
+                        nargs="+",
+                        choices=ESTIMATORS,
+                        default=["stupid_backoff"],
+                        help="The estimators of the models.")
+    parser.add_argument("--alphas",
+                        type=float,
+                        nargs="+",
+                        default=[0.4],
+                        help="The backoff penalties of the stupid backoff models.")
+    parser.add_argument("--smooths",
+                        type=float,
+                        nargs="+",
+                        default=[1e-6],
+                        help="The probabilities of unknown words of the stupid backoff models.")
+    parser.add_argument("--out_filename",
+                        type=str,
+                        help="The results are written to results/<out_filename>.csv",
+                        required=True)
+    parser.add_argument("--counts_directory",
+                        type=str,
+                        default=None,
+                        help="Keep the n-gram counts of each tokenization in this directory.")
+    parser.add_argument("--models_directory",
+                        type=str,
+                        default=None,
+                        help="Also write every model of the grid in the compact binary format.")
+    parser.add_argument("--lexicon",
+                        type=str,
+                        default=None,
+                        help="A phonemization lexicon used to phonemize task sentences word by word.")
+    parser.add_argument("--max_entries_in_memory",
+                        type=int,
+                        default=5_000_000,
+                        help="The maximal number of distinct n-grams counted\
+                            in memory before spilling sorted counts to disk.")
+    parser.add_argument("--tmp_directory",
+                        type=str,
+                        default=None,
+                        help="Where to spill the sorted counts.")
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+
+    with profiling(args.profile, args.cprofile) :
+        if args.lexicon :
+            load_lexicon(args.lexicon)
+        train_files = {tokenization: str(Path(args.tokenized_directory) / TRAINING_FILES[tokenization])
+                        for tokenization in args.tokenizations}
+        rows = sweep(train_files,
+                        args.tasks_folder,
+                        args.orders,
+                        args.estimators,
+                        args.alphas,
+                        args.smooths,
+                        args.counts_directory,
+                        args.models_directory,
+                        args.max_entries_in_memory,
+                        args.tmp_directory)
+        out_directory = Path("results")
+        out_directory.mkdir(exist_ok=True, parents=True)
+        with open(out_directory / f"{args.out_filename}.csv", "w") as out_csv :
+            csv_writer = csv.writer(out_csv)
+            csv_writer.writerow(SWEEP_COLUMNS)
+            csv_writer.writerows(rows)
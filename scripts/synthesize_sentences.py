@@ -1,12 +1,14 @@
 import argparse
 import sys
 from pathlib import Path
+from instrumentation import add_profiling_arguments, profiling, span
 from tasks.synthetizer import BaseCorporaSynthesisTask
 
 
-def synthetize(input, output, credentials_path, test_mode=False):
-    synthetizer = BaseCorporaSynthesisTask(no_confirmation=False)
-    synthetizer.run(input, output, credentials_path, test_mode)
+def synthetize(input, output, credentials_path, test_mode=False, batch_size=None):
+    synthetizer = BaseCorporaSynthesisTask(no_confirmation=False, batch_size=batch_size)
+    with span('synthesize ' + Path(input).stem):
+        synthetizer.run(input, output, credentials_path, test_mode)
 
 
 def main(argv):
@@ -23,6 +25,10 @@ def main(argv):
                         help='if True, will generate only a few stimuli')
     parser.add_argument('--credentials_path', type=str, required=True,
                         help='Path to your Google TTS credentials')
+    parser.add_argument('--batch_size', type=int, default=None,
+                        help='Synthesize up to this number of sentences per request (SSML with <mark> timepoints) '
+                             'and split the audio into one .wav file per sentence.')
+    add_profiling_arguments(parser)
     args = parser.parse_args(argv)
     args.input = Path(args.input)
     args.out = Path(args.out)
@@ -32,41 +38,42 @@ def main(argv):
         args.out = args.out / 'audio'
     args.out.mkdir(parents=True, exist_ok=True)
 
-    if args.which == 'adj_noun_order' or args.which == 'all':
-        print("Adjective noun order task:", end=' ')
-        input = args.input / 'adj_noun_order.csv'
-        output = args.out / input.stem
-        synthetize(input, output, args.credentials_path, args.test)
+    with profiling(args.profile, args.cprofile):
+        if args.which == 'adj_noun_order' or args.which == 'all':
+            print("Adjective noun order task:", end=' ')
+            input = args.input / 'adj_noun_order.csv'
+            output = args.out / input.stem
+            synthetize(input, output, args.credentials_path, args.test, args.batch_size)
 
-    if args.which == 'noun_verb_order' or args.which == 'all':
-        print("Noun verb order task:", end=' ')
-        input = args.input / 'noun_verb_order.csv'
-        output = args.out / input.stem
-        synthetize(input, output, args.credentials_path, args.test)
+        if args.which == 'noun_verb_order' or args.which == 'all':
+            print("Noun verb order task:", end=' ')
+            input = args.input / 'noun_verb_order.csv'
+            output = args.out / input.stem
+            synthetize(input, output, args.credentials_path, args.test, args.batch_size)
 
-    if args.which == 'ana_gender' or args.which == 'all':
-        print("Anaphor gender agreement task:", end=' ')
-        input = args.input / 'anaphor_gender_agreement.csv'
-        output = args.out / input.stem
-        synthetize(input, output, args.credentials_path, args.test)
+        if args.which == 'ana_gender' or args.which == 'all':
+            print("Anaphor gender agreement task:", end=' ')
+            input = args.input / 'anaphor_gender_agreement.csv'
+            output = args.out / input.stem
+            synthetize(input, output, args.credentials_path, args.test, args.batch_size)
 
-    if args.which == 'ana_number' or args.which == 'all':
-        print("Anaphor number agreement task:", end=' ')
-        input = args.input / 'anaphor_number_agreement.csv'
-        output = args.out / input.stem
-        synthetize(input, output, args.credentials_path, args.test)
+        if args.which == 'ana_number' or args.which == 'all':
+            print("Anaphor number agreement task:", end=' ')
+            input = args.input / 'anaphor_number_agreement.csv'
+            output = args.out / input.stem
+            synthetize(input, output, args.credentials_path, args.test, args.batch_size)
 
-    if args.which == 'det_noun' or args.which == 'all':
-        print("Determiner noun agreement task:", end=' ')
-        input = args.input / 'determiner_noun_agreement.csv'
-        output = args.out / input.stem
-        synthetize(input, output, args.credentials_path, args.test)
+        if args.which == 'det_noun' or args.which == 'all':
+            print("Determiner noun agreement task:", end=' ')
+            input = args.input / 'determiner_noun_agreement.csv'
+            output = args.out / input.stem
+            synthetize(input, output, args.credentials_path, args.test, args.batch_size)
 
-    if args.which == 'noun_verb' or args.which == 'all':
-        print("Noun verb agreement task:", end=' ')
-        input = args.input / 'noun_verb_agreement.csv'
-        output = args.out / input.stem
-        synthetize(input, output, args.credentials_path, args.test)
+        if args.which == 'noun_verb' or args.which == 'all':
+            print("Noun verb agreement task:", end=' ')
+            input = args.input / 'noun_verb_agreement.csv'
+            output = args.out / input.stem
+            synthetize(input, output, args.credentials_path, args.test, args.batch_size)
 
 
 if __name__ == "__main__":
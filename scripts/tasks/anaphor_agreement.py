@@ -1,6 +1,5 @@
 from .base import BaseTask
 import pandas as pd
-import mlconjug3
 
 class AnaphorGenderAgreementTask(BaseTask):
 
@@ -51,6 +50,8 @@ class AnaphorNumberAgreementTask(BaseTask):
         self.word_path = word_path
         self.out_path = out_path
         self.init_words()
+        # mlconjug3 is slow to import: only this task needs it
+        import mlconjug3
         self.conjugator = mlconjug3.Conjugator(language='en')
         self._nouns = list(pd.read_csv(self.nouns_path)['word'])[:self.n_nouns]
         self._nouns_plural = list(pd.read_csv(self.nouns_path)['plural'])[:self.n_nouns]
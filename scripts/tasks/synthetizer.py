@@ -1,20 +1,22 @@
 # Adapted from: gitlab.cognitive-ml.fr/htiteux/paraphone
 import asyncio
+import io
 import itertools
 import logging
+import os
 import random
 import shutil
+import wave
 from asyncio import Semaphore
+from concurrent.futures import ThreadPoolExecutor
 from itertools import zip_longest
 from logging import StreamHandler, Formatter
 from pathlib import Path
-from typing import Optional, Iterable, List, Tuple, Awaitable, Set
+from typing import Optional, Iterable, Iterator, List, Tuple, Awaitable, Callable, Set
+from xml.sax.saxutils import escape
 
 import pandas as pd
 from aiolimiter import AsyncLimiter
-from google.api_core.exceptions import GoogleAPICallError
-from google.cloud import texttospeech
-from google.cloud.texttospeech_v1 import SynthesisInput
 from tqdm.asyncio import tqdm as async_tqdm
 
 VOICES = [
@@ -42,6 +44,141 @@ stream_handler.setLevel(logging.INFO)
 stream_handler.setFormatter(stream_formatter)
 logger.addHandler(stream_handler)
 
+# Silence between the sentences of a batched request, half of it is kept on each side of a sentence.
+SSML_BREAK_MS = 500
+# Maximal size of the SSML input of a request.
+MAX_SSML_BYTES = 5000
+AUDIO_EXTENSIONS = ["ogg", "wav"]
+# Audio files are written under this suffix and renamed once on disk.
+TMP_SUFFIX = ".tmp"
+
+
+def ssml_sentence(idx: int, sentence: str) -> str:
+    return f'<mark name="{idx}"/>{escape(sentence)}<mark name="{idx}_end"/><break time="{SSML_BREAK_MS}ms"/>'
+
+
+def build_ssml(sentences: List[str]) -> str:
+    """
+    Pack sentences in a single SSML input: each sentence is between a start mark ("<i>")
+    and an end mark ("<i>_end"), and followed by a break.
+    """
+    return f"<speak>{''.join(ssml_sentence(idx, sentence) for idx, sentence in enumerate(sentences))}</speak>"
+
+
+def pack_sentences(sentences: Iterable[str], max_sentences: int,
+                   max_bytes: int = MAX_SSML_BYTES) -> Iterator[List[str]]:
+    """Group sentences in batches of at most max_sentences whose SSML input fits in max_bytes."""
+    batch, size = [], len("<speak></speak>")
+    for sentence in sentences:
+        sentence_size = len(ssml_sentence(len(batch), sentence).encode("utf-8"))
+        if batch and (len(batch) == max_sentences or size + sentence_size > max_bytes):
+            yield batch
+            batch, size = [], len("<speak></speak>")
+            sentence_size = len(ssml_sentence(0, sentence).encode("utf-8"))
+        batch.append(sentence)
+        size += sentence_size
+    if batch:
+        yield batch
+
+
+def split_audio(audio_bytes: bytes, timepoints: List[Tuple[str, float]], n_sentences: int) -> List[bytes]:
+    """
+    Split the WAV audio of a batched request into one WAV file per sentence, from its start mark
+    to its end mark, with half of the break before and after.
+    """
+    marks = dict(timepoints)
+    missing = [name for idx in range(n_sentences) for name in (str(idx), f"{idx}_end") if name not in marks]
+    if missing:
+        raise ValueError(f"Missing timepoints for marks {', '.join(missing)}")
+    with wave.open(io.BytesIO(audio_bytes)) as audio:
+        params = audio.getparams()
+        frames = audio.readframes(audio.getnframes())
+    frame_size = params.sampwidth * params.nchannels
+    n_frames = len(frames) // frame_size
+    padding = SSML_BREAK_MS / 2000
+    segments = []
+    for idx in range(n_sentences):
+        start = max(0, int((marks[str(idx)] - padding) * params.framerate))
+        end = min(n_frames, int((marks[f"{idx}_end"] + padding) * params.framerate))
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as segment:
+            segment.setparams(params)
+            segment.writeframes(frames[start * frame_size:end * frame_size])
+        segments.append(buffer.getvalue())
+    return segments
+
+
+def write_atomically(files: List[Tuple[Path, bytes]]):
+    """
+    Write files to temporary files, fsync them and rename them all at once, then fsync their
+    directories: a file only appears under its name once it is complete on disk.
+    """
+    tmp_paths = []
+    for path, data in files:
+        tmp_path = path.with_name(path.name + TMP_SUFFIX)
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        tmp_paths.append(tmp_path)
+    for tmp_path, (path, _) in zip(tmp_paths, files):
+        os.replace(tmp_path, path)
+    for directory in set(path.parent for path, _ in files):
+        try:
+            directory_fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.fsync(directory_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(directory_fd)
+
+
+class AudioWriter:
+    """
+    Writes files from the event loop without blocking it: files are queued and written by batches
+    (see write_atomically) in a pool of threads. `write` waits while max_pending files are queued,
+    which slows down the synthesis when the disk cannot keep up.
+    """
+    def __init__(self, workers: int = 16, max_pending: int = 256, batch_size: int = 32):
+        self.queue = asyncio.Queue(max_pending)
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(workers)
+        self.consumers = [asyncio.ensure_future(self._consume()) for _ in range(workers)]
+        self.error = None
+
+    async def write(self, path: Path, data: bytes):
+        if self.error is not None:
+            raise self.error
+        await self.queue.put((path, data))
+
+    async def _consume(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            files = [await self.queue.get()]
+            while len(files) < self.batch_size and not self.queue.empty():
+                files.append(self.queue.get_nowait())
+            try:
+                if self.error is None:
+                    await loop.run_in_executor(self.executor, write_atomically, files)
+            except Exception as error:
+                self.error = error
+            finally:
+                for _ in files:
+                    self.queue.task_done()
+
+    async def close(self):
+        """Wait for the queued files to be written."""
+        await self.queue.join()
+        for consumer in self.consumers:
+            consumer.cancel()
+        await asyncio.gather(*self.consumers, return_exceptions=True)
+        self.executor.shutdown()
+        if self.error is not None:
+            raise self.error
+
 
 class GoogleSpeakSynthesizer:
     STANDARD_VOICE_PRICE_PER_CHAR = 0.000004
@@ -50,6 +187,8 @@ class GoogleSpeakSynthesizer:
     RETRY_WAIT_TIME = 10.0
 
     def __init__(self, lang, voice_id: str, credentials_path: Path):
+        # The Google client is slow to import: it is only loaded once a synthesizer is created
+        from google.cloud import texttospeech
         self.lang = lang
         self.credentials_file = credentials_path
         self.voice_id = voice_id
@@ -61,32 +200,63 @@ class GoogleSpeakSynthesizer:
             audio_encoding=texttospeech.AudioEncoding.OGG_OPUS
         )
         self.client = texttospeech.TextToSpeechAsyncClient.from_service_account_file(str(credentials_path))
+        # Client of the v1beta1 API, which returns the time of SSML marks, created on the first batched request
+        self.beta_client = None
 
     def estimate_price(self, sentences: Iterable[str]):
         return sum(len(sentence) for sentence in sentences) * self.WAVENET_VOICE_PRICE_PER_CHAR
 
-    async def _synth_worker(self, synth_input: SynthesisInput) -> Optional[bytes]:
+    async def _retry(self, request: Callable[[], Awaitable]):
+        from google.api_core.exceptions import GoogleAPICallError
         for _ in range(self.NUMBER_RETRIES):
             try:
-                response = await self.client.synthesize_speech(
-                    input=synth_input,
-                    voice=self.voice,
-                    audio_config=self.audio_config
-                )
+                response = await request()
             except GoogleAPICallError:
                 wait_time = random.random() * self.RETRY_WAIT_TIME
                 logger.debug(f"Error in synth, retrying in {wait_time}s")
                 await asyncio.sleep(wait_time)
                 continue
             else:
-                return response.audio_content
+                return response
         else:
             return None
 
+    async def _synth_worker(self, synth_input: "SynthesisInput") -> Optional[bytes]:
+        response = await self._retry(lambda: self.client.synthesize_speech(
+            input=synth_input,
+            voice=self.voice,
+            audio_config=self.audio_config
+        ))
+        return None if response is None else response.audio_content
+
     async def synth_text(self, text: str) -> bytes:
+        from google.cloud import texttospeech
         response = await self._synth_worker(texttospeech.SynthesisInput(text=text))
         return response, text
 
+    async def synth_ssml(self, ssml: str) -> Tuple[Optional[bytes], List[Tuple[str, float]]]:
+        """Synthesize an SSML input as WAV audio, along with the time (in seconds) of each of its marks."""
+        from google.cloud import texttospeech_v1beta1 as texttospeech
+        if self.beta_client is None:
+            self.beta_client = texttospeech.TextToSpeechAsyncClient.from_service_account_file(
+                str(self.credentials_file))
+        request = texttospeech.SynthesizeSpeechRequest(
+            input=texttospeech.SynthesisInput(ssml=ssml),
+            voice=texttospeech.VoiceSelectionParams(language_code=self.lang, name=self.voice_id),
+            audio_config=texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.LINEAR16),
+            enable_time_pointing=[texttospeech.SynthesizeSpeechRequest.TimepointType.SSML_MARK]
+        )
+        response = await self._retry(lambda: self.beta_client.synthesize_speech(request=request))
+        if response is None:
+            return None, []
+        return response.audio_content, [(timepoint.mark_name, timepoint.time_seconds)
+                                        for timepoint in response.timepoints]
+
+    async def synth_batch(self, sentences: List[str]) -> Tuple[Optional[bytes], List[Tuple[str, float]], List[str]]:
+        """Synthesize many sentences in a single request (see build_ssml)."""
+        audio_bytes, timepoints = await self.synth_ssml(build_ssml(sentences))
+        return audio_bytes, timepoints, sentences
+
 
 class BaseSpeechSynthesisTask:
     MAX_REQUEST_PER_MINUTE = 500
@@ -98,8 +268,11 @@ class BaseSpeechSynthesisTask:
         self.rate_limiter = AsyncLimiter(self.MAX_REQUEST_PER_SECOND, time_period=1)
         self.semaphore = Semaphore(self.MAX_CONCURRENT_REQUEST)
 
-    def store_output(self, audio_bytes: bytes, sentence: str, folder: Path):
-        raise NotImplemented()
+    def output_path(self, sentence: str, folder: Path, extension: str = "ogg") -> Path:
+        raise NotImplementedError
+
+    def store_output(self, audio_bytes: bytes, sentence: str, folder: Path, extension: str = "ogg"):
+        raise NotImplementedError
 
     async def tasks_limiter(self, task: Awaitable[Tuple[bytes, List[str]]]):
         async with self.rate_limiter:
@@ -113,28 +286,78 @@ class BaseSpeechSynthesisTask:
         if test_mode:
             synth_tasks = synth_tasks[:5]
 
-        for synth_task in async_tqdm.as_completed(synth_tasks):
-            audio_bytes, sentence = await synth_task
-            if audio_bytes is None:
-                logger.warning(f"Got none bytes for {sentence}, skipping")
-                raise RuntimeError()
-            self.store_output(audio_bytes, sentence, output_folder)
+        writer = AudioWriter()
+        try:
+            for synth_task in async_tqdm.as_completed(synth_tasks):
+                audio_bytes, sentence = await synth_task
+                if audio_bytes is None:
+                    logger.warning(f"Got none bytes for {sentence}, skipping")
+                    raise RuntimeError()
+                await writer.write(self.output_path(sentence, output_folder), audio_bytes)
+        finally:
+            await writer.close()
+
+    async def run_synth_batched(self, sentences: List[str], synthesizer: GoogleSpeakSynthesizer,
+                                output_folder: Path, batch_size: int, test_mode: bool = False):
+        """
+        Synthesize the sentences by batches of at most batch_size sentences per request, and split
+        the audio of each request into one .wav file per sentence at its SSML marks.
+        """
+        batches = list(pack_sentences(sentences, batch_size))
+        if test_mode:
+            batches = batches[:1]
+        synth_tasks = [self.tasks_limiter(synthesizer.synth_batch(batch)) for batch in batches]
+
+        writer = AudioWriter()
+        try:
+            for synth_task in async_tqdm.as_completed(synth_tasks):
+                audio_bytes, timepoints, batch = await synth_task
+                if audio_bytes is None:
+                    logger.warning(f"Got none bytes for a batch of {len(batch)} sentences, skipping")
+                    raise RuntimeError()
+                try:
+                    segments = split_audio(audio_bytes, timepoints, len(batch))
+                except ValueError as error:
+                    if len(batch) == 1:
+                        raise RuntimeError(f"Could not split the audio of {batch[0]}: {error}")
+                    # Synthesize the sentences of the batch one by one
+                    logger.warning(f"{error}, synthesizing the {len(batch)} sentences of the batch separately")
+                    segments = []
+                    for sentence in batch:
+                        audio_bytes, timepoints, _ = await self.tasks_limiter(synthesizer.synth_batch([sentence]))
+                        if audio_bytes is None:
+                            raise RuntimeError(f"Got none bytes for {sentence}")
+                        try:
+                            segments.extend(split_audio(audio_bytes, timepoints, 1))
+                        except ValueError as sentence_error:
+                            raise RuntimeError(f"Could not split the audio of {sentence}: {sentence_error}")
+                for segment, sentence in zip(segments, batch):
+                    await writer.write(self.output_path(sentence, output_folder, "wav"), segment)
+        finally:
+            await writer.close()
 
 
 class BaseCorporaSynthesisTask(BaseSpeechSynthesisTask):
     SYNTH_SUBFOLDER: str
 
-    def __init__(self, no_confirmation: bool = False):
+    def __init__(self, no_confirmation: bool = False, batch_size: Optional[int] = None):
+        """
+        If batch_size is given, up to batch_size sentences are synthesized per request
+        and stored as .wav files (see run_synth_batched).
+        """
         super().__init__()
         self.no_confirmation = no_confirmation
+        self.batch_size = batch_size
 
     @staticmethod
-    def get_filename(sentence: str):
-        raise NotImplemented()
+    def get_filename(sentence: str, extension: str = "ogg"):
+        raise NotImplementedError
+
+    def output_path(self, sentence: str, folder: Path, extension: str = "ogg") -> Path:
+        return folder / Path(self.get_filename(sentence, extension))
 
-    def store_output(self, audio_bytes: bytes, sentence: str, folder: Path):
-        with open(folder / Path(self.get_filename(sentence)), "wb") as file:
-            file.write(audio_bytes)
+    def store_output(self, audio_bytes: bytes, sentence: str, folder: Path, extension: str = "ogg"):
+        write_atomically([(self.output_path(sentence, folder, extension), audio_bytes)])
 
     def init_synthesizers(self, credentials_path) -> List[GoogleSpeakSynthesizer]:
         lang = "en-US"
@@ -149,8 +372,8 @@ class BaseCorporaSynthesisTask(BaseSpeechSynthesisTask):
             yield [e for e in group if e is not None]
 
     @staticmethod
-    def get_filename(sentence: str):
-        return f"{sentence.replace(' ', '_').replace('.', '')}.ogg"
+    def get_filename(sentence: str, extension: str = "ogg"):
+        return f"{sentence.replace(' ', '_').replace('.', '')}.{extension}"
 
     def get_sentences(self, input_file: Path, test_mode: bool = False) -> Set[str]:
         sentences = pd.read_csv(input_file, sep="\t", header=None)
@@ -179,11 +402,15 @@ class BaseCorporaSynthesisTask(BaseSpeechSynthesisTask):
             audio_folder = synth_folder / Path(synth.voice_id)
             if not audio_folder.exists():
                 continue
-            elif not list(audio_folder.iterdir()):
+            # Files of an interrupted run that were not completely written
+            for tmp_path in audio_folder.glob(f"*{TMP_SUFFIX}"):
+                tmp_path.unlink()
+            if not list(audio_folder.iterdir()):
                 continue
             synth_sentences[synth] = [
                 sentence for sentence in sentences
-                if not (audio_folder / Path(self.get_filename(sentence))).exists()
+                if not any((audio_folder / Path(self.get_filename(sentence, extension))).exists()
+                           for extension in AUDIO_EXTENSIONS)
             ]
             logger.info(f"{len(sentences) - len(synth_sentences[synth])} sentences "
                         f"already exist for {synth.voice_id} and won't be synthesized")
@@ -203,7 +430,13 @@ class BaseCorporaSynthesisTask(BaseSpeechSynthesisTask):
                 logger.info(f"For synth with voice id {synth.voice_id}")
                 audio_folder = synth_folder / Path(synth.voice_id)
                 audio_folder.mkdir(parents=True, exist_ok=True)
-                async_tasks = self.run_synth(words_chunk,
-                                             synth,
-                                             audio_folder)
+                if self.batch_size:
+                    async_tasks = self.run_synth_batched(words_chunk,
+                                                         synth,
+                                                         audio_folder,
+                                                         self.batch_size)
+                else:
+                    async_tasks = self.run_synth(words_chunk,
+                                                 synth,
+                                                 audio_folder)
                 loop.run_until_complete(async_tasks)
@@ -0,0 +1,26 @@
+"""This module names the tokenizations of the training corpora, their\
+training files and the n-gram models trained on them, for the scripts\
+that train, evaluate or inspect these models."""
+
+# Tokenization name: (phonemized, tokenized_in_words)
+TOKENIZATIONS = {"orthographic_words": (False, True),
+                    "phonemic_words": (True, True),
+                    "phonemic_phonemes": (True, False)}
+
+# Training file of each tokenization, written by create_training_files.py.
+TRAINING_FILES = {"orthographic_words": "providence_orthographic_tokenized_in_words.txt",
+                    "phonemic_words": "providence_phonemic_tokenized_in_words.txt",
+                    "phonemic_phonemes": "providence_phonemic_tokenized_in_phonemes.txt"}
+
+# Model names used in results/, by n-gram order.
+ORDER_NAMES = {3: "trigram", 5: "fivegram"}
+
+def tokenization_name(phonemized: bool, tokenized_in_words: bool) -> str:
+    """Get the name of the tokenization produced by the preprocessing flags."""
+    if not phonemized :
+        return "orthographic_words"
+    return "phonemic_words" if tokenized_in_words else "phonemic_phonemes"
+
+def model_name(order: int, tokenization: str) -> str:
+    """Name of the n-gram model of an order and a tokenization, e.g. trigram_lm_orthographic_words."""
+    return f"{ORDER_NAMES.get(order, f'{order}gram')}_lm_{tokenization}"
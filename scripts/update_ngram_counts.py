@@ -0,0 +1,333 @@
+"""This script maintains mergeable n-gram counts of the Providence corpus, one\
+set of counts per source csv, and updates the n-gram models from them.
+
+When sessions or children are added to the csvs directory, only the new or\
+changed csvs are cleaned, phonemized and counted. The counts of all the\
+sources are then merged and the models are estimated again from the merged\
+counts, without rewriting the training files.
+
+The counts directory contains:
+
+    manifest.json                          the counted sources and the hash of their csv
+    sources/<csv name>/<tokenization>/     the counts of a source, with its own vocabulary
+    merged/<tokenization>/                 the counts of all the sources
+
+A vocabulary is stored in `vocabulary.txt`, one word per line, and the counts\
+of each order as in `ngram_counts.count_ngrams_external`. The vocabulary of a\
+source lists its words in order of first occurrence, so that the merged\
+vocabulary (words sorted by decreasing frequency, ties in order of first\
+occurrence) is the one `build_vocabulary` gives on the training files.
+"""
+import hashlib
+import json
+import os
+import shutil
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from tokenizations import TOKENIZATIONS, model_name
+from models.ngram_store import SPECIAL_TOKENS, write_ngram_store
+from models.ngram_estimators import NGramCounts, count_ngrams
+from models.ngram_counts import write_counts, load_count_directory, sum_counts
+from models.ngram_lm import ESTIMATORS, estimate_model
+from instrumentation import add_profiling_arguments, profiling, span
+
+MANIFEST_VERSION = 1
+VOCABULARY_FILE = "vocabulary.txt"
+
+def csv_hash(path: Path) -> str :
+    """The sha256 of the content of a file."""
+    digest = hashlib.sha256()
+    with open(path, mode="rb") as input_file :
+        for block in iter(lambda: input_file.read(1 << 20), b"") :
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_vocabulary(directory: Path) -> List[str] :
+    with open(Path(directory) / VOCABULARY_FILE, encoding="utf-8") as vocabulary_file :
+        return vocabulary_file.read().split("\n")[:-1]
+
+def write_vocabulary(vocabulary: Sequence[str], directory: Path) -> None :
+    with open(Path(directory) / VOCABULARY_FILE, mode="w", encoding="utf-8") as vocabulary_file :
+        vocabulary_file.writelines(f"{word}\n" for word in vocabulary)
+
+def source_vocabulary(sentences: Sequence[Sequence[str]]) -> List[str] :
+    """Special tokens first, then the words of the sentences in order of first occurrence."""
+    words = dict.fromkeys(word for sentence in sentences for word in sentence)
+    return SPECIAL_TOKENS + [word for word in words if word not in SPECIAL_TOKENS]
+
+def count_source(csv_file: Path,
+                    out_directory: Path,
+                    ngram_size: int,
+                    adults: Sequence[str],
+                    batch_size: int=2000) -> int :
+    """
+    Clean, phonemize and count the adult utterances of a csv file, as\
+    create_training_files.py does for the training files.
+
+    Parameters
+    ----------
+    - csv_file: Path
+        A csv of the Providence corpus.
+    - out_directory: Path
+        Where the counts of each tokenization are written.
+    - ngram_size: int
+        The maximal order of the counts.
+    - adults: list
+        The speaker roles considered as adults.
+    - batch_size: int
+        The number of utterances phonemized at once.
+
+    Return
+    ------
+    - int:
+        The number of counted utterances.
+    """
+    from preprocessing_tools import Cleaner
+    from create_training_files import read_adult_utterances, tokenize_batch
+    with span("read_csv") as stage :
+        adult_utterances = read_adult_utterances(csv_file, adults)
+        stage.add(len(adult_utterances))
+    with span("clean", items=len(adult_utterances)) :
+        utterances = [utterance for utterance in Cleaner(remove_punctuation=False).clean_many(adult_utterances)
+                        if utterance]
+    lines = ([], [], [])
+    for start in range(0, len(utterances), batch_size) :
+        for tokenization_lines, batch_lines in zip(lines, tokenize_batch(utterances[start:start + batch_size])) :
+            tokenization_lines.extend(batch_lines)
+    for tokenization, tokenization_lines in zip(TOKENIZATIONS, lines) :
+        sentences = [tokens for tokens in map(str.split, tokenization_lines) if tokens]
+        with span("count", items=len(sentences)) :
+            vocabulary = source_vocabulary(sentences)
+            counts = count_ngrams(sentences, vocabulary, ngram_size)
+        directory = out_directory / tokenization
+        directory.mkdir(parents=True, exist_ok=True)
+        write_vocabulary(vocabulary, directory)
+        for order, (ids, order_counts) in enumerate(counts, start=1) :
+            write_counts(ids, order_counts, directory / f"order_{order}")
+    return len(utterances)
+
+def merge_sources(source_directories: Sequence[Path],
+                    ngram_size: int) -> Tuple[List[str], NGramCounts] :
+    """
+    Merge the counts of several sources of a tokenization: their word ids\
+    are remapped to a common vocabulary and the counts of identical n-grams\
+    are summed.
+
+    Return
+    ------
+    - tuple:
+        The merged vocabulary and, for each order, the sorted ids and counts.
+    """
+    vocabularies = [read_vocabulary(directory) for directory in source_directories]
+    source_counts = [load_count_directory(directory, ngram_size) for directory in source_directories]
+    frequencies = Counter()
+    for vocabulary, counts in zip(vocabularies, source_counts) :
+        unigram_ids, unigram_counts = counts[0]
+        word_counts = np.zeros(len(vocabulary), dtype=np.int64)
+        word_counts[unigram_ids[:, 0]] = unigram_counts
+        # The insertion order of the counter is the order of first occurrence in the corpus.
+        frequencies.update(dict(zip(vocabulary[len(SPECIAL_TOKENS):],
+                                    word_counts[len(SPECIAL_TOKENS):].tolist())))
+    merged_vocabulary = SPECIAL_TOKENS + [word for word, _ in frequencies.most_common()]
+    word_to_id = {word: idx for idx, word in enumerate(merged_vocabulary)}
+    mappings = [np.array([word_to_id[word] for word in vocabulary], dtype=np.uint32)
+                for vocabulary in vocabularies]
+    merged_counts = [sum_counts([(mapping[counts[order - 1][0]], counts[order - 1][1])
+                                    for mapping, counts in zip(mappings, source_counts)],
+                                order)
+                        for order in range(1, ngram_size + 1)]
+    return merged_vocabulary, merged_counts
+
+def load_manifest(counts_directory: Path) -> dict :
+    manifest_path = counts_directory / "manifest.json"
+    if not manifest_path.exists() :
+        return {"version": MANIFEST_VERSION, "sources": {}}
+    with open(manifest_path) as manifest_file :
+        return json.load(manifest_file)
+
+def save_manifest(manifest: dict, counts_directory: Path) -> None :
+    tmp_path = counts_directory / "manifest.json.tmp"
+    with open(tmp_path, mode="w") as manifest_file :
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(tmp_path, counts_directory / "manifest.json")
+
+def update_counts(csvs_directory: str,
+                    counts_directory: str,
+                    ngram_size: int=5,
+                    adults: Sequence[str]=("Mother", "Father"),
+                    batch_size: int=2000,
+                    force: bool=False) -> Dict[str, List[str]] :
+    """
+    Count the new and changed csvs of a directory, forget the removed ones\
+    and merge the counts of all the sources.
+
+    All the sources are counted again if the maximal order or the adult\
+    roles changed since the last update, or if `force` is set.
+
+    Parameters
+    ----------
+    - csvs_directory: str
+        The directory of the Providence csvs.
+    - counts_directory: str
+        The directory of the counts.
+    - ngram_size: int
+        The maximal order of the counts.
+    - adults: list
+        The speaker roles considered as adults.
+    - batch_size: int
+        The number of utterances phonemized at once.
+    - force: bool
+        Whether to count all the sources again.
+
+    Return
+    ------
+    - dict:
+        The names of the 'added', 'changed' and 'removed' csvs.
+    """
+    counts_directory = Path(counts_directory)
+    counts_directory.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(counts_directory)
+    settings = {"version": MANIFEST_VERSION, "ngram_size": ngram_size, "adults": list(adults)}
+    if force or any(manifest.get(key) != value for key, value in settings.items()) :
+        shutil.rmtree(counts_directory / "sources", ignore_errors=True)
+        manifest = dict(settings, sources={})
+    sources = manifest["sources"]
+    csv_files = sorted(Path(csvs_directory).glob("*.csv"))
+    with span("hash", items=len(csv_files)) :
+        hashes = {csv_file.name: csv_hash(csv_file) for csv_file in csv_files}
+    changes = {"added": [name for name in hashes if name not in sources],
+                "changed": [name for name in hashes if name in sources and sources[name]["sha256"] != hashes[name]],
+                "removed": [name for name in sources if name not in hashes]}
+    for name in changes["removed"] :
+        shutil.rmtree(counts_directory / "sources" / name, ignore_errors=True)
+        del sources[name]
+    for csv_file in csv_files :
+        if csv_file.name not in changes["added"] + changes["changed"] :
+            continue
+        print(f"Counting {csv_file.name}...")
+        source_directory = counts_directory / "sources" / csv_file.name
+        tmp_directory = source_directory.with_name(f"{csv_file.name}.tmp")
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        utterances = count_source(csv_file, tmp_directory, ngram_size, adults, batch_size)
+        shutil.rmtree(source_directory, ignore_errors=True)
+        os.replace(tmp_directory, source_directory)
+        sources[csv_file.name] = {"sha256": hashes[csv_file.name], "utterances": utterances}
+        # The manifest is saved after each source, an interrupted update resumes from there.
+        save_manifest(manifest, counts_directory)
+    save_manifest(manifest, counts_directory)
+
+    merged_directory = counts_directory / "merged"
+    if any(changes.values()) or not all((merged_directory / tokenization / VOCABULARY_FILE).exists()
+                                        for tokenization in TOKENIZATIONS) :
+        for tokenization in TOKENIZATIONS :
+            print(f"Merging the counts of {len(sources)} sources ({tokenization})...")
+            with span("merge") :
+                vocabulary, counts = merge_sources([counts_directory / "sources" / name / tokenization
+                                                    for name in sorted(sources)],
+                                                    ngram_size)
+                directory = merged_directory / tokenization
+                directory.mkdir(parents=True, exist_ok=True)
+                write_vocabulary(vocabulary, directory)
+                for order, (ids, order_counts) in enumerate(counts, start=1) :
+                    write_counts(ids, order_counts, directory / f"order_{order}")
+    return changes
+
+def write_models(counts_directory: str,
+                    models_directory: str,
+                    orders: Sequence[int],
+                    estimator: str="stupid_backoff",
+                    alpha: float=0.4,
+                    smooth: float=1e-6) -> List[Path] :
+    """
+    Estimate the models of each tokenization from the merged counts and\
+    write them in the compact binary format, with the names used by the\
+    pipeline (e.g. trigram_lm_orthographic_words.bin).
+
+    Return
+    ------
+    - list:
+        The paths of the models.
+    """
+    manifest = load_manifest(Path(counts_directory))
+    if max(orders) > manifest.get("ngram_size", 0) :
+        raise ValueError(f"The counts go up to order {manifest.get('ngram_size')}, cannot estimate order {max(orders)}.")
+    Path(models_directory).mkdir(parents=True, exist_ok=True)
+    paths = []
+    for tokenization in TOKENIZATIONS :
+        directory = Path(counts_directory) / "merged" / tokenization
+        vocabulary = read_vocabulary(directory)
+        counts = load_count_directory(directory, max(orders))
+        for order in orders :
+            with span("estimate") :
+                tables, metadata = estimate_model(counts[:order], len(vocabulary), estimator, alpha, smooth)
+            path = Path(models_directory) / f"{model_name(order, tokenization)}.bin"
+            with span("write") :
+                write_ngram_store(path, vocabulary, tables, metadata)
+            paths.append(path)
+    return paths
+
+if __name__ == "__main__" :
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument("--csvs_directory",
+                        type=str,
+                        default="data/children_csvs",
+                        help="The directory containing the csv files.")
+    parser.add_argument("--counts_directory",
+                        type=str,
+                        default="data/counts",
+                        help="The directory of the per-source and merged counts.")
+    parser.add_argument("--ngram_size",
+                        type=int,
+                        default=5,
+                        help="The maximal order of the counts.")
+    parser.add_argument("--batch_size",
+                        type=int,
+                        default=2000,
+                        help="The number of utterances phonemized at once.")
+    parser.add_argument("--force",
+                        action="store_true",
+                        help="Count all the sources again.")
+    parser.add_argument("--models_directory",
+                        type=str,
+                        default=None,
+                        help="If given, estimate the models from the merged counts and write them there.")
+    parser.add_argument("--orders",
+                        type=int,
+                        nargs="+",
+                        default=[3, 5],
+                        help="The orders of the models.")
+    parser.add_argument("--estimator",
+                        choices=ESTIMATORS,
+                        default="stupid_backoff",
+                        help="The estimator of the models.")
+    parser.add_argument("--alpha",
+                        type=float,
+                        default=0.4,
+                        help="The backoff penalty of the stupid backoff models.")
+    parser.add_argument("--smooth",
+                        type=float,
+                        default=1e-6,
+                        help="The probability of unknown words of the stupid backoff models.")
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    if max(args.orders) > args.ngram_size :
+        parser.error("The orders of the models cannot exceed --ngram_size.")
+
+    with profiling(args.profile, args.cprofile) :
+        changes = update_counts(args.csvs_directory,
+                                args.counts_directory,
+                                args.ngram_size,
+                                batch_size=args.batch_size,
+                                force=args.force)
+        print(", ".join(f"{len(names)} {change}" for change, names in changes.items()) + " sources.")
+        if args.models_directory :
+            for path in write_models(args.counts_directory,
+                                        args.models_directory,
+                                        args.orders,
+                                        args.estimator,
+                                        args.alpha,
+                                        args.smooth) :
+                print(f"Model saved to {path}")
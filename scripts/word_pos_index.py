@@ -0,0 +1,151 @@
+"""Persistent index of the part-of-speech statistics of the CHILDES words.
+
+The index is a SQLite database with one row per (word, POS tag, speaker role)
+and its number of occurrences, so that word candidates can be queried with
+any POS set, probability threshold or speaker filter without reading the
+transcripts again.
+"""
+import itertools
+import sqlite3
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE counts (word TEXT NOT NULL,
+                     pos TEXT NOT NULL,
+                     speaker_role TEXT NOT NULL,
+                     count INTEGER NOT NULL,
+                     PRIMARY KEY (word, pos, speaker_role)) WITHOUT ROWID;
+CREATE INDEX counts_speaker_role ON counts (speaker_role);
+CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def read_tokens(input_file):
+    """
+    Read the transcripts and return one row per token with its word (lowercased stem),
+    its POS tag and the role of its speaker. Utterances whose stem or POS is missing,
+    or whose number of POS tags differs from their number of words, are dropped.
+    """
+    data = pd.read_csv(input_file, usecols=['stem', 'part_of_speech', 'speaker_role'])
+    len1 = len(data)
+    data = data.dropna(axis=0, how='any', subset=['stem', 'part_of_speech'])
+    len2 = len(data)
+    print("Lost %.1f %% data when excluding items for which the number of POS or stem is NA." % (100 - len2 * 100 / len1))
+    stem = [s.lower().split(' ') for s in data.stem]
+    pos = [p.split(' ') for p in data.part_of_speech]
+    aligned = [len(s) == len(p) for s, p in zip(stem, pos)]
+    print("Lost %.1f %% data when excluding items for which the number of POS is different from the number of words"
+          % (100 - sum(aligned) * 100 / len2))
+    stem = [s for s, keep in zip(stem, aligned) if keep]
+    pos = [p for p, keep in zip(pos, aligned) if keep]
+    speaker_role = data.speaker_role.fillna('').values[np.array(aligned, dtype=bool)]
+    return pd.DataFrame({'word': list(itertools.chain.from_iterable(stem)),
+                         'pos': list(itertools.chain.from_iterable(pos)),
+                         'speaker_role': np.repeat(speaker_role, [len(s) for s in stem])})
+
+
+def build_index(input_file, index_path):
+    """
+    Count the tokens of the transcripts by (word, POS tag, speaker role) and store the
+    counts in a new SQLite index.
+    """
+    tokens = read_tokens(input_file)
+    counts = tokens.groupby(['word', 'pos', 'speaker_role'], sort=False).size().reset_index(name='count')
+    index_path = Path(index_path)
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = index_path.with_name(index_path.name + '.tmp')
+    if tmp_path.exists():
+        tmp_path.unlink()
+    with sqlite3.connect(str(tmp_path)) as connection:
+        connection.executescript(SCHEMA)
+        connection.executemany('INSERT INTO counts VALUES (?, ?, ?, ?)',
+                               ((word, pos, role, int(count))
+                                for word, pos, role, count in counts.itertuples(index=False, name=None)))
+        connection.executemany('INSERT INTO metadata VALUES (?, ?)',
+                               [('source', str(input_file)),
+                                ('source_size', str(Path(input_file).stat().st_size)),
+                                ('source_mtime', str(Path(input_file).stat().st_mtime))])
+    connection.close()
+    # The index only replaces a previous one once it is complete.
+    tmp_path.replace(index_path)
+    print("Indexed %d tokens of %d words." % (counts['count'].sum(), counts.word.nunique()))
+
+
+def is_up_to_date(index_path, input_file):
+    """Whether the index exists and was built from the current version of the transcripts."""
+    if not Path(index_path).exists():
+        return False
+    with sqlite3.connect(str(index_path)) as connection:
+        metadata = dict(connection.execute('SELECT key, value FROM metadata'))
+    connection.close()
+    stat = Path(input_file).stat()
+    return metadata.get('source_size') == str(stat.st_size) and metadata.get('source_mtime') == str(stat.st_mtime)
+
+
+def _in_clause(column, values):
+    """Build a parameterized `column IN (...)` clause."""
+    return '%s IN (%s)' % (column, ', '.join('?' * len(values))), list(values)
+
+
+def query_candidates(index_path, pos_tags, threshold, speaker_roles=None, exclude_roles=None,
+                     exclude_words=(), n_to_keep=None):
+    """
+    Find the words whose probability of having one of the given POS tags is greater than
+    the threshold, sorted by decreasing frequency.
+
+    Parameters
+    ----------
+    - index_path: str
+        The index built by `build_index`.
+    - pos_tags: list
+        The POS tags of the category (e.g. ['adj']).
+    - threshold: float
+        Minimal probability that the word has one of the POS tags.
+    - speaker_roles: list
+        Only count the tokens of these speaker roles (default to all).
+    - exclude_roles: list
+        Do not count the tokens of these speaker roles.
+    - exclude_words: list
+        Words to remove from the candidates.
+    - n_to_keep: int
+        Maximal number of candidates (default to all).
+
+    Return
+    ------
+    - pd.DataFrame:
+        The word, freq (frequency among all the counted tokens) and prob columns.
+    """
+    conditions, parameters = [], []
+    if speaker_roles:
+        condition, values = _in_clause('speaker_role', speaker_roles)
+        conditions.append(condition)
+        parameters += values
+    if exclude_roles:
+        condition, values = _in_clause('speaker_role', exclude_roles)
+        conditions.append('NOT ' + condition)
+        parameters += values
+    pos_condition, pos_values = _in_clause('pos', pos_tags)
+    word_condition, word_values = _in_clause('word', exclude_words)
+    query = """
+        WITH words AS (SELECT word,
+                              SUM(count) AS total,
+                              SUM(CASE WHEN %s THEN count ELSE 0 END) AS pos_count
+                       FROM counts %s
+                       GROUP BY word)
+        SELECT word,
+               CAST(total AS REAL) / (SELECT SUM(total) FROM words) AS freq,
+               CAST(pos_count AS REAL) / total AS prob
+        FROM words
+        WHERE CAST(pos_count AS REAL) / total > ? AND NOT %s
+        ORDER BY total DESC, word
+        LIMIT ?
+    """ % (pos_condition,
+           'WHERE ' + ' AND '.join(conditions) if conditions else '',
+           word_condition)
+    parameters = pos_values + parameters + [threshold] + word_values + [-1 if n_to_keep is None else n_to_keep]
+    with sqlite3.connect(str(index_path)) as connection:
+        candidates = pd.read_sql_query(query, connection, params=parameters)
+    connection.close()
+    return candidates
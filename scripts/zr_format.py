@@ -5,8 +5,8 @@ import pandas as pd
 import numpy as np
 import random
 import shutil
-from pydub import AudioSegment
 from tqdm import tqdm
+from instrumentation import add_profiling_arguments, profiling, span
 
 def get_gold(in_folder, subtasks, voices):
     out = pd.DataFrame()
@@ -67,15 +67,33 @@ def split_dev_test(gold, subtask_sizes, dev_prop, dev_voices):
     return dev_gold, test_gold
 
 
+def convert_files(gold, audio_folder, out_folder):
+    """
+    Convert the audio files of a gold split to 16kHz mono .wav files: the .ogg files
+    of synthesize_sentences.py, or the .wav files of its batched mode.
+    """
+    from pydub import AudioSegment
+    for filename, subtask in tqdm(zip(gold['filename'], gold['type'])):
+        voice = filename.split('_')[-1]
+        filename = '_'.join(filename.split('_')[:-1])
+        input_file = audio_folder / subtask / voice / (filename + '.ogg')
+        if not input_file.exists():
+            input_file = input_file.with_suffix('.wav')
+        output_file = out_folder / (filename + '_' + voice + '.wav')
+        audio = AudioSegment.from_file(input_file).set_frame_rate(16000).set_channels(1)
+        audio.export(output_file, format='wav')
+
+
 def main(argv):
     parser = argparse.ArgumentParser(description='This scripts mimics zerospeech 2021 format '
                                                  'and split into dev and test sets.')
     parser.add_argument('--input', type=str, default='data/synth',
-                        help='Path where to find the .ogg files that have been synthetized.')
+                        help='Path where to find the .ogg (or .wav) files that have been synthetized.')
     parser.add_argument('--sentences', type=str, default='data/tasks',
                         help='Where to find the sentences (textual version).')
     parser.add_argument('--out', type=str, default='data/zr_format',
                         help='Path where the output will be stored.')
+    add_profiling_arguments(parser)
     args = parser.parse_args(argv)
     args.input = Path(args.input)
     args.sentences = Path(args.sentences)
@@ -84,41 +102,35 @@ def main(argv):
     (args.out / 'syntactic' / 'dev').mkdir(parents=True, exist_ok=True)
     (args.out / 'syntactic' / 'test').mkdir(parents=True, exist_ok=True)
 
-    voices = ['en-US-Wavenet-A', 'en-US-Wavenet-B', 'en-US-Wavenet-C', 'en-US-Wavenet-D', 'en-US-Wavenet-E',
-              'en-US-Wavenet-F', 'en-US-Wavenet-G', 'en-US-Wavenet-H', 'en-US-Wavenet-I', 'en-US-Wavenet-J']
-    subtasks = ['adj_noun_order', 'anaphor_number_agreement', 'noun_verb_agreement',
-                'anaphor_gender_agreement', 'determiner_noun_agreement', 'noun_verb_order']
-
-    # 1) Create gold file, in a ZR-2021-like format
-    gold_data = get_gold(args.sentences, subtasks, voices)
-
-    # 2) Split into dev & test
-    subtasks_sizes = [1600, 1000, 2000, 1000, 3600, 1600]
-    dev_prop = 0.2
-    dev_voices = ['en-US-Wavenet-B', 'en-US-Wavenet-I']
-    dev_gold, test_gold = split_dev_test(gold_data, subtasks_sizes, dev_prop, dev_voices)
-
-    # 3) Save gold.csv and copy .wav files
-    dev_gold.to_csv(args.out / 'syntactic' / 'dev' / 'gold.csv', index=False, sep=',')
-    test_gold.to_csv(args.out / 'syntactic' / 'test' / 'gold.csv', index=False, sep=',')
-
-    print("Converting dev files.")
-    for filename, subtask in tqdm(zip(dev_gold['filename'], dev_gold['type'])):
-        voice = filename.split('_')[-1]
-        filename = '_'.join(filename.split('_')[:-1])
-        input_file = args.input / 'audio' / subtask / voice / (filename + '.ogg')
-        output_file = args.out / 'syntactic' / 'dev' / (filename + '_' + voice + '.wav')
-        ogg = AudioSegment.from_ogg(input_file).set_frame_rate(16000).set_channels(1)
-        ogg.export(output_file, format='wav')
-
-    print("Converting test files.")
-    for filename, subtask in tqdm(zip(test_gold['filename'], test_gold['type'])):
-        voice = filename.split('_')[-1]
-        filename = '_'.join(filename.split('_')[:-1])
-        input_file = args.input / 'audio' / subtask / voice / (filename + '.ogg')
-        output_file = args.out / 'syntactic' / 'test' / (filename + '_' + voice + '.wav')
-        ogg = AudioSegment.from_ogg(input_file).set_frame_rate(16000).set_channels(1)
-        ogg.export(output_file, format='wav')
+    with profiling(args.profile, args.cprofile):
+        voices = ['en-US-Wavenet-A', 'en-US-Wavenet-B', 'en-US-Wavenet-C', 'en-US-Wavenet-D', 'en-US-Wavenet-E',
+                  'en-US-Wavenet-F', 'en-US-Wavenet-G', 'en-US-Wavenet-H', 'en-US-Wavenet-I', 'en-US-Wavenet-J']
+        subtasks = ['adj_noun_order', 'anaphor_number_agreement', 'noun_verb_agreement',
+                    'anaphor_gender_agreement', 'determiner_noun_agreement', 'noun_verb_order']
+
+        # 1) Create gold file, in a ZR-2021-like format
+        with span('gold') as stage:
+            gold_data = get_gold(args.sentences, subtasks, voices)
+            stage.add(len(gold_data))
+
+        # 2) Split into dev & test
+        subtasks_sizes = [1600, 1000, 2000, 1000, 3600, 1600]
+        dev_prop = 0.2
+        dev_voices = ['en-US-Wavenet-B', 'en-US-Wavenet-I']
+        with span('split', items=len(gold_data)):
+            dev_gold, test_gold = split_dev_test(gold_data, subtasks_sizes, dev_prop, dev_voices)
+
+        # 3) Save gold.csv and copy .wav files
+        dev_gold.to_csv(args.out / 'syntactic' / 'dev' / 'gold.csv', index=False, sep=',')
+        test_gold.to_csv(args.out / 'syntactic' / 'test' / 'gold.csv', index=False, sep=',')
+
+        print("Converting dev files.")
+        with span('convert dev', items=len(dev_gold)):
+            convert_files(dev_gold, args.input / 'audio', args.out / 'syntactic' / 'dev')
+
+        print("Converting test files.")
+        with span('convert test', items=len(test_gold)):
+            convert_files(test_gold, args.input / 'audio', args.out / 'syntactic' / 'test')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+# The scripts import each other as top-level modules, and the benchmarks
+# provide local stand-ins of external services (e.g. fake_tts).
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'scripts'))
+sys.path.insert(0, str(ROOT / 'benchmarks'))
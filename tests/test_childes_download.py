@@ -0,0 +1,127 @@
+"""Tests of the chunked CHILDES downloads, with a local stand-in for the database."""
+from functools import partial
+import pandas as pd
+import pytest
+from childes_download import chunk_filename, concatenate_csvs, download_chunks, download_table
+
+CORPORA = ['Brown', 'Providence', 'Bates/Free']
+
+
+def fake_table(corpus):
+    """The rows of the stand-in table for a corpus."""
+    n_rows = len(corpus) + 2
+    return pd.DataFrame({'corpus_name': [corpus] * n_rows,
+                         'gloss': ['%s utterance %d' % (corpus, idx) for idx in range(n_rows)]})
+
+
+def fake_fetch(calls_path, failing, table, corpus):
+    """Stand-in for `fetch_table`: logs each call and fails for the corpora of `failing`."""
+    with open(calls_path, 'a') as calls_file:
+        calls_file.write(corpus + '\n')
+    if corpus in failing:
+        raise ConnectionError('lost connection while fetching %s' % corpus)
+    return fake_table(corpus)
+
+
+def fetched(calls_path):
+    if not calls_path.exists():
+        return []
+    return sorted(calls_path.read_text().split())
+
+
+@pytest.fixture
+def chunks():
+    return {corpus: {'corpus': corpus} for corpus in CORPORA}
+
+
+def test_download_chunks_writes_a_checkpoint_per_chunk(tmp_path, chunks):
+    calls = tmp_path / 'calls.txt'
+    paths = download_chunks(partial(fake_fetch, calls, (), 'utterances'), chunks, tmp_path / 'chunks')
+    assert paths == [tmp_path / 'chunks' / chunk_filename(corpus) for corpus in CORPORA]
+    for corpus, path in zip(CORPORA, paths):
+        pd.testing.assert_frame_equal(pd.read_csv(path), fake_table(corpus))
+    assert not list((tmp_path / 'chunks').glob('*.tmp'))
+    assert fetched(calls) == sorted(CORPORA)
+
+
+def test_download_table_concatenates_the_chunks(tmp_path, chunks):
+    out_path = tmp_path / 'utterances.csv'
+    download_table('utterances', chunks, out_path, tmp_path / 'chunks',
+                   fetch=partial(fake_fetch, tmp_path / 'calls.txt', ()))
+    expected = pd.concat([fake_table(corpus) for corpus in CORPORA], ignore_index=True)
+    pd.testing.assert_frame_equal(pd.read_csv(out_path), expected)
+    assert not (tmp_path / 'chunks').exists()
+
+
+def test_download_table_skips_an_existing_output(tmp_path, chunks):
+    calls = tmp_path / 'calls.txt'
+    out_path = tmp_path / 'utterances.csv'
+    out_path.write_text('corpus_name,gloss\n')
+    download_table('utterances', chunks, out_path, tmp_path / 'chunks', fetch=partial(fake_fetch, calls, ()))
+    assert fetched(calls) == []
+    assert out_path.read_text() == 'corpus_name,gloss\n'
+
+
+def test_download_resumes_after_a_failed_chunk(tmp_path, chunks):
+    calls = tmp_path / 'calls.txt'
+    out_path = tmp_path / 'utterances.csv'
+    chunks_directory = tmp_path / 'chunks'
+    with pytest.raises(RuntimeError, match='Providence'):
+        download_table('utterances', chunks, out_path, chunks_directory, keep_chunks=True,
+                       fetch=partial(fake_fetch, calls, ('Providence',)))
+    assert not out_path.exists()
+    assert sorted(path.name for path in chunks_directory.iterdir()) \
+        == sorted(chunk_filename(corpus) for corpus in CORPORA if corpus != 'Providence')
+
+    calls.unlink()
+    download_table('utterances', chunks, out_path, chunks_directory, keep_chunks=True,
+                   fetch=partial(fake_fetch, calls, ()))
+    assert fetched(calls) == ['Providence']
+    expected = pd.concat([fake_table(corpus) for corpus in CORPORA], ignore_index=True)
+    pd.testing.assert_frame_equal(pd.read_csv(out_path), expected)
+    assert (chunks_directory / chunk_filename('Brown')).exists()
+
+
+def test_concatenate_csvs_streams_the_rows_under_one_header(tmp_path):
+    paths = []
+    for idx in range(3):
+        paths.append(tmp_path / ('chunk%d.csv' % idx))
+        paths[-1].write_text('a,b\n%d,x\n%d,y\n' % (2 * idx, 2 * idx + 1))
+    concatenate_csvs(paths, tmp_path / 'out.csv')
+    assert (tmp_path / 'out.csv').read_text() == 'a,b\n0,x\n1,y\n2,x\n3,y\n4,x\n5,y\n'
+
+
+def test_concatenate_csvs_refuses_different_headers(tmp_path):
+    (tmp_path / 'first.csv').write_text('a,b\n1,2\n')
+    (tmp_path / 'second.csv').write_text('a,c\n3,4\n')
+    with pytest.raises(ValueError, match='header'):
+        concatenate_csvs([tmp_path / 'first.csv', tmp_path / 'second.csv'], tmp_path / 'out.csv')
+    assert not (tmp_path / 'out.csv').exists()
+    assert not (tmp_path / 'out.csv.tmp').exists()
+
+
+def fake_database(table, **filters):
+    """Stand-in for `fetch_table` serving every table of a small collection."""
+    if table == 'corpora':
+        return pd.DataFrame({'corpus_name': CORPORA})
+    return pd.DataFrame({'table': [table] * 2, 'corpus': [filters['corpus']] * 2,
+                         'target_child': [filters.get('target_child', '')] * 2})
+
+
+def test_download_transcript_writes_every_table(tmp_path):
+    from download_transcript import main
+    main(['--out', str(tmp_path)], fetch=fake_database)
+    assert sorted(path.name for path in tmp_path.iterdir()) \
+        == ['sentences.csv', 'tokens.csv', 'transcripts.csv', 'types.csv']
+    sentences = pd.read_csv(tmp_path / 'sentences.csv')
+    assert list(sentences['corpus']) == [corpus for corpus in CORPORA for _ in range(2)]
+    assert set(sentences['table']) == {'utterances'}
+    assert list(pd.read_csv(tmp_path / 'tokens.csv')['corpus']) == ['Brown', 'Brown']
+
+
+def test_downloads_children_csvs_writes_a_csv_per_child(tmp_path):
+    from download_providence_csvs import CHILDREN, downloads_children_csvs
+    downloads_children_csvs(tmp_path, fetch=fake_database)
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(child + '.csv' for child in CHILDREN)
+    william = pd.read_csv(tmp_path / 'William.csv', index_col=0)
+    assert list(william['target_child']) == ['William', 'William']
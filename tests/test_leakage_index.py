@@ -0,0 +1,47 @@
+"""Tests of the leakage index of the task sentences in the training corpora."""
+import json
+import pytest
+from leakage_index import INDEX_VERSION, build_index, check_sentences, check_tasks, load_index
+
+CORPUS = ['the good mom sees herself', 'look at the dog', 'where is the big ball']
+
+
+@pytest.fixture
+def train_file(tmp_path):
+    path = tmp_path / 'train.txt'
+    path.write_text(''.join(sentence + '\n' for sentence in CORPUS))
+    return path
+
+
+def test_casefolded_index_finds_capitalized_sentences(tmp_path, train_file):
+    build_index(str(train_file), tmp_path / 'index', orders=(3,), casefold=True)
+    found = check_sentences([['The', 'good', 'mom', 'sees', 'herself'], ['The', 'good', 'mom'],
+                             ['The', 'good', 'dad']],
+                            load_index(tmp_path / 'index'), casefold=True)
+    assert list(found['exact']) == [True, False, False]
+    assert list(found['3gram']) == [True, True, False]
+
+
+def test_index_is_case_sensitive_without_casefold(tmp_path, train_file):
+    build_index(str(train_file), tmp_path / 'index', orders=(3,))
+    found = check_sentences([['The', 'good', 'mom'], ['the', 'good', 'mom']], load_index(tmp_path / 'index'))
+    assert list(found['3gram']) == [False, True]
+
+
+def test_index_is_built_again_when_the_casefolding_changes(tmp_path, train_file):
+    assert build_index(str(train_file), tmp_path / 'index', orders=(3,))['casefold'] is False
+    metadata = build_index(str(train_file), tmp_path / 'index', orders=(3,), casefold=True)
+    assert metadata['casefold'] is True and metadata['version'] == INDEX_VERSION
+    with open(tmp_path / 'index' / 'index.json') as metadata_file:
+        assert json.load(metadata_file)['casefold'] is True
+
+
+def test_check_tasks_casefolds_the_task_sentences_of_a_casefolded_index(tmp_path, train_file):
+    pytest.importorskip('pylangacq')
+    build_index(str(train_file), tmp_path / 'index', orders=(3,), casefold=True)
+    tasks = {'anaphor': [('The good mom sees herself.', 'The good mom sees himself.'),
+                         ('The big dog sees itself.', 'The big dog sees herself.')]}
+    pairs = check_tasks(tasks, {'orthographic_words': str(tmp_path / 'index')}, filter_on='exact')
+    assert list(pairs['real_exact']) == [True, False]
+    assert list(pairs['modified_3gram']) == [True, False]
+    assert list(pairs['leaked']) == [True, False]
@@ -0,0 +1,62 @@
+"""Tests of the text cleaning against outputs of the original cleaning functions."""
+import pytest
+
+pytest.importorskip('pylangacq')
+import preprocessing_tools
+from preprocessing_tools import Cleaner, check_cleaner
+
+# CHAT utterances and their cleaning by the original chain of functions
+# (pylangacq 0.16.2): without punctuation removal, as for the training
+# files, and with it, as for the task sentences.
+BASELINE = [
+    ("what's that ?", "what's that ?", 'whats that'),
+    ('ice_cream', 'ice cream', 'icecream'),
+    ('do you want some apple+juice ?', 'do you want some apple juice ?', 'do you want some applejuice'),
+    ('<you know> [/] you know', 'you know', 'you know you know'),
+    ('he goed [: went] home', 'he went home', 'he goed went home'),
+    ('&=laughs look at the doggie !', 'look at the doggie !', 'laughs look at the doggie'),
+    ("xxx mommy's here", "mommy's here", 'mommys here'),
+    ("(be)cause it's raining .", "(be)cause it's raining .", 'because its raining'),
+    ('oh_my_goodness !', 'oh my goodness !', 'ohmygoodness'),
+    ('that [!] is mine', 'that is mine', 'that is mine'),
+    ('movement[?]', 'movement', 'movement'),
+    ('I  want   that', 'I want that', 'I want that'),
+    ('say “please” , sweetie', 'say please , sweetie', 'say please sweetie'),
+    ('what (.) is that', 'what is that', 'what is that'),
+    ('0is it a cow ?', '0is it a cow ?', '0is it a cow'),
+    ('+" he said so', 'he said so', 'he said so'),
+    ("don't touch &-um the oven", "don't touch the oven", 'dont touch um the oven'),
+    ('yyy', '', ''),
+    ('the dog [= Rover] barked', 'the dog barked', 'the dog Rover barked'),
+    ('no no no [x 3]', 'no no no', 'no no no x 3'),
+    ('mama@f', 'mama@f', 'mamaf'),
+    ('a', 'a', 'a'),
+    ('', '', ''),
+]
+UTTERANCES = [utterance for utterance, _, _ in BASELINE]
+
+
+def test_cleaner_matches_the_baseline_outputs():
+    assert Cleaner(remove_punctuation=False).clean_many(UTTERANCES) \
+        == [cleaned for _, cleaned, _ in BASELINE]
+    assert Cleaner(remove_punctuation=True).clean_many(UTTERANCES) \
+        == [cleaned for _, _, cleaned in BASELINE]
+
+
+def test_cleaner_collapses_the_spaces_left_by_separators():
+    assert Cleaner(remove_punctuation=False).clean('ice_ cream') == 'ice  cream'
+    assert Cleaner(remove_punctuation=False, collapse_spaces=True).clean('ice_ cream') == 'ice cream'
+
+
+@pytest.mark.parametrize('remove_punctuation', [False, True])
+@pytest.mark.parametrize('collapse_spaces', [False, True])
+def test_check_cleaner_finds_no_mismatch(remove_punctuation, collapse_spaces):
+    assert check_cleaner(UTTERANCES + ['ice_ cream'], remove_punctuation, collapse_spaces) == []
+
+
+def test_check_cleaner_detects_a_regression(monkeypatch):
+    # A cleaner that stops splitting multiword expressions.
+    monkeypatch.setattr(preprocessing_tools, 'SEPARATORS_TABLE', str.maketrans('', ''))
+    assert check_cleaner(UTTERANCES, remove_punctuation=False) \
+        == [UTTERANCES.index('ice_cream'), UTTERANCES.index('do you want some apple+juice ?'),
+            UTTERANCES.index('oh_my_goodness !')]
@@ -0,0 +1,97 @@
+"""Tests of the batched synthesis, against the synthetic speech of fake_tts."""
+import io
+import wave
+import pytest
+
+pytest.importorskip('aiolimiter')
+from fake_tts import FRAME_RATE, SECONDS_PER_CHARACTER, FakeCorporaSynthesisTask, FakeSynthesizer, synthetic_speech
+from tasks.synthetizer import MAX_SSML_BYTES, SSML_BREAK_MS, build_ssml, pack_sentences, split_audio
+
+SENTENCES = ['the dog sees himself', 'a cat', 'the good mom is sleeping in the big house', 'no']
+
+
+def duration(wav_bytes):
+    with wave.open(io.BytesIO(wav_bytes)) as audio:
+        return audio.getnframes() / audio.getframerate()
+
+
+def expected_duration(idx, sentence):
+    """The tone of the sentence, with half a break before (except for the first one) and after."""
+    padding = SSML_BREAK_MS / 2000
+    return int(len(sentence) * SECONDS_PER_CHARACTER * FRAME_RATE) / FRAME_RATE + padding * (2 if idx else 1)
+
+
+def assert_segments(segments, sentences):
+    assert len(segments) == len(sentences)
+    for idx, (segment, sentence) in enumerate(zip(segments, sentences)):
+        assert duration(segment) == pytest.approx(expected_duration(idx, sentence), abs=2 / FRAME_RATE)
+
+
+def test_split_audio_cuts_each_sentence_between_its_marks():
+    audio, timepoints = synthetic_speech(build_ssml(SENTENCES))
+    assert_segments(split_audio(audio, timepoints, len(SENTENCES)), SENTENCES)
+
+
+def test_build_ssml_escapes_the_sentences():
+    sentences = ['salt & pepper', 'one < two', 'the cat']
+    ssml = build_ssml(sentences)
+    assert 'salt &amp; pepper' in ssml and 'one &lt; two' in ssml
+    audio, timepoints = synthetic_speech(ssml)
+    assert_segments(split_audio(audio, timepoints, len(sentences)), sentences)
+
+
+def test_pack_sentences_fits_batches_in_max_ssml_bytes():
+    sentences = ['the sentence number %d is a bit longer than the others, café' % idx for idx in range(300)]
+    batches = list(pack_sentences(sentences, max_sentences=1000))
+    assert len(batches) > 1
+    assert [sentence for batch in batches for sentence in batch] == sentences
+    for batch, next_batch in zip(batches, batches[1:] + [None]):
+        assert len(build_ssml(batch).encode('utf-8')) <= MAX_SSML_BYTES
+        if next_batch is not None:
+            assert len(build_ssml(batch + next_batch[:1]).encode('utf-8')) > MAX_SSML_BYTES
+
+
+def test_pack_sentences_limits_the_sentences_per_batch():
+    assert [len(batch) for batch in pack_sentences(SENTENCES * 3, max_sentences=5)] == [5, 5, 2]
+
+
+def test_split_audio_reports_missing_marks():
+    audio, timepoints = synthetic_speech(build_ssml(SENTENCES))
+    timepoints = [(name, time) for name, time in timepoints if name != '1_end']
+    with pytest.raises(ValueError, match='1_end'):
+        split_audio(audio, timepoints, len(SENTENCES))
+
+
+class MarklessSynthesizer(FakeSynthesizer):
+    """Drops the end marks of the requests of more than max_sentences sentences."""
+    def __init__(self, voice_id, max_sentences):
+        super().__init__(voice_id, b'')
+        self.max_sentences = max_sentences
+
+    async def synth_ssml(self, ssml):
+        audio, timepoints = await super().synth_ssml(ssml)
+        if sum(1 for name, _ in timepoints if name.endswith('_end')) > self.max_sentences:
+            timepoints = [(name, time) for name, time in timepoints if not name.endswith('_end')]
+        return audio, timepoints
+
+
+def synthesize(tmp_path, max_sentences):
+    task_file = tmp_path / 'task.csv'
+    task_file.write_text(''.join('%s\t%s\n' % pair for pair in zip(SENTENCES[::2], SENTENCES[1::2])))
+    task = FakeCorporaSynthesisTask(['voice'], batch_size=10)
+    task.synthesizers = [MarklessSynthesizer('voice', max_sentences)]
+    task.run(task_file, tmp_path / 'audio', None, False)
+    return task
+
+
+def test_batched_synthesis_falls_back_to_one_sentence_per_request(tmp_path):
+    task = synthesize(tmp_path, max_sentences=1)
+    assert task.synthesizers[0].requests == 1 + len(SENTENCES)
+    for sentence in SENTENCES:
+        path = tmp_path / 'audio' / 'voice' / task.get_filename(sentence, 'wav')
+        assert duration(path.read_bytes()) == pytest.approx(expected_duration(0, sentence), abs=2 / FRAME_RATE)
+
+
+def test_batched_synthesis_fails_without_marks(tmp_path):
+    with pytest.raises(RuntimeError, match='Could not split the audio'):
+        synthesize(tmp_path, max_sentences=0)